@@ -1,2 +1,38 @@
 #!/bin/sh -l
-python /src/main.py --openai_api_key "$1" --github_token "$2" --github_pr_id "$3" --google_gemini_token "$4" --ignore_files_with_content "$5" --ignore_files_in_paths "$6" --instructions "$7" --google_ai_model "$8" --google_project_name "$9"
+python /src/main.py \
+  --openai_api_key "$1" \
+  --github_token "$2" \
+  --github_pr_id "$3" \
+  --google_gemini_token "$4" \
+  --ignore_files_with_content "$5" \
+  --ignore_files_in_paths "$6" \
+  --instructions "$7" \
+  --google_ai_model "$8" \
+  --google_project_name "$9" \
+  --max_workers "${10}" \
+  --async_mode "${11}" \
+  --google_max_connections "${12}" \
+  --google_keepalive_expiry "${13}" \
+  --github_api "${14}" \
+  --walk_commits "${15}" \
+  --bulk_content_download "${16}" \
+  --max_file_changes "${17}" \
+  --path_match_style "${18}" \
+  --chunk_large_files "${19}" \
+  --context_mode "${20}" \
+  --context_lines "${21}" \
+  --include_signatures "${22}" \
+  --review_cache_dir "${23}" \
+  --review_cache_max_size_mb "${24}" \
+  --shared_review_cache "${25}" \
+  --shared_review_cache_backend "${26}" \
+  --shared_review_cache_ttl_hours "${27}" \
+  --incremental "${28}" \
+  --output_mode "${29}" \
+  --ai_requests_per_minute "${30}" \
+  --ai_tokens_per_minute "${31}" \
+  --ai_max_retries "${32}" \
+  --ai_hedge_after_seconds "${33}" \
+  --batch_small_files "${34}" \
+  --batch_max_files "${35}" \
+  --instructions_file "${36}"
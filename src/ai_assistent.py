@@ -1,12 +1,32 @@
-import fnmatch
+import asyncio
+import random
+import re
+import threading
+import time
 from abc import ABC, abstractmethod
-from dataclasses import dataclass
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, replace
 from pathlib import Path
-from typing import List, Optional, Tuple
+from typing import Dict, Iterator, List, Optional, Set, Tuple
 
 from github.IssueComment import IssueComment
 
+from ai_rate_limiter import AiRateLimiter
+from chunking import Chunk, split_in_chunks
+from comment_metadata import (
+    FILE_COMMENT_KIND,
+    SUMMARY_COMMENT_KIND,
+    CommentMetadata,
+    get_prompt_hash,
+    parse_comment_metadata,
+)
+from diff_hunks import build_hunks_context, get_review_position, parse_hunks
 from github_pr import GithubPR
+from instruction_template import FILE_NAME_SLOT, FILE_SUFFIX_SLOT, InstructionTemplate
+from path_matcher import FNMATCH_STYLE, PathMatcher
+from review_cache import ReviewCache
+from token_counter import ApproximateTokenCounter, TokenCounter
 from github.Commit import Commit
 from github.File import File
 
@@ -22,10 +42,82 @@ class LatestFile:
             self._content = gr_pr.get_content_for_file(self.file, self.commit)
         return self._content
 
+
+@dataclass
+class ReviewRequest:
+    instructions: str
+    ai_input: str
+    # Lines of the file sent in the request when it is a chunk of a bigger file
+    start_line: int = 0
+    end_line: int = 0
+
+
 @dataclass
 class FileInstructions:
     file_match: str
-    instructions: str
+    instructions: str = ""
+    # Used with the default header when there are no instructions, see
+    # _generate_file_instructions
+    specifics: str = ""
+    # "full" sends the whole file, "hunks" only the changed lines and their context.
+    # When None the values given to the AiAssistent are used.
+    context_mode: Optional[str] = None
+    context_lines: Optional[int] = None
+
+
+FULL_CONTEXT = "full"
+HUNKS_CONTEXT = "hunks"
+
+# One issue comment per file plus a summary, or a single pull request review with the
+# findings anchored to the changed lines
+COMMENTS_OUTPUT = "comments"
+REVIEW_OUTPUT = "review"
+
+RETRYABLE_STATUS_CODES = (408, 429, 500, 502, 503, 504)
+
+CHUNK_ERROR_RESPONSE = (
+    "Error while generating information for these lines, they are reviewed again "
+    "in the next run."
+)
+
+# Separates the files of a batched request and of its response
+BATCH_FILE_MARKER = "=== FILE: {file} ==="
+BATCH_FILE_MARKER_PATTERN = re.compile(r"^[\s#*`]*=== FILE: (.+?) ===[\s*`]*$")
+
+
+@dataclass
+class ReviewedFile:
+    # A file reviewed in a previous run and not changed since, known only by the
+    # summary comment
+    filename: str
+    sha: str
+    status: str = "unchanged"
+
+
+@dataclass
+class BotComment:
+    # A comment left by a previous run, parsed once
+    comment: IssueComment
+    metadata: CommentMetadata
+    skipped: bool = False
+    # Pull request reviews can't be deleted, they only keep the state of previous runs
+    read_only: bool = False
+
+    @property
+    def kind(self) -> str:
+        return self.metadata.kind
+
+    @property
+    def filename(self) -> str:
+        return self.metadata.file
+
+    @property
+    def sha(self) -> str:
+        return self.metadata.sha
+
+    @property
+    def reviewed_files(self) -> Set[Tuple[str, str]]:
+        return set(self.metadata.files)
 
 
 class AiAssistent(ABC):
@@ -40,9 +132,50 @@ class AiAssistent(ABC):
     _ignore_files_with_content: List[str]
     _ignore_files_in_paths: List[str]
     _file_instructions: List[FileInstructions]
+    _file_instructions_matcher: PathMatcher
+    _instruction_templates: List[InstructionTemplate]
+    # Rendered instructions by (template index, file suffix), for the templates
+    # without a {file_name} slot
+    _rendered_instructions: Dict[Tuple[int, str], str]
+    _ignore_files_in_paths_matcher: PathMatcher
+    _token_counter: TokenCounter
+    _chunk_large_files: bool
+    _context_mode: str
+    _context_lines: int
+    _include_signatures: bool
     _instructions: List[str]
-    _deprecated_comments: List[IssueComment]
+    _deprecated_comments: List[BotComment]
+    _max_workers: int
+    _walk_commits: bool
+    _bulk_content_download: bool
+    _bulk_loaded_refs: Set[str]
+    _max_file_changes: int
+    _review_cache: Optional[ReviewCache]
+    _shared_review_cache: Optional[ReviewCache]
+    _incremental: bool
+    _output_mode: str
+    _rate_limiter: AiRateLimiter
+    _max_retries: int
+    _hedge_after_seconds: float
+    # Caps the AI requests in flight to max_workers, whether they come from the file
+    # workers or from the chunks of a file
+    _request_slots: threading.BoundedSemaphore
+    _async_request_slots: Optional[asyncio.Semaphore]
+    _batch_small_files: bool
+    _batch_max_files: int
+    # Tokens of each instructions text, they are counted for every request
+    _instructions_tokens: Dict[str, int]
+    _model_name: str = ""
     MAX_TOKENS = 0
+    # Part of MAX_TOKENS kept for the answer of the model, the instructions and the
+    # input share the rest
+    RESERVED_OUTPUT_TOKENS = 1024
+    RETRY_BASE_DELAY = 2.0
+    RETRY_MAX_DELAY = 60.0
+    # Files up to this share of the input tokens can be batched, and a batch takes up
+    # to this other share, the rest is left for the batch instructions
+    BATCH_FILE_TOKENS_SHARE = 0.2
+    BATCH_MAX_TOKENS_SHARE = 0.6
 
     def __init__(
         self,
@@ -50,17 +183,93 @@ class AiAssistent(ABC):
         ignore_files_with_content: List[str],
         ignore_files_in_paths: List[str],
         instructions: List[str],
+        max_workers: int = 1,
+        walk_commits: bool = False,
+        bulk_content_download: bool = False,
+        max_file_changes: int = 0,
+        path_match_style: str = FNMATCH_STYLE,
+        chunk_large_files: bool = True,
+        context_mode: str = FULL_CONTEXT,
+        context_lines: int = 10,
+        include_signatures: bool = True,
+        review_cache: Optional[ReviewCache] = None,
+        shared_review_cache: Optional[ReviewCache] = None,
+        incremental: bool = False,
+        output_mode: str = COMMENTS_OUTPUT,
+        requests_per_minute: int = 0,
+        tokens_per_minute: int = 0,
+        max_retries: int = 3,
+        hedge_after_seconds: float = 0,
+        batch_small_files: bool = False,
+        batch_max_files: int = 10,
+        file_instructions: Optional[List[FileInstructions]] = None,
     ) -> None:
         self._github_pr = github_pr
         self._ignore_files_with_content = ignore_files_with_content
         self._ignore_files_in_paths = ignore_files_in_paths
         self._instructions = instructions
-        self._file_instructions = self._generate_file_instructions()
-
-    def _get_header(self) -> str:
-        return f"{self.COMMENT_HEADER}\n#### File: _{{file}}_\n{self.SHA_HEADER} {{sha}} {self.SHA_HEADER_ENDING}\n----\n{{response}}"
+        self._max_workers = max(1, max_workers)
+        self._walk_commits = walk_commits
+        self._bulk_content_download = bulk_content_download
+        self._bulk_loaded_refs = set()
+        self._max_file_changes = max_file_changes
+        self._file_instructions = self._generate_file_instructions(
+            file_instructions or []
+        )
+        # Patterns are compiled once, instead of calling fnmatch for each file and pattern
+        self._file_instructions_matcher = PathMatcher(
+            [instruction.file_match for instruction in self._file_instructions]
+        )
+        self._instruction_templates = [
+            InstructionTemplate(instruction.instructions)
+            for instruction in self._file_instructions
+        ]
+        self._rendered_instructions = {}
+        self._ignore_files_in_paths_matcher = PathMatcher(
+            ignore_files_in_paths, style=path_match_style
+        )
+        self._token_counter = ApproximateTokenCounter()
+        self._chunk_large_files = chunk_large_files
+        self._context_mode = context_mode
+        self._context_lines = context_lines
+        self._include_signatures = include_signatures
+        self._review_cache = review_cache
+        self._shared_review_cache = shared_review_cache
+        self._incremental = incremental
+        self._output_mode = output_mode
+        self._rate_limiter = AiRateLimiter(
+            requests_per_minute=requests_per_minute,
+            tokens_per_minute=tokens_per_minute,
+        )
+        self._max_retries = max_retries
+        self._hedge_after_seconds = hedge_after_seconds
+        self._request_slots = threading.BoundedSemaphore(self._max_workers)
+        self._async_request_slots = None
+        self._batch_small_files = batch_small_files
+        self._batch_max_files = max(1, batch_max_files)
+        self._instructions_tokens = {}
+
+    def _format_file_comment(
+        self,
+        file: File,
+        response: str,
+        instructions: str = "",
+        duration: float = 0.0,
+    ) -> str:
+        metadata = CommentMetadata(
+            kind=FILE_COMMENT_KIND,
+            file=file.filename,
+            sha=file.sha,
+            model=self._model_name,
+            prompt_hash=get_prompt_hash(instructions),
+            duration=duration,
+        )
+        return f"{self.COMMENT_HEADER}\n#### File: _{file.filename}_\n{metadata.to_comment()}\n----\n{response}"
 
-    def _generate_file_instructions(self) -> List[FileInstructions]:
+    def _generate_file_instructions(
+        self, custom_instructions: List[FileInstructions]
+    ) -> List[FileInstructions]:
+        # The custom instructions go first, so they win over the defaults
         header = f"""You are a senior Python developer reviewing a pull request. Follow these guidelines:
 
 1. Add comments for content that is unclear or problematic.
@@ -163,18 +372,554 @@ parameters:
             default_instructions,
         ]
 
-        appended_instructions = "\n This is the file name {file_name}. Put the response in a single file in plain Markdown Github format."
+        # The instructions are the same for every file of a type, so the providers can
+        # cache them as a prompt prefix. The file name goes with the file content.
+        appended_instructions = (
+            "\n Put the response in a single file in plain Markdown Github format."
+        )
         for instruction in result:
             instruction.instructions = (
                 f"{instruction.instructions} {appended_instructions}"
             )
 
-        return result
+        # Custom instructions given as specifics use the same header as the defaults,
+        # the ones with their own instructions are used as they are
+        custom_result = []
+        for instruction in custom_instructions:
+            if not instruction.instructions:
+                instructions_text = header.format(
+                    specifics=instruction.specifics,
+                    specific_instructions=specific_instruction,
+                )
+                instruction = replace(
+                    instruction,
+                    instructions=f"{instructions_text} {appended_instructions}",
+                )
+            custom_result.append(instruction)
+
+        return custom_result + result
 
     @abstractmethod
-    def _generate_comment(self, latest_file: LatestFile, instructions: str) -> str:
+    def _build_ai_input(
+        self, latest_file: LatestFile, file_content: str, patch: str
+    ) -> str:
         pass
 
+    def _get_system_instruction(self, instructions: str) -> str:
+        # What the provider sends as the instructions of each request
+        return instructions
+
+    @abstractmethod
+    def _request_review(self, instructions: str, ai_input: str) -> str:
+        pass
+
+    async def _request_review_async(self, instructions: str, ai_input: str) -> str:
+        # Providers without an async client run the blocking call in a thread
+        return await asyncio.to_thread(self._request_review, instructions, ai_input)
+
+    def _is_retryable_error(self, error: Exception) -> bool:
+        # Throttling, timeouts and server errors are transient, anything else (e.g. a
+        # request that is too long) fails the same way when retried
+        for attribute in ("http_status", "status_code", "code", "status"):
+            status = getattr(error, attribute, None)
+            if isinstance(status, int):
+                return status in RETRYABLE_STATUS_CODES
+        return isinstance(error, (TimeoutError, ConnectionError))
+
+    def _get_retry_delay(self, error: Exception, attempt: int) -> float:
+        headers = getattr(error, "headers", None) or {}
+        try:
+            retry_after = headers.get("retry-after") or headers.get("Retry-After")
+            if retry_after is not None:
+                return min(float(retry_after), self.RETRY_MAX_DELAY)
+        except (AttributeError, ValueError):
+            pass
+        delay = min(self.RETRY_BASE_DELAY * 2**attempt, self.RETRY_MAX_DELAY)
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def _send_review_request(self, instructions: str, ai_input: str) -> str:
+        # Waits for the provider budget and retries transient errors with backoff
+        tokens = self._token_counter.count(instructions + ai_input)
+        attempt = 0
+        while True:
+            self._rate_limiter.acquire(tokens)
+            try:
+                return self._request_review_hedged(instructions, ai_input, tokens)
+            except Exception as e:
+                if attempt >= self._max_retries or not self._is_retryable_error(e):
+                    raise
+                delay = self._get_retry_delay(e, attempt)
+                attempt += 1
+                print(
+                    f"AI request failed ({e}), retry {attempt}/{self._max_retries} "
+                    f"in {delay:.1f}s"
+                )
+                time.sleep(delay)
+
+    async def _send_review_request_async(self, instructions: str, ai_input: str) -> str:
+        tokens = self._token_counter.count(instructions + ai_input)
+        attempt = 0
+        while True:
+            await self._rate_limiter.acquire_async(tokens)
+            if self._async_request_slots is None:
+                self._async_request_slots = asyncio.Semaphore(self._max_workers)
+            try:
+                return await self._request_review_hedged_async(
+                    instructions, ai_input, tokens
+                )
+            except Exception as e:
+                if attempt >= self._max_retries or not self._is_retryable_error(e):
+                    raise
+                delay = self._get_retry_delay(e, attempt)
+                attempt += 1
+                print(
+                    f"AI request failed ({e}), retry {attempt}/{self._max_retries} "
+                    f"in {delay:.1f}s"
+                )
+                await asyncio.sleep(delay)
+
+    def _request_review_hedged(
+        self, instructions: str, ai_input: str, tokens: int
+    ) -> str:
+        # When the request takes longer than hedge_after_seconds a duplicate is sent and
+        # the first successful answer wins, which cuts the tail latency of slow files
+        if not self._hedge_after_seconds:
+            with self._request_slots:
+                return self._request_review(instructions, ai_input)
+
+        executor = ThreadPoolExecutor(max_workers=2)
+
+        def _submit() -> Future:
+            # Each request keeps its slot until it finishes, also when its answer is
+            # ignored, so there are never more than max_workers requests in flight
+            future = executor.submit(self._request_review, instructions, ai_input)
+            future.add_done_callback(lambda _: self._request_slots.release())
+            return future
+
+        try:
+            self._request_slots.acquire()
+            futures = [_submit()]
+            done, _ = wait(futures, timeout=self._hedge_after_seconds)
+            # The duplicate is only sent when a slot is free
+            if not done and self._request_slots.acquire(blocking=False):
+                print(
+                    f"AI request is taking more than {self._hedge_after_seconds}s, "
+                    f"sending a hedged request"
+                )
+                self._rate_limiter.acquire(tokens)
+                futures.append(_submit())
+
+            error: Optional[BaseException] = None
+            pending = set(futures)
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future.exception() is None:
+                        return future.result()
+                    error = future.exception()
+            raise error
+        finally:
+            # The slower request is not waited for, its answer is ignored
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    async def _request_review_hedged_async(
+        self, instructions: str, ai_input: str, tokens: int
+    ) -> str:
+        slots = self._async_request_slots
+        if not self._hedge_after_seconds:
+            async with slots:
+                return await self._request_review_async(instructions, ai_input)
+
+        def _start() -> asyncio.Future:
+            task = asyncio.ensure_future(
+                self._request_review_async(instructions, ai_input)
+            )
+            task.add_done_callback(lambda _: slots.release())
+            return task
+
+        await slots.acquire()
+        tasks = {_start()}
+        done, _ = await asyncio.wait(tasks, timeout=self._hedge_after_seconds)
+        if not done and not slots.locked():
+            print(
+                f"AI request is taking more than {self._hedge_after_seconds}s, "
+                f"sending a hedged request"
+            )
+            # A free slot is taken right away, without waiting
+            await slots.acquire()
+            try:
+                await self._rate_limiter.acquire_async(tokens)
+            except BaseException:
+                slots.release()
+                raise
+            tasks.add(_start())
+
+        error: Optional[BaseException] = None
+        pending = tasks
+        try:
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def _generate_comment(self, latest_file: LatestFile, instructions: str) -> str:
+        print(f"Generating comment for file: {latest_file.file.filename}")
+        started_at = time.perf_counter()
+        response = self._get_cached_review(latest_file, instructions)
+        if response is not None:
+            return self._format_review(latest_file, response, instructions)
+
+        requests, comment = self._prepare_review(latest_file, instructions)
+        if comment is not None:
+            return comment
+
+        if len(requests) == 1:
+            try:
+                response = self._send_review_request(
+                    requests[0].instructions, requests[0].ai_input
+                )
+            except Exception as e:
+                return self._format_review_error(
+                    latest_file, e, instructions, time.perf_counter() - started_at
+                )
+        else:
+            # The chunk requests share the max_workers request slots with the other files
+            with ThreadPoolExecutor(max_workers=self._max_workers) as executor:
+                responses = list(executor.map(self._request_chunk_review, requests))
+            response = self._merge_chunk_reviews(requests, responses)
+            if None in responses:
+                # A failed chunk is retried in the next run instead of being cached
+                return self._format_review(
+                    latest_file,
+                    response,
+                    instructions,
+                    time.perf_counter() - started_at,
+                )
+
+        self._store_review(latest_file, instructions, response)
+        return self._format_review(
+            latest_file, response, instructions, time.perf_counter() - started_at
+        )
+
+    async def _generate_comment_async(
+        self, latest_file: LatestFile, instructions: str
+    ) -> str:
+        print(f"Generating comment for file: {latest_file.file.filename}")
+        started_at = time.perf_counter()
+        response = await asyncio.to_thread(
+            self._get_cached_review, latest_file, instructions
+        )
+        if response is not None:
+            return self._format_review(latest_file, response, instructions)
+
+        requests, comment = await asyncio.to_thread(
+            self._prepare_review, latest_file, instructions
+        )
+        if comment is not None:
+            return comment
+
+        if len(requests) == 1:
+            try:
+                response = await self._send_review_request_async(
+                    requests[0].instructions, requests[0].ai_input
+                )
+            except Exception as e:
+                return self._format_review_error(
+                    latest_file, e, instructions, time.perf_counter() - started_at
+                )
+        else:
+            responses = await asyncio.gather(
+                *[self._request_chunk_review_async(request) for request in requests]
+            )
+            response = self._merge_chunk_reviews(requests, responses)
+            if None in responses:
+                return self._format_review(
+                    latest_file,
+                    response,
+                    instructions,
+                    time.perf_counter() - started_at,
+                )
+
+        await asyncio.to_thread(self._store_review, latest_file, instructions, response)
+        return self._format_review(
+            latest_file, response, instructions, time.perf_counter() - started_at
+        )
+
+    def _get_review_cache_keys(
+        self, latest_file: LatestFile, instructions: str
+    ) -> Iterator[Tuple[ReviewCache, str]]:
+        # The keys are made lazily, the shared one needs the content of the file and
+        # isn't made when the review is found by the blob sha
+        instructions_hash = ReviewCache.get_key(instructions)
+        if self._review_cache is not None:
+            # What the AI sees depends on the context of the file, not only on the
+            # defaults
+            context_mode, context_lines = self._get_review_context(latest_file)
+            # The file is identified by its blob sha, so the key doesn't change with
+            # force-pushes and rebases that keep the same content
+            yield (
+                self._review_cache,
+                ReviewCache.get_key(
+                    latest_file.file.sha,
+                    instructions_hash,
+                    self._model_name,
+                    f"{context_mode}:{context_lines}",
+                ),
+            )
+        if self._shared_review_cache is not None and latest_file.file.patch:
+            # The same change landing in many PRs or repos (dependency bumps, codegen)
+            # is reviewed once. The key is what the AI sees, the whole file or the
+            # hunks with their context, so different files with the same hunk don't
+            # share their reviews.
+            ai_input = self._build_ai_input(
+                latest_file,
+                self._get_review_content(latest_file),
+                latest_file.file.patch,
+            )
+            yield (
+                self._shared_review_cache,
+                ReviewCache.get_key(
+                    "input",
+                    ReviewCache.get_key(ai_input),
+                    instructions_hash,
+                    self._model_name,
+                ),
+            )
+
+    def _get_cached_review(
+        self, latest_file: LatestFile, instructions: str
+    ) -> Optional[str]:
+        for cache, key in self._get_review_cache_keys(latest_file, instructions):
+            try:
+                response = cache.get(key)
+            except Exception as e:
+                print(f"Error while reading the review cache: {e}")
+                continue
+            if response is not None:
+                print(f"{latest_file.file.filename}: Using the cached review")
+                return response
+        return None
+
+    def _store_review(
+        self, latest_file: LatestFile, instructions: str, response: str
+    ) -> None:
+        for cache, key in self._get_review_cache_keys(latest_file, instructions):
+            try:
+                cache.set(key, response)
+            except Exception as e:
+                print(f"Error while saving the review in the cache: {e}")
+
+    def _prepare_review(
+        self, latest_file: LatestFile, instructions: str
+    ) -> Tuple[List[ReviewRequest], Optional[str]]:
+        # Returns the requests to send to the AI, or the final comment when the file
+        # can't be sent to the AI
+        file = latest_file.file
+        file_content = latest_file.get_file_content(self._github_pr)
+        review_content = self._get_review_content(latest_file)
+        # The note about the hunks only applies to this request, the chunks below are
+        # cut from the raw file
+        review_instructions = self._add_context_instructions(latest_file, instructions)
+        ai_input = self._build_ai_input(latest_file, review_content, file.patch)
+
+        tokens = self._get_number_of_tokens_in_content(
+            ai_input, self._get_input_tokens_limit(review_instructions)
+        )
+        if tokens != -1:
+            return [
+                ReviewRequest(instructions=review_instructions, ai_input=ai_input)
+            ], None
+
+        if self._chunk_large_files:
+            requests = self._split_review_in_chunks(
+                latest_file, file_content, instructions
+            )
+            if requests:
+                print(
+                    f"{file.filename}: File is too long, reviewing it in {len(requests)} chunks"
+                )
+                return requests, None
+
+        print(f"File is too long to generate a comment: {file.filename}")
+        return [], self._format_file_comment(
+            file, "File is too long to generate a comment.", instructions
+        )
+
+    def _get_review_content(self, latest_file: LatestFile) -> str:
+        # The content sent to the AI, the whole file or only the changed lines
+        file_content = latest_file.get_file_content(self._github_pr)
+        context_mode, context_lines = self._get_review_context(latest_file)
+        if context_mode != HUNKS_CONTEXT:
+            return file_content
+        return build_hunks_context(
+            file_content,
+            parse_hunks(latest_file.file.patch),
+            context_lines,
+            self._include_signatures,
+        )
+
+    def _add_context_instructions(
+        self, latest_file: LatestFile, instructions: str
+    ) -> str:
+        context_mode, context_lines = self._get_review_context(latest_file)
+        if context_mode != HUNKS_CONTEXT:
+            return instructions
+        return (
+            f"{instructions}\n Only the changed parts of the file are shown, with "
+            f"{context_lines} lines around them. Each line starts with its line number."
+        )
+
+    def _get_review_context(self, latest_file: LatestFile) -> Tuple[str, int]:
+        index = self._file_instructions_matcher.find(latest_file.file.filename)
+        file_instructions = (
+            self._file_instructions[index] if index is not None else None
+        )
+        if file_instructions is None:
+            context_mode = self._context_mode
+            context_lines = self._context_lines
+        else:
+            context_mode = file_instructions.context_mode or self._context_mode
+            context_lines = (
+                file_instructions.context_lines
+                if file_instructions.context_lines is not None
+                else self._context_lines
+            )
+        # Without a patch there are no hunks to show, the whole file is reviewed
+        if latest_file.file.patch is None:
+            context_mode = FULL_CONTEXT
+        return context_mode, context_lines
+
+    def _split_review_in_chunks(
+        self, latest_file: LatestFile, file_content: str, instructions: str
+    ) -> List[ReviewRequest]:
+        def _get_request(chunk: Chunk) -> ReviewRequest:
+            # The chunk note goes after the file, so the instructions stay a stable prefix
+            chunk_note = (
+                f"\nYou are reviewing only the lines {chunk.start_line} to "
+                f"{chunk.end_line} of the file, the rest of the file is not shown.\n"
+            )
+            return ReviewRequest(
+                instructions=instructions,
+                ai_input=self._build_ai_input(
+                    latest_file, chunk.content, chunk.get_patch()
+                )
+                + chunk_note,
+                start_line=chunk.start_line,
+                end_line=chunk.end_line,
+            )
+
+        limit = self._get_input_tokens_limit(instructions)
+
+        def _fits(chunk: Chunk) -> bool:
+            return (
+                self._get_number_of_tokens_in_content(
+                    _get_request(chunk).ai_input, limit
+                )
+                != -1
+            )
+
+        chunks = split_in_chunks(
+            file_content, parse_hunks(latest_file.file.patch), _fits
+        )
+        return [_get_request(chunk) for chunk in chunks]
+
+    def _request_chunk_review(self, request: ReviewRequest) -> Optional[str]:
+        # None when the request failed, the other chunks are still reviewed
+        try:
+            return self._send_review_request(request.instructions, request.ai_input)
+        except Exception as e:
+            print(f"Error while generating information: {e}")
+            return None
+
+    async def _request_chunk_review_async(
+        self, request: ReviewRequest
+    ) -> Optional[str]:
+        try:
+            return await self._send_review_request_async(
+                request.instructions, request.ai_input
+            )
+        except Exception as e:
+            print(f"Error while generating information: {e}")
+            return None
+
+    def _merge_chunk_reviews(
+        self, requests: List[ReviewRequest], responses: List[Optional[str]]
+    ) -> str:
+        sections = [
+            f"**Lines {request.start_line}-{request.end_line}**\n\n"
+            f"{response if response is not None else CHUNK_ERROR_RESPONSE}"
+            for request, response in zip(requests, responses)
+            if response is None
+            or self.SKIP_COMMENT_TOKEN.upper() not in response.upper()
+        ]
+        if not sections:
+            return self.SKIP_COMMENT_TOKEN
+        return "\n\n".join(sections)
+
+    def _format_review(
+        self,
+        latest_file: LatestFile,
+        response: str,
+        instructions: str,
+        duration: float = 0.0,
+    ) -> str:
+        file = latest_file.file
+        print(f"Generated comment for file: {file.filename}")
+        return self._format_file_comment(file, response, instructions, duration)
+
+    def _format_review_error(
+        self,
+        latest_file: LatestFile,
+        error: Exception,
+        instructions: str,
+        duration: float = 0.0,
+    ) -> str:
+        file = latest_file.file
+        if "maximum context length" in str(error):
+            print(f"File is too long to generate a comment: {file.filename}")
+            response = "File is too long to generate a comment."
+        else:
+            print(f"Error while generating information: {error}")
+            response = f"Error while generating information: {error}"
+        return self._format_file_comment(file, response, instructions, duration)
+
+    def _should_file_be_ignored_due_to_metadata(self, file: LatestFile) -> bool:
+        # Filters are ordered by cost and stop at the first match. None of them needs
+        # the file content, so ignored files are never downloaded.
+        return (
+            self._should_file_be_ignored_due_to_status(file)
+            or self._should_file_be_ignored_due_to_path(file.file.filename)
+            or self._should_file_be_ignored_due_to_size(file)
+        )
+
+    @staticmethod
+    def _should_file_be_ignored_due_to_status(file: LatestFile) -> bool:
+        if file.file.status == "removed":
+            print(f"{file.file.filename}: File was removed, skipping it.")
+            return True
+        return False
+
+    def _should_file_be_ignored_due_to_size(self, file: LatestFile) -> bool:
+        # GitHub doesn't send a patch for binary files, renames without changes and
+        # diffs that are too big. Only the last ones have changed lines to review.
+        if file.file.patch is None and file.file.changes == 0:
+            print(f"{file.file.filename}: File has no changed lines, skipping it.")
+            return True
+        if self._max_file_changes and file.file.changes > self._max_file_changes:
+            print(
+                f"{file.file.filename}: File has {file.file.changes} changed lines, skipping it. Limit: {self._max_file_changes}"
+            )
+            return True
+        return False
+
     def _should_file_be_ignored_due_to_content(self, file: LatestFile) -> bool:
         if self._ignore_files_with_content:
             try:
@@ -196,22 +941,98 @@ parameters:
             print("Dependabot PR, skipping")
             exit(0)
 
+        print("Getting all bot comments")
+        all_bot_comments = self.get_all_bot_comments()
         print("Getting all files from PR")
-        all_files = self._get_latest_file_version_from_commits()
-        print("Filter files by their content")
+        all_files, unchanged_files = self._get_files_to_review(all_bot_comments)
+        print("Filter files by their status, path and size")
         all_files = [
             file
             for file in all_files
-            if not self._should_file_be_ignored_due_to_content(file)
+            if not self._should_file_be_ignored_due_to_metadata(file)
         ]
-        print("Filter files by their path")
+        if self._ignore_files_with_content:
+            self._load_file_contents(all_files)
+            print("Filter files by their content")
+            all_files = [
+                file
+                for file in all_files
+                if not self._should_file_be_ignored_due_to_content(file)
+            ]
+        all_files += unchanged_files
+        print("Removing deprecated comments")
+        remaining_comments = self._remove_deprecated_comments(
+            all_files, all_bot_comments
+        )
+        print("Generating new comments")
+        files_to_comment = self._get_files_to_comment(all_files, remaining_comments)
+        files_to_comment = self._filter_files_to_comment(
+            files_to_comment, all_bot_comments
+        )
+
+        if not files_to_comment:
+            print("No files to comment, exiting")
+            exit(0)
+
+        self._load_file_contents(self._get_files_to_download(files_to_comment))
+        comments = self._generate_comments(files_to_comment)
+        comments = self._filter_comments(comments)
+
+        summary_comment = self._generate_summary_comment(
+            all_files, comments, remaining_comments, self._github_pr.get_head_sha()
+        )
+        comments.append(summary_comment)
+
+        print("Deleting deprecated comments")
+        self._delete_deprecated_comments(files_to_comment)
+
+        print("Publishing new comments")
+        self._publish_comments(comments, files_to_comment)
+
+    async def execute_async(self):
+        print("Getting PR information")
+        if self._incremental:
+            # The files to review depend on the head reviewed by the last summary
+            pr_author, all_bot_comments = await asyncio.gather(
+                asyncio.to_thread(self._github_pr.get_pr_author_login),
+                asyncio.to_thread(self.get_all_bot_comments),
+            )
+            all_files, unchanged_files = await asyncio.to_thread(
+                self._get_files_to_review, all_bot_comments
+            )
+        else:
+            pr_author, all_files, all_bot_comments = await asyncio.gather(
+                asyncio.to_thread(self._github_pr.get_pr_author_login),
+                asyncio.to_thread(self._get_latest_files),
+                asyncio.to_thread(self.get_all_bot_comments),
+            )
+            unchanged_files = []
+        if "dependabot" in pr_author:
+            print("Dependabot PR, skipping")
+            exit(0)
+
+        print("Filter files by their status, path and size")
         all_files = [
             file
             for file in all_files
-            if not self._should_file_be_ignored_due_to_path(file.file.filename)
+            if not self._should_file_be_ignored_due_to_metadata(file)
         ]
-        print("Getting all bot comments")
-        all_bot_comments = self.get_all_bot_comments()
+        if self._ignore_files_with_content:
+            await asyncio.to_thread(self._load_file_contents, all_files)
+            print("Filter files by their content")
+            semaphore = asyncio.Semaphore(self._max_workers)
+
+            async def _is_ignored_due_to_content(file: LatestFile) -> bool:
+                async with semaphore:
+                    return await asyncio.to_thread(
+                        self._should_file_be_ignored_due_to_content, file
+                    )
+
+            ignored = await asyncio.gather(
+                *[_is_ignored_due_to_content(file) for file in all_files]
+            )
+            all_files = [file for file, skip in zip(all_files, ignored) if not skip]
+        all_files += unchanged_files
         print("Removing deprecated comments")
         remaining_comments = self._remove_deprecated_comments(
             all_files, all_bot_comments
@@ -226,19 +1047,82 @@ parameters:
             print("No files to comment, exiting")
             exit(0)
 
-        comments = self._generate_comments(files_to_comment)
+        # Old comments that can't be reused are deleted while the AI is still working
+        # on the new ones
+        print("Deleting deprecated comments")
+        delete_task = asyncio.create_task(
+            asyncio.to_thread(self._delete_deprecated_comments, files_to_comment)
+        )
+        files_to_download = await asyncio.to_thread(
+            self._get_files_to_download, files_to_comment
+        )
+        await asyncio.to_thread(self._load_file_contents, files_to_download)
+        comments = await self._generate_comments_async(files_to_comment)
         comments = self._filter_comments(comments)
 
         summary_comment = self._generate_summary_comment(
-            all_files, comments, remaining_comments
+            all_files, comments, remaining_comments, self._github_pr.get_head_sha()
         )
         comments.append(summary_comment)
+        await delete_task
 
-        print("Deleting deprecated comments")
-        self._delete_deprecated_comments()
+        print("Publishing new comments")
+        await asyncio.to_thread(self._publish_comments, comments, files_to_comment)
+
+    def _get_files_to_download(self, files: List[LatestFile]) -> List[LatestFile]:
+        # Files with a cached review don't need their content. Only the blob sha cache
+        # is checked, the shared cache needs the content to make its key.
+        if not self._bulk_content_download or self._review_cache is None:
+            return files
 
-        print("Adding new comments")
-        self._github_pr.add_comments(comments)
+        result = []
+        for file in files:
+            instructions = self._get_instructions_for_file(file)
+            if not instructions:
+                continue
+            cache, key = next(self._get_review_cache_keys(file, instructions))
+            try:
+                if cache.get(key) is not None:
+                    continue
+            except Exception as e:
+                print(f"Error while reading the review cache: {e}")
+            result.append(file)
+        return result
+
+    def _load_file_contents(self, files: List[LatestFile]) -> None:
+        # Loads the content of all the files in a single download instead of one
+        # request per file. Files missing from the download are loaded one by one later.
+        if not self._bulk_content_download:
+            return
+
+        files = [
+            file
+            for file in files
+            if file._content is None and file.file.status != "removed"
+        ]
+        if not files:
+            return
+
+        # When commits are walked the files can come from different commits, only the
+        # most common one is downloaded
+        ref = Counter(file.commit.sha for file in files).most_common(1)[0][0]
+        if ref in self._bulk_loaded_refs:
+            return
+        self._bulk_loaded_refs.add(ref)
+
+        files = [file for file in files if file.commit.sha == ref]
+        print(f"Downloading the content of {len(files)} files from {ref}")
+        try:
+            contents = self._github_pr.get_contents_for_files(
+                [file.file.filename for file in files], ref
+            )
+        except Exception as e:
+            print(f"Error while downloading files content: {e}")
+            return
+
+        for file in files:
+            if file.file.filename in contents:
+                file._content = contents[file.file.filename]
 
     def _filter_comments(self, comments: List[str]) -> List[str]:
         # if SKIP_COMMENT_TOKEN is in the comment, remove it
@@ -252,21 +1136,102 @@ parameters:
         self,
         files_to_comment: List[LatestFile],
         comments: List[str],
-        remaining_comments: List[IssueComment],
+        remaining_comments: List[BotComment],
+        head_sha: str = "",
     ) -> str:
-        hidden_files_section = [
-            f"{self.HIDE_FILE_LINE_START}{file.file.filename}|{file.file.sha}{self.HIDE_FILE_LINE_END}\n"
-            for file in files_to_comment
-        ]
+        metadata = CommentMetadata(
+            kind=SUMMARY_COMMENT_KIND,
+            files=[(file.file.filename, file.file.sha) for file in files_to_comment],
+            head_sha=head_sha,
+        )
         summary = f"""{self.SUMMARY_COMMENT_HEADER}
   
   - {len(files_to_comment)} files were reviewed.
   - {len(comments) + len(remaining_comments)} comments were added.
   
-    {"".join(hidden_files_section)}
+{metadata.to_comment()}
 """
         return summary
 
+    def _get_files_to_review(
+        self, all_bot_comments: List[BotComment]
+    ) -> Tuple[List[LatestFile], List[LatestFile]]:
+        # Returns the files to check and the files that didn't change since the last
+        # review, which skip the filters and are only used to keep their state
+        if self._incremental:
+            result = self._get_files_changed_since_last_review(all_bot_comments)
+            if result is not None:
+                return result
+        return self._get_latest_files(), []
+
+    def _get_files_changed_since_last_review(
+        self, all_bot_comments: List[BotComment]
+    ) -> Optional[Tuple[List[LatestFile], List[LatestFile]]]:
+        summaries = [
+            comment
+            for comment in all_bot_comments
+            if comment.kind == SUMMARY_COMMENT_KIND and comment.metadata.head_sha
+        ]
+        if not summaries:
+            print("No previous review found, reviewing all files")
+            return None
+
+        last_review = summaries[-1].metadata
+        head_commit = self._github_pr.get_head_commit()
+        try:
+            changed_files = self._github_pr.get_changed_files(
+                last_review.head_sha, head_commit.sha
+            )
+        except Exception as e:
+            print(f"Error while comparing with the last review: {e}")
+            return None
+        if changed_files is None:
+            print("PR history changed since the last review, reviewing all files")
+            return None
+
+        print(
+            f"{len(changed_files)} files changed since {last_review.head_sha}, only "
+            f"those are reviewed"
+        )
+        changed_filenames = set()
+        for file in changed_files:
+            changed_filenames.add(file.filename)
+            if getattr(file, "previous_filename", None):
+                changed_filenames.add(file.previous_filename)
+        unchanged_files = [
+            LatestFile(
+                file=ReviewedFile(filename=filename, sha=sha), commit=head_commit
+            )
+            for filename, sha in last_review.files
+            if filename not in changed_filenames
+        ]
+        # The compare API only picks the files, its patches are the diff since the last
+        # review. The files reviewed come from the PR diff, so the AI, the hunks and
+        # the review positions see everything the PR changes in them.
+        latest_files = [
+            LatestFile(file=file, commit=head_commit)
+            for file in self._github_pr.get_files()
+            if file.filename in changed_filenames
+        ]
+        return latest_files, unchanged_files
+
+    def _get_latest_files(self) -> List[LatestFile]:
+        if not self._walk_commits:
+            try:
+                return self._get_latest_file_version_from_head()
+            except Exception as e:
+                print(f"Could not load files from the PR head, walking commits: {e}")
+        return self._get_latest_file_version_from_commits()
+
+    def _get_latest_file_version_from_head(self) -> List[LatestFile]:
+        # Every file still in the PR diff is at its latest version in the PR head, so
+        # there is no need to find which commit touched it last
+        head_commit = self._github_pr.get_head_commit()
+        return [
+            LatestFile(file=file, commit=head_commit)
+            for file in self._github_pr.get_files()
+        ]
+
     def _get_latest_file_version_from_commits(self) -> List[LatestFile]:
         files_in_pr = [f.filename for f in self._github_pr.get_files()]
         commits = self._github_pr.get_pr_commits()
@@ -281,23 +1246,82 @@ parameters:
 
         return list(files.values())
 
-    def get_all_bot_comments(self) -> List[IssueComment]:
-        comments = self._github_pr.get_comments()
+    def get_all_bot_comments(self) -> List[BotComment]:
         result = []
-        for comment in comments:
-            if self.COMMENT_HEADER or self.SUMMARY_COMMENT_HEADER in comment.body:
-                result.append(comment)
+        for comment in self._github_pr.get_comments():
+            bot_comment = self._parse_bot_comment(comment)
+            if bot_comment is not None:
+                result.append(bot_comment)
+        if self._output_mode == REVIEW_OUTPUT:
+            # The summary of the previous runs is in the body of their reviews
+            for review in self._github_pr.get_reviews():
+                bot_comment = self._parse_bot_comment(review)
+                if bot_comment is not None:
+                    bot_comment.read_only = True
+                    result.append(bot_comment)
         return result
 
+    def _parse_bot_comment(self, comment: IssueComment) -> Optional[BotComment]:
+        body = comment.body or ""
+        metadata = self._parse_comment_body(body)
+        if metadata is None:
+            return None
+        return BotComment(
+            comment=comment,
+            metadata=metadata,
+            skipped=self.SKIP_COMMENT_TOKEN.upper() in body.upper(),
+        )
+
+    @classmethod
+    def _parse_comment_body(cls, body: str) -> Optional[CommentMetadata]:
+        # Returns None when the comment wasn't written by the bot
+        metadata = parse_comment_metadata(body)
+        if metadata is not None:
+            return metadata
+        if cls.SUMMARY_COMMENT_HEADER in body:
+            return cls._parse_legacy_summary_body(body)
+        if cls.COMMENT_HEADER in body:
+            return cls._parse_legacy_file_body(body)
+        return None
+
+    @classmethod
+    def _parse_legacy_file_body(cls, body: str) -> CommentMetadata:
+        # Comments written before the metadata block keep the file and sha in the
+        # markdown header, which ends at the "----" line
+        metadata = CommentMetadata(kind=FILE_COMMENT_KIND, version=0)
+        for line in body.splitlines():
+            if line.startswith("#### File:"):
+                # Remove first and last char from file name as the format is _{file_name}_
+                metadata.file = line.split("#### File:")[1].strip()[1:-1]
+            elif cls.SHA_HEADER in line:
+                sha = line.split(cls.SHA_HEADER)[1]
+                metadata.sha = sha.replace(cls.SHA_HEADER_ENDING, "").strip()
+            elif line.startswith("#### SHA:"):
+                # Oldest format, the sha is shown as _{sha}_
+                metadata.sha = line.split("#### SHA:")[1].strip()[1:-1]
+            elif line.startswith("---"):
+                break
+        return metadata
+
+    @classmethod
+    def _parse_legacy_summary_body(cls, body: str) -> CommentMetadata:
+        metadata = CommentMetadata(kind=SUMMARY_COMMENT_KIND, version=0)
+        for line in body.splitlines():
+            if cls.HIDE_FILE_LINE_START in line:
+                line = line.replace(cls.HIDE_FILE_LINE_START, "").replace(
+                    cls.HIDE_FILE_LINE_END, ""
+                )
+                file_name, _, file_sha = line.partition("|")
+                metadata.files.append((file_name.strip(), file_sha.strip()))
+        return metadata
+
     def _get_files_to_comment(
-        self, files: List[LatestFile], all_bot_comments: List[IssueComment]
+        self, files: List[LatestFile], remaining_comments: List[BotComment]
     ) -> List[LatestFile]:
+        commented_files = {comment.filename for comment in remaining_comments}
         result = []
         for file in files:
-            if file.file.filename not in [
-                self._get_file_name_from_comment(comment.body)
-                for comment in all_bot_comments
-            ]:
+            if file.file.filename not in commented_files:
                 result.append(file)
                 print(
                     f"File {file.file.filename} is not commented, adding it to the list"
@@ -308,178 +1332,496 @@ parameters:
         return result
 
     def _filter_files_to_comment(
-        self, files: List[LatestFile], all_bot_comments: List[IssueComment]
+        self, files: List[LatestFile], all_bot_comments: List[BotComment]
     ) -> List[LatestFile]:
-        all_files_in_previous_run: List[Tuple[str, str]] = []
+        # Files reviewed in a previous run without comments only show up in the summary
+        all_files_in_previous_run: Set[Tuple[str, str]] = set()
         for comment in all_bot_comments:
-            if self.SUMMARY_COMMENT_HEADER not in comment.body:
-                continue
-
-            lines = comment.body.splitlines()
-            for line in lines:
-                if self.HIDE_FILE_LINE_START in line:
-                    line = line.replace(self.HIDE_FILE_LINE_START, "").replace(
-                        self.HIDE_FILE_LINE_END, ""
-                    )
-                    file_name, file_sha = line.split("|")
-                    all_files_in_previous_run.append((file_name.strip(), file_sha))
+            all_files_in_previous_run |= comment.reviewed_files
 
+        result = []
         for file in files:
             if (file.file.filename, file.file.sha) in all_files_in_previous_run:
                 print(f"File {file.file.filename} is already commented, ignoring it")
-                files.remove(file)
             else:
+                result.append(file)
                 print(
                     f"File {file.file.filename} is not commented, adding it to the list"
                 )
 
-        return files
+        return result
 
     def _remove_deprecated_comments(
-        self, files: List[LatestFile], all_bot_comments: List[IssueComment]
-    ) -> List[IssueComment]:
+        self, files: List[LatestFile], all_bot_comments: List[BotComment]
+    ) -> List[BotComment]:
         deprecated_comments = []
         remaining_comments = []
+        file_shas = {file.file.filename: file.file.sha for file in files}
 
         for comment in all_bot_comments:
-            if self.SUMMARY_COMMENT_HEADER in comment.body:
+            if comment.read_only:
+                continue
+
+            if comment.kind == SUMMARY_COMMENT_KIND:
                 print("Summary comment found, ignoring it")
                 deprecated_comments.append(comment)
                 continue
 
-            if self.SKIP_COMMENT_TOKEN.upper() in comment.body.upper():
+            if comment.skipped:
                 print("Comment contains SKIP_COMMENT_TOKEN, ignoring it")
                 deprecated_comments.append(comment)
                 continue
 
-            comment_file_name = self._get_file_name_from_comment(comment.body)
-            comment_file_sha = self._get_file_sha_from_comment(comment.body)
-
-            # If it's not a comment created by the bot (doesn't contain self.COMMENT_HEADER in body), ignore it
-            if self.COMMENT_HEADER not in comment.body:
-                print("Comment is not created by the bot, ignoring it")
-                continue
-
-            if comment_file_name == "" or comment_file_sha == "":
+            if comment.filename == "" or comment.sha == "":
                 print("Could not parse comment, deleting it")
                 deprecated_comments.append(comment)
                 continue
 
             # if file is no longer in the PR, delete the comment
-            if comment_file_name not in [file.file.filename for file in files]:
+            if comment.filename not in file_shas:
                 print(
-                    f"{comment_file_name}: File is no longer in the PR, deleting comment"
+                    f"{comment.filename}: File is no longer in the PR, deleting comment"
                 )
                 deprecated_comments.append(comment)
                 continue
 
             # if file changed sha, delete the comment
-            deleted = False
-            for file in files:
-                if (
-                    file.file.filename == comment_file_name
-                    and file.file.sha != comment_file_sha
-                ):
-                    print(
-                        f"{comment_file_name}: File content changed, deleting comment"
-                    )
-                    deprecated_comments.append(comment)
-                    deleted = True
-                    break
+            if file_shas[comment.filename] != comment.sha:
+                print(f"{comment.filename}: File content changed, deleting comment")
+                deprecated_comments.append(comment)
+                continue
 
-            if not deleted:
-                remaining_comments.append(comment)
+            remaining_comments.append(comment)
 
         self._deprecated_comments = deprecated_comments
 
         return remaining_comments
 
-    def _delete_deprecated_comments(self):
+    def _delete_deprecated_comments(self, files_to_comment: List[LatestFile]) -> None:
+        # Deletes the comments of files that are not reviewed again, the others are
+        # kept to be edited in place by _publish_comments
+        filenames = {file.file.filename for file in files_to_comment}
+        deleted = []
+        kept = []
         for comment in self._deprecated_comments:
-            comment.delete()
-
-    def _get_file_sha_from_comment(self, comment: str) -> str:
-        lines = comment.splitlines()
-        for line in lines:
-            if self.SHA_HEADER in line:
-                # Remove first and last char from sha as the format is _{sha}_
-                sha = line.split(self.SHA_HEADER)[1].strip()
-                sha = sha.replace(self.SHA_HEADER_ENDING, "").strip()
-                return sha
-            elif line.startswith("---"):
-                break
-        return ""
+            if comment.kind == FILE_COMMENT_KIND and comment.filename not in filenames:
+                deleted.append(comment.comment)
+            else:
+                kept.append(comment)
+        self._deprecated_comments = kept
+        self._github_pr.update_comments(deleted=deleted)
 
-    @staticmethod
-    def _get_file_name_from_comment(comment: str) -> str:
-        lines = comment.splitlines()
-        for line in lines:
-            if line.startswith("#### File:"):
-                # Remove first and last char from file name as the format is _{file_name}_
-                return line.split("#### File:")[1].strip()[1:-1]
-            elif line.startswith("---"):
-                break
-        return ""
+    def _publish_comments(
+        self, comments: List[str], files_to_comment: List[LatestFile]
+    ) -> None:
+        if self._output_mode == REVIEW_OUTPUT:
+            self._submit_review(comments, files_to_comment)
+            return
+
+        # A deprecated comment of the same file is edited instead of deleting it and
+        # creating a new one, which halves the writes and doesn't notify again
+        reusable: Dict[Tuple[str, str], BotComment] = {}
+        deleted = []
+        for comment in self._deprecated_comments:
+            key = (comment.kind, comment.filename)
+            if key in reusable:
+                deleted.append(reusable[key].comment)
+            reusable[key] = comment
+
+        edited = []
+        created = []
+        for body in comments:
+            metadata = self._parse_comment_body(body)
+            key = (metadata.kind, metadata.file) if metadata is not None else None
+            # The summary must stay the last comment, it is only edited when nothing
+            # new is created after it
+            if key is None or (key[0] == SUMMARY_COMMENT_KIND and created):
+                created.append(body)
+                continue
+            existing = reusable.pop(key, None)
+            if existing is None:
+                created.append(body)
+            elif existing.comment.body != body:
+                edited.append((existing.comment, body))
+
+        deleted += [comment.comment for comment in reusable.values()]
+        self._deprecated_comments = []
+        print(
+            f"Editing {len(edited)} comments, creating {len(created)} and deleting "
+            f"{len(deleted)}"
+        )
+        self._github_pr.update_comments(edited=edited, created=created, deleted=deleted)
+
+    def _submit_review(
+        self, comments: List[str], files_to_comment: List[LatestFile]
+    ) -> None:
+        # All the findings go in one review, each anchored to a line of its file diff.
+        # The summary opens the review body, where the next runs read it from.
+        files = {file.file.filename: file for file in files_to_comment}
+        summaries = []
+        body_comments = []
+        review_comments = []
+        for body in comments:
+            metadata = self._parse_comment_body(body)
+            if metadata is not None and metadata.kind == SUMMARY_COMMENT_KIND:
+                summaries.append(body)
+                continue
+            file = files.get(metadata.file) if metadata is not None else None
+            position = None
+            if file is not None:
+                # The positions are relative to the PR diff, which is the patch of the
+                # files to comment also in incremental mode
+                position = get_review_position(parse_hunks(file.file.patch), body)
+            if position is None:
+                body_comments.append(body)
+            else:
+                review_comments.append(
+                    {"path": file.file.filename, "position": position, "body": body}
+                )
+
+        print(f"Submitting a review with {len(review_comments)} inline comments")
+        self._github_pr.create_review(
+            "\n\n".join(summaries + body_comments), review_comments
+        )
+
+        # Issue comments of previous runs are replaced by the review, they are only
+        # deleted once it was created, a rejected review keeps them
+        deleted = [comment.comment for comment in self._deprecated_comments]
+        self._deprecated_comments = []
+        if deleted:
+            self._github_pr.update_comments(deleted=deleted)
+
+    @classmethod
+    def _get_file_sha_from_comment(cls, comment: str) -> str:
+        metadata = cls._parse_comment_body(comment)
+        return metadata.sha if metadata is not None else ""
+
+    @classmethod
+    def _get_file_name_from_comment(cls, comment: str) -> str:
+        metadata = cls._parse_comment_body(comment)
+        return metadata.file if metadata is not None else ""
 
     def _generate_comments(self, files: List[LatestFile]) -> List[str]:
-        comments = []
+        # Sort by file name so the comments are always posted in the same order,
+        # no matter which worker finishes first
+        files = sorted(files, key=lambda file: file.file.filename)
+        batches = self._group_files_in_batches(files)
+        if self._max_workers == 1 or len(batches) <= 1:
+            results = [self._generate_comments_for_batch(batch) for batch in batches]
+        else:
+            print(f"Generating comments using {self._max_workers} workers")
+            with ThreadPoolExecutor(max_workers=self._max_workers) as executor:
+                results = list(executor.map(self._generate_comments_for_batch, batches))
+
+        return self._sort_batch_comments(files, batches, results)
+
+    async def _generate_comments_async(self, files: List[LatestFile]) -> List[str]:
+        files = sorted(files, key=lambda file: file.file.filename)
+        batches = await asyncio.to_thread(self._group_files_in_batches, files)
+        semaphore = asyncio.Semaphore(self._max_workers)
+
+        # Created in the running loop, execute_async can run more than once
+        self._async_request_slots = asyncio.Semaphore(self._max_workers)
+
+        async def _generate(batch: List[LatestFile]) -> List[str]:
+            async with semaphore:
+                return await self._generate_comments_for_batch_async(batch)
+
+        results = await asyncio.gather(*[_generate(batch) for batch in batches])
+        return self._sort_batch_comments(files, batches, results)
+
+    @staticmethod
+    def _sort_batch_comments(
+        files: List[LatestFile],
+        batches: List[List[LatestFile]],
+        results: List[List[str]],
+    ) -> List[str]:
+        comments_by_file = {}
+        for batch, comments in zip(batches, results):
+            for file, comment in zip(batch, comments):
+                comments_by_file[file.file.filename] = comment
+        comments = [comments_by_file[file.file.filename] for file in files]
+        return [comment for comment in comments if comment != ""]
+
+    def _group_files_in_batches(
+        self, files: List[LatestFile]
+    ) -> List[List[LatestFile]]:
+        # Small files with the same instructions are packed in the same request, up to
+        # a share of the token budget. Every other file is a batch of its own.
+        if not self._batch_small_files or len(files) <= 1:
+            return [[file] for file in files]
+
+        with ThreadPoolExecutor(max_workers=self._max_workers) as executor:
+            candidates = list(executor.map(self._get_batch_candidate, files))
+
+        batches = []
+        groups: Dict[Tuple[int, str, str, int], List[Tuple[LatestFile, int]]] = {}
+        budgets: Dict[Tuple[int, str, str, int], float] = {}
+        for file, candidate in zip(files, candidates):
+            if candidate is None:
+                batches.append([file])
+                continue
+            key, tokens, limit = candidate
+            groups.setdefault(key, []).append((file, tokens))
+            budget = limit * self.BATCH_MAX_TOKENS_SHARE
+            budgets[key] = min(budgets.get(key, budget), budget)
+
+        for key, group in groups.items():
+            budget = budgets[key]
+            batch: List[LatestFile] = []
+            batch_tokens = 0
+            for file, tokens in group:
+                if batch and (
+                    batch_tokens + tokens > budget
+                    or len(batch) >= self._batch_max_files
+                ):
+                    batches.append(batch)
+                    batch, batch_tokens = [], 0
+                batch.append(file)
+                batch_tokens += tokens
+            batches.append(batch)
+        return batches
+
+    def _get_batch_candidate(
+        self, file: LatestFile
+    ) -> Optional[Tuple[Tuple[int, str, str, int], int, int]]:
+        # Returns the group of the file, its tokens and the tokens left for the input by
+        # its instructions, or None when the file must be reviewed alone
+        try:
+            key = self._get_instructions_key(file)
+            if key is None:
+                return None
+            instructions = self._get_instructions_for_file(file)
+            if self._get_cached_review(file, instructions):
+                return None
+            ai_input = self._build_ai_input(
+                file, self._get_review_content(file), file.file.patch
+            )
+        except Exception as e:
+            print(f"{file.file.filename}: Can't be batched, reviewing it alone: {e}")
+            return None
+
+        limit = self._get_input_tokens_limit(
+            self._add_context_instructions(file, instructions)
+        )
+        tokens = self._get_number_of_tokens_in_content(ai_input, limit)
+        if tokens == -1 or tokens > limit * self.BATCH_FILE_TOKENS_SHARE:
+            return None
+        return (*key, *self._get_review_context(file)), tokens, limit
+
+    def _build_batch_request(self, files: List[LatestFile]) -> ReviewRequest:
+        names = ", ".join(file.file.filename for file in files)
+        instructions = self._get_instructions_for_file(files[0], file_name=names)
+        instructions = self._add_context_instructions(files[0], instructions)
+        instructions += (
+            f"\n You are reviewing several files at once, each one starts with a "
+            f'line like "{BATCH_FILE_MARKER.format(file="name")}". Review each file on '
+            f"its own and answer with one section per file, starting with the same "
+            f"line, followed by the review of that file. When a file has no problems "
+            f'its section must only contain "{self.SKIP_COMMENT_TOKEN}".'
+        )
+        sections = [
+            (file, self._get_review_content(file), file.file.patch) for file in files
+        ]
+        return ReviewRequest(
+            instructions=instructions,
+            ai_input=self._build_batch_ai_input(sections),
+        )
+
+    def _build_batch_ai_input(self, sections: List[Tuple[LatestFile, str, str]]) -> str:
+        return "\n".join(
+            f"{BATCH_FILE_MARKER.format(file=latest_file.file.filename)}\n"
+            f"{self._build_ai_input(latest_file, content, patch)}"
+            for latest_file, content, patch in sections
+        )
+
+    @staticmethod
+    def _split_batch_response(response: str, files: List[LatestFile]) -> Dict[str, str]:
+        names = {file.file.filename for file in files}
+        sections: Dict[str, List[str]] = {}
+        current = None
+        for line in response.splitlines():
+            match = BATCH_FILE_MARKER_PATTERN.match(line)
+            if match and match.group(1).strip() in names:
+                current = match.group(1).strip()
+                sections[current] = []
+            elif current is not None:
+                sections[current].append(line)
+        return {
+            name: "\n".join(lines).strip()
+            for name, lines in sections.items()
+            if "\n".join(lines).strip()
+        }
+
+    def _finish_batch(
+        self, files: List[LatestFile], response: str, duration: float
+    ) -> List[Optional[str]]:
+        # The comment of each file, or None for the files missing from the response
+        reviews = self._split_batch_response(response, files)
+        comments: List[Optional[str]] = []
         for file in files:
-            if file.file.status == "removed":
+            review = reviews.get(file.file.filename)
+            if review is None:
+                print(f"{file.file.filename}: Missing from the batch response")
+                comments.append(None)
                 continue
+            # Cached as if the file was reviewed alone
+            instructions = self._get_instructions_for_file(file)
+            self._store_review(file, instructions, review)
+            comment = self._format_review(file, review, instructions, duration)
+            comments.append(self._sanitize_comment(comment))
+        return comments
 
-            instructions_text: str = next(
-                (
-                    instruction.instructions
-                    for instruction in self._file_instructions
-                    if fnmatch.fnmatch(file.file.filename, instruction.file_match)
-                ),
-                "",
+    def _generate_comments_for_batch(self, files: List[LatestFile]) -> List[str]:
+        if len(files) == 1:
+            return [self._generate_comment_for_file(files[0])]
+
+        print(f"Reviewing {len(files)} files in a single request")
+        started_at = time.perf_counter()
+        try:
+            request = self._build_batch_request(files)
+            response = self._send_review_request(request.instructions, request.ai_input)
+        except Exception as e:
+            print(f"Error while reviewing the batch, reviewing the files alone: {e}")
+            return [self._generate_comment_for_file(file) for file in files]
+
+        comments = self._finish_batch(files, response, time.perf_counter() - started_at)
+        return [
+            comment if comment is not None else self._generate_comment_for_file(file)
+            for file, comment in zip(files, comments)
+        ]
+
+    async def _generate_comments_for_batch_async(
+        self, files: List[LatestFile]
+    ) -> List[str]:
+        if len(files) == 1:
+            return [await self._generate_comment_for_file_async(files[0])]
+
+        print(f"Reviewing {len(files)} files in a single request")
+        started_at = time.perf_counter()
+        try:
+            request = await asyncio.to_thread(self._build_batch_request, files)
+            response = await self._send_review_request_async(
+                request.instructions, request.ai_input
+            )
+        except Exception as e:
+            print(f"Error while reviewing the batch, reviewing the files alone: {e}")
+            return list(
+                await asyncio.gather(
+                    *[self._generate_comment_for_file_async(file) for file in files]
+                )
             )
-            if instructions_text == "":
-                print(f"No instructions found for file {file.file.filename}")
-                continue
 
-            instructions_text = instructions_text.replace(
-                "{file_suffix}", Path(file.file.filename).suffix
+        comments = await asyncio.to_thread(
+            self._finish_batch, files, response, time.perf_counter() - started_at
+        )
+        return list(
+            await asyncio.gather(
+                *[
+                    self._generate_comment_for_file_async(file)
+                    if comment is None
+                    else asyncio.sleep(0, comment)
+                    for file, comment in zip(files, comments)
+                ]
             )
-            instructions_text = instructions_text.replace(
-                "{file_name}", file.file.filename
+        )
+
+    def _generate_comment_for_file(self, file: LatestFile) -> str:
+        instructions_text = self._get_instructions_for_file(file)
+        if instructions_text == "":
+            return ""
+
+        try:
+            comment = self._generate_comment(file, instructions_text)
+        except Exception as e:
+            print(f"Error while generating comment for file {file.file.filename}: {e}")
+            comment = ""
+
+        if comment != "":
+            comment = self._sanitize_comment(comment)
+        return comment
+
+    async def _generate_comment_for_file_async(self, file: LatestFile) -> str:
+        instructions_text = self._get_instructions_for_file(file)
+        if instructions_text == "":
+            return ""
+
+        try:
+            comment = await self._generate_comment_async(file, instructions_text)
+        except Exception as e:
+            print(f"Error while generating comment for file {file.file.filename}: {e}")
+            comment = ""
+
+        if comment != "":
+            comment = self._sanitize_comment(comment)
+        return comment
+
+    def _get_instructions_for_file(
+        self, file: LatestFile, file_name: Optional[str] = None
+    ) -> str:
+        # file_name replaces the name of the file in the instructions, e.g. with the
+        # names of all the files of a batch
+        key = self._get_instructions_key(file)
+        if key is None:
+            return ""
+
+        index, suffix = key
+        template = self._instruction_templates[index]
+        if FILE_NAME_SLOT in template.slots:
+            return template.render(
+                file_name=file_name or file.file.filename, file_suffix=suffix
             )
 
-            try:
-                comment = self._generate_comment(file, instructions_text)
-            except Exception as e:
-                print(
-                    f"Error while generating comment for file {file.file.filename}: {e}"
-                )
-                comment = ""
+        rendered = self._rendered_instructions.get(key)
+        if rendered is None:
+            rendered = template.render(file_suffix=suffix)
+            self._rendered_instructions[key] = rendered
+        return rendered
 
-            if comment != "":
-                comment = self._sanitize_comment(comment)
-                comments.append(comment)
-        return comments
+    def _get_instructions_key(self, file: LatestFile) -> Optional[Tuple[int, str]]:
+        # The template of the file and the suffix it is rendered with, files with the
+        # same key get the same instructions and can be reviewed in the same request
+        if file.file.status == "removed":
+            return None
+
+        index = self._file_instructions_matcher.find(file.file.filename)
+        if index is None:
+            print(f"No instructions found for file {file.file.filename}")
+            return None
+
+        suffix = ""
+        if FILE_SUFFIX_SLOT in self._instruction_templates[index].slots:
+            suffix = Path(file.file.filename).suffix
+        return index, suffix
 
     def _should_file_be_ignored_due_to_path(self, file_name: str) -> bool:
-        if any(
-            [fnmatch.fnmatch(file_name, path) for path in self._ignore_files_in_paths]
-        ):
+        if self._ignore_files_in_paths_matcher.match(file_name):
             print(f"{file_name} is under an ignored path, skipping it.")
             return True
         return False
 
-    def _get_number_of_tokens_in_content(self, content: str) -> int:
-        # 1500 words in content = 2048 tokens
-        # where maximum is 4000 tokens, if content is longer than 4000 tokens, it will return -1
-        number_of_tokens = int(len(content.split(" ")) / 1500 * 2048)
-        if number_of_tokens > self.MAX_TOKENS:
+    def _get_number_of_tokens_in_content(
+        self, content: str, limit: Optional[int] = None
+    ) -> int:
+        # If content is longer than the limit, MAX_TOKENS by default, it will return -1
+        if limit is None:
+            limit = self.MAX_TOKENS
+        number_of_tokens = self._token_counter.count(content, limit=max(limit, 0))
+        if number_of_tokens > limit:
             return -1
-
-        # increase 10%
-        number_of_tokens = int(number_of_tokens * 1.40)
-        if number_of_tokens > self.MAX_TOKENS:
-            return self.MAX_TOKENS
         return number_of_tokens
 
+    def _get_input_tokens_limit(self, instructions: str) -> int:
+        # The instructions are sent with every request and the answer counts against
+        # the same context, the input gets what is left of MAX_TOKENS
+        tokens = self._instructions_tokens.get(instructions)
+        if tokens is None:
+            tokens = self._token_counter.count(
+                self._get_system_instruction(instructions)
+            )
+            self._instructions_tokens[instructions] = tokens
+        return self.MAX_TOKENS - tokens - self.RESERVED_OUTPUT_TOKENS
+
     @staticmethod
     def _sanitize_comment(comment: str) -> str:
         CODE_BLOCK_START = "```"
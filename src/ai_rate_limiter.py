@@ -0,0 +1,72 @@
+import asyncio
+import threading
+import time
+from typing import Callable, Optional
+
+
+class _Budget:
+    # Token bucket that refills "per_minute" units over a minute. Callers reserve what
+    # they need, possibly going into debt, and wait until the debt is paid, so the
+    # waiting happens outside the lock.
+    _per_minute: float
+    _available: float
+    _updated_at: float
+
+    def __init__(self, per_minute: float, now: float):
+        self._per_minute = per_minute
+        self._available = per_minute
+        self._updated_at = now
+
+    def reserve(self, amount: float, now: float) -> float:
+        rate = self._per_minute / 60
+        self._available = min(
+            self._per_minute, self._available + (now - self._updated_at) * rate
+        )
+        self._updated_at = now
+        # A single request bigger than the whole budget waits for a full minute at most
+        self._available -= min(amount, self._per_minute)
+        return max(0.0, -self._available / rate)
+
+
+class AiRateLimiter:
+    # Requests per minute and tokens per minute of the AI provider, 0 means no limit.
+    # Keeps the run under the provider quotas instead of hitting 429 errors.
+    _requests: Optional[_Budget]
+    _tokens: Optional[_Budget]
+    _lock: threading.Lock
+    _clock: Callable[[], float]
+
+    def __init__(
+        self,
+        requests_per_minute: int = 0,
+        tokens_per_minute: int = 0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        now = clock()
+        self._requests = (
+            _Budget(requests_per_minute, now) if requests_per_minute else None
+        )
+        self._tokens = _Budget(tokens_per_minute, now) if tokens_per_minute else None
+        self._lock = threading.Lock()
+        self._clock = clock
+
+    def reserve(self, tokens: int) -> float:
+        # Returns how many seconds the caller has to wait before sending the request
+        with self._lock:
+            now = self._clock()
+            wait = 0.0
+            if self._requests is not None:
+                wait = max(wait, self._requests.reserve(1, now))
+            if self._tokens is not None:
+                wait = max(wait, self._tokens.reserve(tokens, now))
+            return wait
+
+    def acquire(self, tokens: int) -> None:
+        wait = self.reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self, tokens: int) -> None:
+        wait = self.reserve(tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
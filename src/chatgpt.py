@@ -1,14 +1,24 @@
-from typing import List
+from typing import List, Optional
 
 import openai
 
 from github_pr import GithubPR
-from ai_assistent import AiAssistent, LatestFile
+from ai_assistent import (
+    COMMENTS_OUTPUT,
+    FULL_CONTEXT,
+    AiAssistent,
+    FileInstructions,
+    LatestFile,
+)
+from path_matcher import FNMATCH_STYLE
+from review_cache import ReviewCache
+from token_counter import TiktokenTokenCounter
 
 
 class ChatGPT(AiAssistent):
     _github_pr: GithubPR
     MAX_TOKENS = 4097
+    _model_name = "gpt-3.5-turbo"
 
     def __init__(
         self,
@@ -17,88 +27,100 @@ class ChatGPT(AiAssistent):
         ignore_files_with_content: List[str],
         ignore_files_in_paths: List[str],
         instructions: List[str],
+        max_workers: int = 1,
+        walk_commits: bool = False,
+        bulk_content_download: bool = False,
+        max_file_changes: int = 0,
+        path_match_style: str = FNMATCH_STYLE,
+        chunk_large_files: bool = True,
+        context_mode: str = FULL_CONTEXT,
+        context_lines: int = 10,
+        include_signatures: bool = True,
+        review_cache: Optional[ReviewCache] = None,
+        shared_review_cache: Optional[ReviewCache] = None,
+        incremental: bool = False,
+        output_mode: str = COMMENTS_OUTPUT,
+        requests_per_minute: int = 0,
+        tokens_per_minute: int = 0,
+        max_retries: int = 3,
+        hedge_after_seconds: float = 0,
+        batch_small_files: bool = False,
+        batch_max_files: int = 10,
+        file_instructions: Optional[List[FileInstructions]] = None,
     ):
         super().__init__(
             github_pr=github_pr,
             ignore_files_with_content=ignore_files_with_content,
             ignore_files_in_paths=ignore_files_in_paths,
             instructions=instructions,
+            max_workers=max_workers,
+            walk_commits=walk_commits,
+            bulk_content_download=bulk_content_download,
+            max_file_changes=max_file_changes,
+            path_match_style=path_match_style,
+            chunk_large_files=chunk_large_files,
+            context_mode=context_mode,
+            context_lines=context_lines,
+            include_signatures=include_signatures,
+            review_cache=review_cache,
+            shared_review_cache=shared_review_cache,
+            incremental=incremental,
+            output_mode=output_mode,
+            requests_per_minute=requests_per_minute,
+            tokens_per_minute=tokens_per_minute,
+            max_retries=max_retries,
+            hedge_after_seconds=hedge_after_seconds,
+            batch_small_files=batch_small_files,
+            batch_max_files=batch_max_files,
+            file_instructions=file_instructions,
         )
         openai.api_key = openai_token
+        self._token_counter = TiktokenTokenCounter(self._model_name)
 
-    def _generate_comment(self, latest_file: LatestFile, instructions: str) -> str:
-        header = self._get_header()
-        file = latest_file.file
-        print(f"Generating comment for file: {file.filename}")
-        commit = latest_file.commit
-        try:
-            file_content = self._github_pr.get_content_for_file(file, commit)
-
-            if self._ignore_files_with_content:
-                for ignore_content in self._ignore_files_with_content:
-                    if ignore_content in file_content:
-                        print(
-                            f"{file.filename}: File content contains {ignore_content}, skipping it"
-                        )
-                        return ""
-        except Exception as e:
-            print(f"Error while getting content for file: {e}")
-            return header.format(
-                file=file.filename,
-                sha=file.sha,
-                response=f"Error while getting content for file: {e}",
-            )
-
-        ai_input = f"""
-This is the whole file content:
+    def _build_ai_input(
+        self, latest_file: LatestFile, file_content: str, patch: str
+    ) -> str:
+        return f"""
+This is the content of the file {latest_file.file.filename}:
 ```
 {file_content}
 ```
 
 And these are the changes you need to review, they are in git diff format:
 ```
-{file.patch}
+{patch}
 ```
 """
 
-        tokens = self._get_number_of_tokens_in_content(ai_input)
-        if tokens == -1:
-            print(f"File is too long to generate a comment: {file.filename}")
-            return header.format(
-                file=file.filename,
-                sha=file.sha,
-                response="File is too long to generate a comment.",
-            )
-
-        try:
-            response = openai.ChatCompletion.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {"role": "system", "content": instructions},
-                    {"role": "user", "content": ai_input},
-                ],
-            )
+    def _get_messages(self, instructions: str, ai_input: str) -> List[dict]:
+        return [
+            {"role": "system", "content": instructions},
+            {"role": "user", "content": ai_input},
+        ]
 
-        except Exception as e:
-            if "maximum context length" in str(e):
-                print(f"File is too long to generate a comment: {file.filename}")
-                return header.format(
-                    file=file.filename,
-                    sha=file.sha,
-                    response="File is too long to generate a comment.",
-                )
-            else:
-                print(f"Error while generating information: {e}")
-                return header.format(
-                    file=file.filename,
-                    sha=file.sha,
-                    response=f"Error while generating information: {e}",
-                )
-
-        comment = response["choices"][0]["message"]["content"]
+    def _request_review(self, instructions: str, ai_input: str) -> str:
+        response = openai.ChatCompletion.create(
+            model=self._model_name,
+            messages=self._get_messages(instructions, ai_input),
+        )
+        return response["choices"][0]["message"]["content"]
 
-        final_comment = header.format(
-            file=file.filename, sha=file.sha, response=comment
+    async def _request_review_async(self, instructions: str, ai_input: str) -> str:
+        response = await openai.ChatCompletion.acreate(
+            model=self._model_name,
+            messages=self._get_messages(instructions, ai_input),
         )
-        print(f"Generated comment for file: {file.filename}")
-        return final_comment
+        return response["choices"][0]["message"]["content"]
+
+    def _is_retryable_error(self, error: Exception) -> bool:
+        if isinstance(
+            error,
+            (
+                openai.error.Timeout,
+                openai.error.APIConnectionError,
+                openai.error.ServiceUnavailableError,
+                openai.error.RateLimitError,
+            ),
+        ):
+            return True
+        return super()._is_retryable_error(error)
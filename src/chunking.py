@@ -0,0 +1,103 @@
+from dataclasses import dataclass
+from typing import Callable, List
+
+from diff_hunks import Hunk
+
+
+@dataclass
+class Chunk:
+    # Range of lines of the new file, 1-based and inclusive
+    start_line: int
+    end_line: int
+    content: str
+    hunks: List[Hunk]
+
+    def get_patch(self) -> str:
+        return "\n".join(hunk.get_text() for hunk in self.hunks)
+
+
+def _make_chunk(lines: List[str], start: int, end: int, hunks: List[Hunk]) -> Chunk:
+    return Chunk(
+        start_line=start,
+        end_line=end,
+        content="".join(lines[start - 1 : end]),
+        hunks=hunks,
+    )
+
+
+def _split_window(
+    lines: List[str],
+    start: int,
+    end: int,
+    hunk: Hunk,
+    fits: Callable[[Chunk], bool],
+) -> List[Chunk]:
+    # A single hunk that doesn't fit is split in the biggest pieces that fit, found with
+    # a binary search as the token count only grows with the number of lines
+    chunks = []
+    piece_start = start
+    while piece_start <= end:
+        low, high = piece_start, end
+        piece_end = piece_start - 1
+        while low <= high:
+            middle = (low + high) // 2
+            candidate = _make_chunk(
+                lines, piece_start, middle, [hunk.slice(piece_start, middle)]
+            )
+            if fits(candidate):
+                piece_end = middle
+                low = middle + 1
+            else:
+                high = middle - 1
+
+        if piece_end < piece_start:
+            print(f"Line {piece_start} is too long to be reviewed, skipping it")
+            piece_start += 1
+            continue
+
+        chunks.append(
+            _make_chunk(
+                lines, piece_start, piece_end, [hunk.slice(piece_start, piece_end)]
+            )
+        )
+        piece_start = piece_end + 1
+    return chunks
+
+
+def split_in_chunks(
+    content: str,
+    hunks: List[Hunk],
+    fits: Callable[[Chunk], bool],
+    context_lines: int = 20,
+) -> List[Chunk]:
+    # Builds windows around the changed lines of the file and merges the neighbour
+    # windows while they still fit in the token budget
+    lines = content.splitlines(keepends=True)
+    chunks: List[Chunk] = []
+    current = None
+    for hunk in hunks:
+        start = max(1, hunk.new_start - context_lines)
+        end = max(start, min(len(lines), hunk.new_end + context_lines))
+
+        if current is not None:
+            candidate = _make_chunk(
+                lines,
+                current.start_line,
+                max(current.end_line, end),
+                current.hunks + [hunk],
+            )
+            if fits(candidate):
+                current = candidate
+                continue
+            chunks.append(current)
+            current = None
+
+        candidate = _make_chunk(lines, start, end, [hunk])
+        if fits(candidate):
+            current = candidate
+        else:
+            chunks += _split_window(lines, start, end, hunk, fits)
+
+    if current is not None:
+        chunks.append(current)
+    return chunks
@@ -0,0 +1,79 @@
+import hashlib
+import json
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple
+
+METADATA_VERSION = 1
+METADATA_START = "<!--aixplain:"
+METADATA_END = "-->"
+
+FILE_COMMENT_KIND = "file"
+SUMMARY_COMMENT_KIND = "summary"
+
+
+def get_prompt_hash(instructions: str) -> str:
+    return hashlib.sha256(instructions.encode("utf-8")).hexdigest()[:16]
+
+
+@dataclass
+class CommentMetadata:
+    # State of a bot comment, stored as a hidden JSON block so the next runs can read it
+    # back without parsing the markdown
+    kind: str
+    file: str = ""
+    sha: str = ""
+    model: str = ""
+    prompt_hash: str = ""
+    # Seconds spent generating the review
+    duration: float = 0.0
+    # (file name, sha) of the files reviewed by the run and the PR head it reviewed,
+    # only in summary comments
+    files: List[Tuple[str, str]] = field(default_factory=list)
+    head_sha: str = ""
+    # 0 for comments written before the metadata block existed
+    version: int = METADATA_VERSION
+
+    def to_comment(self) -> str:
+        data = {"v": self.version, "k": self.kind}
+        if self.kind == SUMMARY_COMMENT_KIND:
+            data["files"] = [list(file) for file in self.files]
+            data["h"] = self.head_sha
+        else:
+            data.update(
+                f=self.file,
+                s=self.sha,
+                m=self.model,
+                p=self.prompt_hash,
+                t=round(self.duration, 2),
+            )
+        # ">" is escaped so a file name can never close the HTML comment
+        encoded = json.dumps(data, separators=(",", ":")).replace(">", "\\u003e")
+        return f"{METADATA_START}{encoded}{METADATA_END}"
+
+
+def parse_comment_metadata(body: str) -> Optional[CommentMetadata]:
+    # Returns None when the body has no metadata block, e.g. older comments
+    start = body.find(METADATA_START)
+    if start == -1:
+        return None
+    start += len(METADATA_START)
+    end = body.find(METADATA_END, start)
+    if end == -1:
+        return None
+
+    try:
+        data = json.loads(body[start:end])
+        return CommentMetadata(
+            version=int(data["v"]),
+            kind=data["k"],
+            file=data.get("f", ""),
+            sha=data.get("s", ""),
+            model=data.get("m", ""),
+            prompt_hash=data.get("p", ""),
+            duration=float(data.get("t", 0.0)),
+            files=[(name, sha) for name, sha in data.get("files", [])],
+            head_sha=data.get("h", ""),
+        )
+    except (ValueError, KeyError, TypeError):
+        print("Could not parse the comment metadata")
+        return None
@@ -0,0 +1,187 @@
+import re
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+HUNK_HEADER = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+
+
+@dataclass
+class HunkLine:
+    text: str
+    # Line of the new file the line belongs to, removed lines point to the next line
+    new_line: int
+    # Position in the patch as used by the GitHub review comments API
+    position: int
+
+    @property
+    def is_change(self) -> bool:
+        return self.text.startswith(("+", "-"))
+
+
+@dataclass
+class Hunk:
+    header: str
+    old_start: int
+    old_lines: int
+    new_start: int
+    new_lines: int
+    lines: List[HunkLine] = field(default_factory=list)
+
+    @property
+    def new_end(self) -> int:
+        return self.new_start + max(self.new_lines, 1) - 1
+
+    def get_text(self) -> str:
+        return "\n".join([self.header] + [line.text for line in self.lines])
+
+    def slice(self, start_line: int, end_line: int) -> "Hunk":
+        # Keeps only the lines that belong to the given range of the new file, with a
+        # header that counts the kept lines so the sliced patch is still valid
+        lines: List[HunkLine] = []
+        old_line, new_line = self.old_start, self.new_start
+        old_start, new_start = old_line, start_line
+        old_lines = new_lines = 0
+        for line in self.lines:
+            in_old = not line.text.startswith(("+", "\\"))
+            in_new = not line.text.startswith(("-", "\\"))
+            if start_line <= line.new_line <= end_line:
+                if not lines:
+                    old_start, new_start = old_line, new_line
+                lines.append(line)
+                old_lines += in_old
+                new_lines += in_new
+            old_line += in_old
+            new_line += in_new
+
+        section = self.header[HUNK_HEADER.match(self.header).end() :]
+        return Hunk(
+            header=f"@@ -{old_start},{old_lines} +{new_start},{new_lines} @@{section}",
+            old_start=old_start,
+            old_lines=old_lines,
+            new_start=new_start,
+            new_lines=new_lines,
+            lines=lines,
+        )
+
+
+def parse_hunks(patch: Optional[str]) -> List[Hunk]:
+    hunks: List[Hunk] = []
+    if not patch:
+        return hunks
+
+    new_line = 0
+    for position, text in enumerate(patch.splitlines()):
+        header = HUNK_HEADER.match(text)
+        if header:
+            old_start, old_lines, new_start, new_lines = header.groups()
+            hunks.append(
+                Hunk(
+                    header=text,
+                    old_start=int(old_start),
+                    old_lines=int(old_lines if old_lines is not None else 1),
+                    new_start=int(new_start),
+                    new_lines=int(new_lines if new_lines is not None else 1),
+                )
+            )
+            new_line = int(new_start)
+            continue
+        if not hunks:
+            continue
+
+        hunks[-1].lines.append(
+            HunkLine(text=text, new_line=new_line, position=position)
+        )
+        if not text.startswith(("-", "\\")):
+            new_line += 1
+    return hunks
+
+
+SIGNATURE = re.compile(
+    r"^\s*(?:export\s+|public\s+|private\s+|protected\s+|static\s+|async\s+)*"
+    r"(?:def|class|function|func|fn|interface|struct|impl|module|trait|enum)\b"
+)
+
+
+def _get_indentation(line: str) -> int:
+    return len(line) - len(line.lstrip())
+
+
+def _get_enclosing_signatures(lines: List[str], start_line: int) -> List[int]:
+    # Walks up from the line looking for definitions with less indentation, which are
+    # the function/class the line is in
+    first_line = next((line for line in lines[start_line - 1 :] if line.strip()), "")
+    indentation = _get_indentation(first_line)
+    signatures = []
+    for number in range(start_line - 1, 0, -1):
+        if indentation == 0:
+            break
+        line = lines[number - 1]
+        if (
+            line.strip()
+            and _get_indentation(line) < indentation
+            and SIGNATURE.match(line)
+        ):
+            signatures.append(number)
+            indentation = _get_indentation(line)
+    return list(reversed(signatures))
+
+
+def build_hunks_context(
+    content: str,
+    hunks: List[Hunk],
+    context_lines: int,
+    include_signatures: bool = True,
+) -> str:
+    # Only the changed lines of the file plus some lines around them, each line
+    # prefixed by its number. Windows that overlap are merged.
+    lines = content.splitlines()
+    windows: List[List[int]] = []
+    for hunk in hunks:
+        start = max(1, hunk.new_start - context_lines)
+        end = min(len(lines), hunk.new_end + context_lines)
+        if windows and start <= windows[-1][1] + 1:
+            windows[-1][1] = max(windows[-1][1], end)
+        else:
+            windows.append([start, end])
+
+    sections = []
+    for start, end in windows:
+        numbers = range(start, end + 1)
+        if include_signatures:
+            signatures = _get_enclosing_signatures(lines, start)
+            numbers = [number for number in signatures if number < start] + list(
+                numbers
+            )
+        section = []
+        previous = None
+        for number in numbers:
+            if previous is not None and number != previous + 1:
+                section.append("...")
+            section.append(f"{number}: {lines[number - 1]}")
+            previous = number
+        sections.append("\n".join(section))
+    return "\n...\n".join(sections)
+
+
+LINE_REFERENCE = re.compile(r"\blines?\s+(\d+)", re.IGNORECASE)
+
+
+def get_review_position(hunks: List[Hunk], text: str = "") -> Optional[int]:
+    # Position in the patch where a review comment is anchored: the first line the text
+    # mentions that is part of the diff, otherwise the first changed line
+    positions = {
+        line.new_line: line.position
+        for hunk in hunks
+        for line in hunk.lines
+        if not line.text.startswith(("-", "\\"))
+    }
+    for match in LINE_REFERENCE.finditer(text):
+        position = positions.get(int(match.group(1)))
+        if position is not None:
+            return position
+
+    for hunk in hunks:
+        for line in hunk.lines:
+            if line.is_change:
+                return line.position
+    return None
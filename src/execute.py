@@ -1,7 +1,18 @@
+import asyncio
 from typing import Optional, List
 
+from ai_assistent import AiAssistent
 from chatgpt import ChatGPT
+from github_graphql_pr import GithubGraphQLPR
 from github_pr import GithubPR
+from instructions_config import load_file_instructions
+from local_git_pr import LocalGitPR
+from review_cache import (
+    FILESYSTEM_BACKEND,
+    FileSystemCacheBackend,
+    ReviewCache,
+    create_cache_backend,
+)
 from google_gemini import GoogleGemini
 
 
@@ -20,36 +31,119 @@ def execute(
     instructions: str,
     google_project_name: str = "",
     google_model_name: str = "",
+    max_workers: int = 1,
+    async_mode: bool = False,
+    google_max_connections: int = 10,
+    google_keepalive_expiry: float = 60.0,
+    github_api: str = "rest",
+    walk_commits: bool = False,
+    bulk_content_download: bool = False,
+    local_repository_path: str = "",
+    max_file_changes: int = 0,
+    path_match_style: str = "fnmatch",
+    chunk_large_files: bool = True,
+    context_mode: str = "full",
+    context_lines: int = 10,
+    include_signatures: bool = True,
+    review_cache_dir: str = "",
+    review_cache_max_size_mb: int = 100,
+    shared_review_cache: str = "",
+    shared_review_cache_backend: str = FILESYSTEM_BACKEND,
+    shared_review_cache_ttl_hours: float = 0,
+    incremental: bool = False,
+    output_mode: str = "comments",
+    ai_requests_per_minute: int = 0,
+    ai_tokens_per_minute: int = 0,
+    ai_max_retries: int = 3,
+    ai_hedge_after_seconds: float = 0,
+    batch_small_files: bool = False,
+    batch_max_files: int = 10,
+    instructions_file: str = "",
 ):
     if openai_token is None and google_gemini_token is None:
         raise ValueError("You need to provide at least one AI Token")
 
     print(f"Github Repository: {github_repository}")
-    github_pr = GithubPR(
-        repository_name=github_repository,
-        github_token=github_token,
-        pr_number=pr_number,
-    )
+    if github_api == "local":
+        github_pr = LocalGitPR(
+            repository_name=github_repository,
+            github_token=github_token,
+            pr_number=pr_number,
+            repository_path=local_repository_path,
+        )
+    else:
+        github_pr_class = GithubGraphQLPR if github_api == "graphql" else GithubPR
+        github_pr = github_pr_class(
+            repository_name=github_repository,
+            github_token=github_token,
+            pr_number=pr_number,
+        )
 
     ignore_files_with_content_list = _generate_list_from_string(
         ignore_files_with_content
     )
     ignore_files_in_path_list = _generate_list_from_string(ignore_files_in_path)
     instructions_list = _generate_list_from_string(instructions)
+    file_instructions = (
+        load_file_instructions(instructions_file) if instructions_file else []
+    )
+
+    review_cache = None
+    if review_cache_dir:
+        print(f"Using review cache in {review_cache_dir}")
+        review_cache = ReviewCache(
+            FileSystemCacheBackend(
+                directory=review_cache_dir,
+                max_size_bytes=review_cache_max_size_mb * 1024 * 1024,
+            )
+        )
+
+    shared_cache = None
+    if shared_review_cache:
+        print(
+            f"Using shared review cache in {shared_review_cache} ({shared_review_cache_backend})"
+        )
+        shared_cache = ReviewCache(
+            create_cache_backend(
+                shared_review_cache_backend,
+                shared_review_cache,
+                max_size_bytes=review_cache_max_size_mb * 1024 * 1024,
+            ),
+            ttl_seconds=shared_review_cache_ttl_hours * 3600,
+        )
 
     if openai_token is not None and openai_token != "":
         print("Using ChatGPT")
-        chatgpt = ChatGPT(
+        ai_assistent: AiAssistent = ChatGPT(
             github_pr=github_pr,
             openai_token=openai_token,
             ignore_files_with_content=ignore_files_with_content_list,
             ignore_files_in_paths=ignore_files_in_path_list,
             instructions=instructions_list,
+            max_workers=max_workers,
+            walk_commits=walk_commits,
+            bulk_content_download=bulk_content_download,
+            max_file_changes=max_file_changes,
+            path_match_style=path_match_style,
+            chunk_large_files=chunk_large_files,
+            context_mode=context_mode,
+            context_lines=context_lines,
+            include_signatures=include_signatures,
+            review_cache=review_cache,
+            shared_review_cache=shared_cache,
+            incremental=incremental,
+            output_mode=output_mode,
+            requests_per_minute=ai_requests_per_minute,
+            tokens_per_minute=ai_tokens_per_minute,
+            max_retries=ai_max_retries,
+            hedge_after_seconds=ai_hedge_after_seconds,
+            batch_small_files=batch_small_files,
+            batch_max_files=batch_max_files,
+            file_instructions=file_instructions,
         )
-        chatgpt.execute()
     else:
         print("Using Google Gemini")
-        google_gemini = GoogleGemini(
+        ai_assistent = GoogleGemini(
             github_pr=github_pr,
             google_gemini_token=google_gemini_token,
             ignore_files_with_content=ignore_files_with_content_list,
@@ -57,6 +151,31 @@ def execute(
             instructions=instructions_list,
             google_project_name=google_project_name,
             model_name=google_model_name,
+            max_workers=max_workers,
+            max_connections=google_max_connections,
+            keepalive_expiry=google_keepalive_expiry,
+            walk_commits=walk_commits,
+            bulk_content_download=bulk_content_download,
+            max_file_changes=max_file_changes,
+            path_match_style=path_match_style,
+            chunk_large_files=chunk_large_files,
+            context_mode=context_mode,
+            context_lines=context_lines,
+            include_signatures=include_signatures,
+            review_cache=review_cache,
+            shared_review_cache=shared_cache,
+            incremental=incremental,
+            output_mode=output_mode,
+            requests_per_minute=ai_requests_per_minute,
+            tokens_per_minute=ai_tokens_per_minute,
+            max_retries=ai_max_retries,
+            hedge_after_seconds=ai_hedge_after_seconds,
+            batch_small_files=batch_small_files,
+            batch_max_files=batch_max_files,
+            file_instructions=file_instructions,
         )
 
-        google_gemini.execute()
+    if async_mode:
+        asyncio.run(ai_assistent.execute_async())
+    else:
+        ai_assistent.execute()
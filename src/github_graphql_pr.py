@@ -0,0 +1,225 @@
+import os
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+import requests
+from github.File import File
+
+from github_pr import GithubPR, PullRequestMetadata
+from github_scheduler import RateLimitedError
+
+PULL_REQUEST_QUERY = """
+query (
+  $owner: String!
+  $name: String!
+  $number: Int!
+  $pageSize: Int!
+  $commitsCursor: String
+  $commentsCursor: String
+  $withCommits: Boolean!
+  $withComments: Boolean!
+) {
+  repository(owner: $owner, name: $name) {
+    pullRequest(number: $number) {
+      title
+      author { login }
+      headRefOid
+      baseRefOid
+      commits(first: $pageSize, after: $commitsCursor) @include(if: $withCommits) {
+        pageInfo { hasNextPage endCursor }
+        nodes { commit { oid } }
+      }
+      comments(first: $pageSize, after: $commentsCursor) @include(if: $withComments) {
+        pageInfo { hasNextPage endCursor }
+        nodes { databaseId body }
+      }
+    }
+  }
+}
+"""
+
+
+@dataclass
+class GraphQLCommit:
+    sha: str
+    _github_pr: "GithubGraphQLPR" = field(repr=False)
+    _files: Optional[List[File]] = field(default=None, repr=False)
+
+    @property
+    def files(self) -> List[File]:
+        # GraphQL does not expose the files changed by a commit, they are loaded from
+        # REST only when someone actually needs them
+        if self._files is None:
+            self._files = self._github_pr.get_commit_files(self.sha)
+        return self._files
+
+
+@dataclass
+class GraphQLIssueComment:
+    id: int
+    body: str
+    _github_pr: "GithubGraphQLPR" = field(repr=False)
+
+    def delete(self) -> None:
+        self._github_pr.delete_comment_by_id(self.id)
+
+    def edit(self, body: str) -> None:
+        self._github_pr.edit_comment_by_id(self.id, body)
+        self.body = body
+
+
+@dataclass
+class _PullRequestData:
+    metadata: PullRequestMetadata
+    commits: List[GraphQLCommit]
+    comments: List[GraphQLIssueComment]
+
+
+class GithubGraphQLPR(GithubPR):
+    # Loads the commit list, the issue comments and the PR metadata with a few paginated
+    # GraphQL queries. File patches and blob shas are not available in GraphQL, so the
+    # file list still comes from REST.
+    PAGE_SIZE = 100
+    # A stalled connection fails instead of hanging the job until the runner kills it
+    REQUEST_TIMEOUT = 60
+    _session: requests.Session
+    _data: Optional[_PullRequestData]
+
+    def __init__(self, repository_name: str, pr_number: int, github_token: str):
+        super().__init__(
+            repository_name=repository_name,
+            pr_number=pr_number,
+            github_token=github_token,
+        )
+        self._graphql_url = os.getenv(
+            "GITHUB_GRAPHQL_URL", "https://api.github.com/graphql"
+        )
+        self._api_url = os.getenv("GITHUB_API_URL", "https://api.github.com")
+        self._session = requests.Session()
+        self._session.headers.update(
+            {
+                "Authorization": f"Bearer {github_token}",
+                "Accept": "application/vnd.github+json",
+            }
+        )
+        self._data = None
+
+    def _query(self, query: str, variables: Dict[str, Any]) -> Dict[str, Any]:
+        # GraphQL has its own points budget, so only the pacing and retries are shared
+        return self._scheduler.read(self._post_query, query, variables)
+
+    def _post_query(self, query: str, variables: Dict[str, Any]) -> Dict[str, Any]:
+        response = self._session.post(
+            self._graphql_url,
+            json={"query": query, "variables": variables},
+            timeout=self.REQUEST_TIMEOUT,
+        )
+        response.raise_for_status()
+        result = response.json()
+        errors = result.get("errors") or []
+        # GraphQL reports its rate limit as an error of a 200 response, it is raised
+        # as a rate limit so the scheduler retries it
+        if any(error.get("type") == "RATE_LIMITED" for error in errors):
+            raise RateLimitedError(
+                f"GraphQL rate limit exceeded: {errors}", response.headers
+            )
+        if errors:
+            raise ValueError(f"GraphQL query failed: {errors}")
+        return result["data"]
+
+    def _get_data(self) -> _PullRequestData:
+        with self._lock:
+            if self._data is None:
+                self._data = self._fetch_data()
+            return self._data
+
+    def _fetch_data(self) -> _PullRequestData:
+        owner, name = self._repository_name.split("/", 1)
+        variables: Dict[str, Any] = {
+            "owner": owner,
+            "name": name,
+            "number": self._pr_number,
+            "pageSize": self.PAGE_SIZE,
+            "commitsCursor": None,
+            "commentsCursor": None,
+            "withCommits": True,
+            "withComments": True,
+        }
+        metadata = None
+        commits = []
+        comments = []
+        # Connections that are fully read are dropped from the next queries
+        while variables["withCommits"] or variables["withComments"]:
+            pull_request = self._query(PULL_REQUEST_QUERY, variables)["repository"][
+                "pullRequest"
+            ]
+            if metadata is None:
+                metadata = PullRequestMetadata(
+                    title=pull_request["title"],
+                    author_login=(pull_request["author"] or {}).get("login", ""),
+                    head_sha=pull_request["headRefOid"],
+                    base_sha=pull_request["baseRefOid"],
+                )
+
+            if variables["withCommits"]:
+                connection = pull_request["commits"]
+                commits += [
+                    GraphQLCommit(sha=node["commit"]["oid"], _github_pr=self)
+                    for node in connection["nodes"]
+                ]
+                variables["withCommits"] = connection["pageInfo"]["hasNextPage"]
+                variables["commitsCursor"] = connection["pageInfo"]["endCursor"]
+
+            if variables["withComments"]:
+                connection = pull_request["comments"]
+                comments += [
+                    GraphQLIssueComment(
+                        id=node["databaseId"], body=node["body"], _github_pr=self
+                    )
+                    for node in connection["nodes"]
+                ]
+                variables["withComments"] = connection["pageInfo"]["hasNextPage"]
+                variables["commentsCursor"] = connection["pageInfo"]["endCursor"]
+
+        print(
+            f"Loaded {len(commits)} commits and {len(comments)} comments using GraphQL"
+        )
+        return _PullRequestData(metadata=metadata, commits=commits, comments=comments)
+
+    def get_metadata(self) -> PullRequestMetadata:
+        return self._get_data().metadata
+
+    def invalidate_cache(self) -> None:
+        super().invalidate_cache()
+        with self._lock:
+            self._data = None
+
+    def get_comments(self) -> List[GraphQLIssueComment]:
+        return list(self._get_data().comments)
+
+    def get_pr_commits(self) -> List[GraphQLCommit]:
+        return list(self._get_data().commits)
+
+    def get_head_commit(self) -> GraphQLCommit:
+        # Only the sha of the head commit is needed, so no REST call is made
+        return GraphQLCommit(sha=self.get_head_sha(), _github_pr=self)
+
+    def get_commit_files(self, sha: str) -> List[File]:
+        return list(self._repository.get_commit(sha).files)
+
+    def delete_comment_by_id(self, comment_id: int) -> None:
+        response = self._session.delete(
+            f"{self._api_url}/repos/{self._repository_name}/issues/comments/{comment_id}",
+            timeout=self.REQUEST_TIMEOUT,
+        )
+        self._scheduler.observe_headers(response.headers)
+        response.raise_for_status()
+
+    def edit_comment_by_id(self, comment_id: int, body: str) -> None:
+        response = self._session.patch(
+            f"{self._api_url}/repos/{self._repository_name}/issues/comments/{comment_id}",
+            json={"body": body},
+            timeout=self.REQUEST_TIMEOUT,
+        )
+        self._scheduler.observe_headers(response.headers)
+        response.raise_for_status()
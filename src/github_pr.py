@@ -1,9 +1,30 @@
-from typing import List
+import base64
+import tarfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from functools import partial
+from typing import Any, Callable, Dict, List, Optional, Tuple, TypeVar
 
+import requests
 from github import Github
 from github.Commit import Commit
 from github.File import File
 from github.IssueComment import IssueComment
+from github.PullRequest import PullRequest
+from github.PullRequestReview import PullRequestReview
+
+from github_scheduler import GithubRequestScheduler
+
+T = TypeVar("T")
+
+
+@dataclass
+class PullRequestMetadata:
+    title: str
+    author_login: str
+    head_sha: str
+    base_sha: str
 
 
 class GithubPR:
@@ -11,51 +32,219 @@ class GithubPR:
     _pr_number: int
     _github_token: str
     _github: Github
+    _pull_request: Optional[PullRequest]
+    _metadata: Optional[PullRequestMetadata]
+    _head_commit: Optional[Commit]
+    _lock: threading.Lock
+    _scheduler: GithubRequestScheduler
 
     def __init__(self, repository_name: str, pr_number: int, github_token: str):
         self._repository_name = repository_name
         self._pr_number = pr_number
         self._github_token = github_token
-        self._github = Github(github_token)
-        self._repository = self._github.get_repo(full_name_or_id=repository_name)
+        # Pacing and retries are done by the scheduler for all the calls, PyGithub's own
+        # throttling would serialize them and retry on top of it
+        self._github = Github(
+            github_token,
+            per_page=100,
+            retry=None,
+            seconds_between_requests=None,
+            seconds_between_writes=None,
+        )
+        self._scheduler = GithubRequestScheduler()
+        self._repository = self._read(
+            self._github.get_repo, full_name_or_id=repository_name
+        )
+        self._pull_request = None
+        self._metadata = None
+        self._head_commit = None
+        self._lock = threading.Lock()
+
+    def _read(self, function: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        try:
+            return self._scheduler.read(function, *args, **kwargs)
+        finally:
+            self._observe_rate_limit()
+
+    def _write(self, function: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        try:
+            return self._scheduler.write(function, *args, **kwargs)
+        finally:
+            self._observe_rate_limit()
+
+    def _create(self, function: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        try:
+            return self._scheduler.create(function, *args, **kwargs)
+        finally:
+            self._observe_rate_limit()
+
+    def _observe_rate_limit(self) -> None:
+        # PyGithub keeps the budget of the last response, reading it is free
+        requester = self._github.requester
+        remaining, limit = requester.rate_limiting
+        self._scheduler.observe(remaining, limit, requester.rate_limiting_resettime)
+
+    def _get_pull_request(self) -> PullRequest:
+        # The pull request is fetched only once, every other call reuses it
+        with self._lock:
+            if self._pull_request is None:
+                self._pull_request = self._read(
+                    self._repository.get_pull, self._pr_number
+                )
+            return self._pull_request
+
+    def get_metadata(self) -> PullRequestMetadata:
+        if self._metadata is None:
+            pull_request = self._get_pull_request()
+            self._metadata = PullRequestMetadata(
+                title=pull_request.title,
+                author_login=pull_request.user.login,
+                head_sha=pull_request.head.sha,
+                base_sha=pull_request.base.sha,
+            )
+        return self._metadata
+
+    def invalidate_cache(self) -> None:
+        # Forces the next call to fetch the pull request again, e.g. after a new push
+        with self._lock:
+            self._pull_request = None
+            self._metadata = None
+            self._head_commit = None
 
     def get_comments(self) -> List[IssueComment]:
-        result = []
-        comments = self._repository.get_pull(self._pr_number).get_issue_comments()
-        for comment in comments:
-            result.append(comment)
-        return result
+        # The pages are loaded inside the scheduled call. The pull request is resolved
+        # before it, so its own read doesn't take a second slot or multiply the retries.
+        pull_request = self._get_pull_request()
+        return self._read(lambda: list(pull_request.get_issue_comments()))
 
     def remove_old_comments(self, identifier: str) -> None:
         for comment in self.get_comments():
             if identifier in comment.body:
-                comment.delete()
+                self._write(comment.delete)
 
     def get_pr_commits(self) -> List[Commit]:
-        commits = self._repository.get_pull(self._pr_number).get_commits()
-        result = []
-        for commit in commits:
-            result.append(commit)
-        return result
+        pull_request = self._get_pull_request()
+        return self._read(lambda: list(pull_request.get_commits()))
 
     def get_files(self) -> List[File]:
-        files = self._repository.get_pull(self._pr_number).get_files()
-        result = []
-        for file in files:
-            result.append(file)
-        return result
+        pull_request = self._get_pull_request()
+        return self._read(lambda: list(pull_request.get_files()))
 
     def add_comments(self, comments: list):
+        pull_request = self._get_pull_request()
         for comment in comments:
-            self._repository.get_pull(self._pr_number).create_issue_comment(comment)
+            self._create(pull_request.create_issue_comment, comment)
+
+    def update_comments(
+        self,
+        edited: Optional[List[Tuple[IssueComment, str]]] = None,
+        created: Optional[List[str]] = None,
+        deleted: Optional[List[IssueComment]] = None,
+    ) -> None:
+        # Edits and deletions don't depend on each other and run concurrently, the
+        # scheduler limits and paces them. New comments are created one by one, in
+        # order, as GitHub asks for content creation to be serial.
+        writes = [partial(comment.edit, body) for comment, body in edited or []]
+        writes += [comment.delete for comment in deleted or []]
+        if writes:
+            with ThreadPoolExecutor(
+                max_workers=self._scheduler.MAX_CONCURRENT_WRITES
+            ) as executor:
+                for future in [executor.submit(self._write, write) for write in writes]:
+                    future.result()
+        if created:
+            self.add_comments(created)
+
+    def get_reviews(self) -> List[PullRequestReview]:
+        pull_request = self._get_pull_request()
+        return self._read(lambda: list(pull_request.get_reviews()))
+
+    def create_review(self, body: str, comments: List[Dict[str, Any]]) -> None:
+        # Everything is sent in a single request. The review is anchored to the reviewed
+        # head, so the positions still match if someone pushes in the meantime.
+        commit = self._read(self._repository.get_commit, self.get_head_sha())
+        self._create(
+            self._get_pull_request().create_review,
+            commit=commit,
+            body=body,
+            event="COMMENT",
+            comments=comments,
+        )
 
     def get_content_for_file(self, file: File, commit: Commit) -> str:
-        return self._repository.get_contents(
-            file.filename, ref=commit.sha
-        ).decoded_content.decode("utf-8")
+        content_file = self._read(
+            self._repository.get_contents, file.filename, ref=commit.sha
+        )
+        if content_file.encoding == "none":
+            # Files bigger than 1 MB don't have their content in the contents API,
+            # the git blob API supports them up to 100 MB
+            blob = self._read(self._repository.get_git_blob, content_file.sha)
+            return base64.b64decode(blob.content).decode("utf-8")
+        return content_file.decoded_content.decode("utf-8")
+
+    def get_contents_for_files(self, filenames: List[str], ref: str) -> Dict[str, str]:
+        return self._read(self._download_contents, filenames, ref)
+
+    def _download_contents(self, filenames: List[str], ref: str) -> Dict[str, str]:
+        # Downloads the tarball of the ref once and reads only the requested files from
+        # the stream. Files that are not in the archive (e.g. export-ignore in
+        # .gitattributes) or are not text are not in the result.
+        wanted = set(filenames)
+        result = {}
+        archive_url = self._repository.get_archive_link("tarball", ref=ref)
+        with requests.get(archive_url, stream=True, timeout=60) as response:
+            self._scheduler.observe_headers(response.headers)
+            response.raise_for_status()
+            response.raw.decode_content = True
+            with tarfile.open(fileobj=response.raw, mode="r|gz") as archive:
+                for member in archive:
+                    if not member.isfile():
+                        continue
+                    # The archive has a root folder named like owner-repo-sha
+                    path = member.name.split("/", 1)[-1]
+                    if path not in wanted:
+                        continue
+                    try:
+                        result[path] = (
+                            archive.extractfile(member).read().decode("utf-8")
+                        )
+                    except UnicodeDecodeError:
+                        print(f"{path}: File is not a text file, ignoring its content")
+                    if len(result) == len(wanted):
+                        break
+        return result
 
     def get_pr_title(self) -> str:
-        return self._repository.get_pull(self._pr_number).title
+        return self.get_metadata().title
 
     def get_pr_author_login(self) -> str:
-        return self._repository.get_pull(self._pr_number).user.login
+        return self.get_metadata().author_login
+
+    def get_head_sha(self) -> str:
+        return self.get_metadata().head_sha
+
+    def get_head_commit(self) -> Commit:
+        if self._head_commit is None:
+            self._head_commit = self._read(
+                self._repository.get_commit, self.get_head_sha()
+            )
+        return self._head_commit
+
+    def get_changed_files(self, base_sha: str, head_sha: str) -> Optional[List[File]]:
+        # Files changed between two versions of the PR. Returns None when the head
+        # doesn't just add commits on top of the base (force-push, rebase, merge of the
+        # target branch), as the diff would then have changes that aren't in the PR.
+        comparison = self._read(self._repository.compare, base_sha, head_sha)
+        if comparison.status == "identical":
+            return []
+        if comparison.status != "ahead":
+            return None
+        if self._read(
+            lambda: any(len(commit.parents) > 1 for commit in comparison.commits)
+        ):
+            return None
+        files = comparison.files
+        # The compare API only returns the first 300 files
+        if len(files) >= 300:
+            return None
+        return files
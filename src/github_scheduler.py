@@ -0,0 +1,232 @@
+import random
+import threading
+import time
+from typing import Any, Callable, Mapping, Optional, Tuple, TypeVar
+
+import requests
+from github import GithubException
+
+T = TypeVar("T")
+
+RETRY_STATUSES = (403, 429, 500, 502, 503, 504)
+# A create that failed with a server error may have been saved anyway, retrying it
+# could post the same comment twice. Rate limited requests are never processed.
+RATE_LIMIT_STATUSES = (403, 429)
+
+
+class RateLimitedError(Exception):
+    # A rate limit reported in the body of a successful response, like the RATE_LIMITED
+    # errors of GraphQL, which come with a 200 status
+    headers: Mapping[str, str]
+
+    def __init__(self, message: str, headers: Optional[Mapping[str, str]] = None):
+        super().__init__(message)
+        self.headers = headers or {}
+
+
+class TokenBucket:
+    # Allows bursts of up to "capacity" requests and then "rate" requests per second
+    _rate: float
+    _capacity: float
+    _tokens: float
+    _updated_at: float
+    _lock: threading.Lock
+
+    def __init__(self, rate: float, capacity: float):
+        self._rate = rate
+        self._capacity = capacity
+        self._tokens = capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def set_rate(self, rate: float) -> None:
+        with self._lock:
+            self._refill()
+            self._rate = rate
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(
+            self._capacity, self._tokens + (now - self._updated_at) * self._rate
+        )
+        self._updated_at = now
+
+    def acquire(self) -> None:
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self._rate
+            time.sleep(wait)
+
+
+class GithubRequestScheduler:
+    # Every GitHub call of a run goes through here. Reads and writes have their own
+    # concurrency limit and token bucket, writes are paced at about one per second as
+    # GitHub asks to avoid the secondary rate limits. The remaining budget reported by
+    # the responses slows the reads down before it runs out, and rate limited or failed
+    # calls are retried with a jittered exponential backoff.
+    READ_RATE = 10.0
+    READ_BURST = 20
+    WRITE_RATE = 1.0
+    WRITE_BURST = 4
+    MAX_CONCURRENT_READS = 8
+    MAX_CONCURRENT_WRITES = 4
+    MAX_RETRIES = 5
+    BASE_DELAY = 1.0
+    MAX_DELAY = 60.0
+    # Below this share of the budget the reads are spread until the budget resets
+    LOW_BUDGET_RATIO = 0.1
+
+    _reads: TokenBucket
+    _writes: TokenBucket
+    _read_slots: threading.BoundedSemaphore
+    _write_slots: threading.BoundedSemaphore
+    _lock: threading.Lock
+    _remaining: Optional[int]
+    _limit: Optional[int]
+    _reset_at: Optional[float]
+    _sleep: Callable[[float], None]
+
+    def __init__(self, sleep: Callable[[float], None] = time.sleep):
+        self._reads = TokenBucket(self.READ_RATE, self.READ_BURST)
+        self._writes = TokenBucket(self.WRITE_RATE, self.WRITE_BURST)
+        self._read_slots = threading.BoundedSemaphore(self.MAX_CONCURRENT_READS)
+        self._write_slots = threading.BoundedSemaphore(self.MAX_CONCURRENT_WRITES)
+        self._lock = threading.Lock()
+        self._remaining = None
+        self._limit = None
+        self._reset_at = None
+        self._sleep = sleep
+
+    def read(self, function: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        return self._run(
+            self._reads, self._read_slots, RETRY_STATUSES, function, *args, **kwargs
+        )
+
+    def write(self, function: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        # Idempotent writes, like edits and deletions
+        return self._run(
+            self._writes, self._write_slots, RETRY_STATUSES, function, *args, **kwargs
+        )
+
+    def create(self, function: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        # Writes that create something, only retried when they were rate limited
+        return self._run(
+            self._writes,
+            self._write_slots,
+            RATE_LIMIT_STATUSES,
+            function,
+            *args,
+            **kwargs,
+        )
+
+    def observe(self, remaining: int, limit: int, reset_at: float) -> None:
+        # Budget reported by the last response, reset_at is a unix timestamp
+        if limit <= 0:
+            return
+        with self._lock:
+            self._remaining = remaining
+            self._limit = limit
+            self._reset_at = reset_at
+
+        seconds_to_reset = max(1.0, reset_at - time.time())
+        if remaining < limit * self.LOW_BUDGET_RATIO:
+            rate = max(remaining, 1) / seconds_to_reset
+            print(
+                f"GitHub rate limit is low ({remaining}/{limit}), "
+                f"slowing down to {rate:.2f} requests per second"
+            )
+            self._reads.set_rate(min(self.READ_RATE, rate))
+        else:
+            self._reads.set_rate(self.READ_RATE)
+
+    def observe_headers(self, headers: Mapping[str, str]) -> None:
+        try:
+            self.observe(
+                int(headers["X-RateLimit-Remaining"]),
+                int(headers["X-RateLimit-Limit"]),
+                float(headers["X-RateLimit-Reset"]),
+            )
+        except (KeyError, TypeError, ValueError):
+            pass
+
+    def _wait_for_budget(self) -> None:
+        with self._lock:
+            remaining, reset_at = self._remaining, self._reset_at
+        if remaining is not None and remaining <= 0 and reset_at is not None:
+            wait = reset_at - time.time()
+            if wait > 0:
+                print(f"GitHub rate limit exhausted, waiting {wait:.0f}s for the reset")
+                self._sleep(min(wait, self.MAX_DELAY))
+
+    def _run(
+        self,
+        bucket: TokenBucket,
+        slots: threading.BoundedSemaphore,
+        retry_statuses: Tuple[int, ...],
+        function: Callable[..., T],
+        *args: Any,
+        **kwargs: Any,
+    ) -> T:
+        attempt = 0
+        while True:
+            self._wait_for_budget()
+            bucket.acquire()
+            try:
+                with slots:
+                    return function(*args, **kwargs)
+            except (GithubException, requests.HTTPError, RateLimitedError) as e:
+                delay = self._get_retry_delay(e, attempt, retry_statuses)
+                if delay is None:
+                    raise
+                attempt += 1
+                print(
+                    f"GitHub request failed ({e}), retry {attempt}/{self.MAX_RETRIES} "
+                    f"in {delay:.1f}s"
+                )
+                self._sleep(delay)
+
+    def _get_retry_delay(
+        self,
+        error: Exception,
+        attempt: int,
+        retry_statuses: Tuple[int, ...] = RETRY_STATUSES,
+    ) -> Optional[float]:
+        if attempt >= self.MAX_RETRIES:
+            return None
+        if isinstance(error, GithubException):
+            status, headers = error.status, error.headers or {}
+        elif isinstance(error, RateLimitedError):
+            status, headers = 429, error.headers
+        else:
+            response = error.response
+            if response is None:
+                return None
+            status, headers = response.status_code, response.headers
+        if status not in retry_statuses:
+            return None
+
+        headers = {key.lower(): value for key, value in headers.items()}
+        if "retry-after" in headers:
+            try:
+                return min(float(headers["retry-after"]), self.MAX_DELAY)
+            except ValueError:
+                pass
+        if (
+            headers.get("x-ratelimit-remaining") == "0"
+            and "x-ratelimit-reset" in headers
+        ):
+            try:
+                wait = float(headers["x-ratelimit-reset"]) - time.time()
+                return min(max(wait, 1.0), self.MAX_DELAY)
+            except ValueError:
+                pass
+        # A 403 that isn't a rate limit is a permission problem, retrying won't help
+        if status == 403 and "rate limit" not in str(error).lower():
+            return None
+
+        delay = min(self.BASE_DELAY * 2**attempt, self.MAX_DELAY)
+        return delay / 2 + random.uniform(0, delay / 2)
@@ -1,21 +1,48 @@
-from typing import List
+import asyncio
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
 
-from github.File import File
+import httpx
 from google import genai
-from google.genai import types
+from google.genai import errors, types
 
 from google.genai.types import GenerateContentResponse
 
-from ai_assistent import AiAssistent, LatestFile
+from ai_assistent import (
+    COMMENTS_OUTPUT,
+    FULL_CONTEXT,
+    AiAssistent,
+    FileInstructions,
+    LatestFile,
+)
+from comment_metadata import get_prompt_hash
 from github_pr import GithubPR
+from path_matcher import FNMATCH_STYLE
+from review_cache import ReviewCache
+
+
+SYSTEM_PREAMBLE = "You are a code reviewer, and you are reviewing a PR that was published in GitHub by one of your colleagues."
 
 
 class GoogleGemini(AiAssistent):
     MAX_TOKENS = 10000
+    # Explicit caches below the minimum size of the models are rejected by the API
+    CACHED_CONTENT_MIN_TOKENS = 4096
+    CACHED_CONTENT_TTL_SECONDS = 900
+    # A cache about to expire is replaced, so no request points to an expired one
+    CACHED_CONTENT_REFRESH_SECONDS = 60
     _google_gemini_token: str
     _google_project_name: str
     _model_name: str
     _google_project_location: str
+    _max_connections: int
+    _keepalive_expiry: float
+    _client: Optional[genai.Client]
+    _client_lock: threading.Lock
+    # Cache name and monotonic expiry time by prompt hash
+    _cached_contents: Dict[str, Tuple[Optional[str], float]]
+    _cached_contents_lock: threading.Lock
 
     def __init__(
         self,
@@ -27,107 +54,237 @@ class GoogleGemini(AiAssistent):
         google_project_name="",
         model_name="gemini-2.0-flash-001",
         google_project_location="us-central1",
+        max_workers: int = 1,
+        max_connections: int = 10,
+        keepalive_expiry: float = 60.0,
+        walk_commits: bool = False,
+        bulk_content_download: bool = False,
+        max_file_changes: int = 0,
+        path_match_style: str = FNMATCH_STYLE,
+        chunk_large_files: bool = True,
+        context_mode: str = FULL_CONTEXT,
+        context_lines: int = 10,
+        include_signatures: bool = True,
+        review_cache: Optional[ReviewCache] = None,
+        shared_review_cache: Optional[ReviewCache] = None,
+        incremental: bool = False,
+        output_mode: str = COMMENTS_OUTPUT,
+        requests_per_minute: int = 0,
+        tokens_per_minute: int = 0,
+        max_retries: int = 3,
+        hedge_after_seconds: float = 0,
+        batch_small_files: bool = False,
+        batch_max_files: int = 10,
+        file_instructions: Optional[List[FileInstructions]] = None,
     ):
         super().__init__(
             github_pr=github_pr,
             ignore_files_with_content=ignore_files_with_content,
             ignore_files_in_paths=ignore_files_in_paths,
             instructions=instructions,
+            max_workers=max_workers,
+            walk_commits=walk_commits,
+            bulk_content_download=bulk_content_download,
+            max_file_changes=max_file_changes,
+            path_match_style=path_match_style,
+            chunk_large_files=chunk_large_files,
+            context_mode=context_mode,
+            context_lines=context_lines,
+            include_signatures=include_signatures,
+            review_cache=review_cache,
+            shared_review_cache=shared_review_cache,
+            incremental=incremental,
+            output_mode=output_mode,
+            requests_per_minute=requests_per_minute,
+            tokens_per_minute=tokens_per_minute,
+            max_retries=max_retries,
+            hedge_after_seconds=hedge_after_seconds,
+            batch_small_files=batch_small_files,
+            batch_max_files=batch_max_files,
+            file_instructions=file_instructions,
         )
         self._google_gemini_token = google_gemini_token
         self._google_project_name = google_project_name
         self._model_name = model_name
         self._google_project_location = google_project_location
+        self._max_connections = max(max_connections, self._max_workers)
+        self._keepalive_expiry = keepalive_expiry
+        self._client = None
+        self._client_lock = threading.Lock()
+        self._cached_contents = {}
+        self._cached_contents_lock = threading.Lock()
 
     def get_client(self) -> genai.Client:
-        return genai.Client(
-            vertexai=True,
-            project=self._google_project_name,
-            location=self._google_project_location,
-        )
-
-    def _generate_comment(self, latest_file: LatestFile, instructions: str) -> str:
-        header = self._get_header()
-        file: File = latest_file.file
-        print(f"Generating comment for file: {file.filename}")
-        ai_input = latest_file.get_file_content(self._github_pr)
-
-        ai_input = f"""
-You are a code reviewer, and you are reviewing a PR that was published in GitHub by one of your colleagues. 
+        # The client is created once per run, so credential discovery and the TLS
+        # handshakes are shared by all the files instead of being paid for each one
+        with self._client_lock:
+            if self._client is None:
+                limits = httpx.Limits(
+                    max_connections=self._max_connections,
+                    max_keepalive_connections=self._max_connections,
+                    keepalive_expiry=self._keepalive_expiry,
+                )
+                self._client = genai.Client(
+                    vertexai=True,
+                    project=self._google_project_name,
+                    location=self._google_project_location,
+                    http_options=types.HttpOptions(
+                        client_args={"limits": limits},
+                        async_client_args={"limits": limits},
+                    ),
+                )
+        return self._client
 
-This is the modified file that you need to review:
+    def _build_ai_input(
+        self, latest_file: LatestFile, file_content: str, patch: str
+    ) -> str:
+        # The instructions go in the system instruction, see _get_system_instruction
+        return f"""
+This is the modified file {latest_file.file.filename} that you need to review:
 ```
-{ai_input}
+{file_content}
 ```
 
 This is the patch from what changed from the git file in main:
 ```
-{file.patch}
+{patch}
 ```
-
-Based on this: 
-{instructions}
 """
 
-        tokens = self._get_number_of_tokens_in_content(ai_input)
-        if tokens == -1:
-            print(f"File is too long to generate a comment: {file.filename}")
-            return header.format(
-                file=file.filename,
-                sha=file.sha,
-                response="File is too long to generate a comment.",
-            )
+    def _get_system_instruction(self, instructions: str) -> str:
+        return f"{SYSTEM_PREAMBLE}\n\n{instructions}"
 
-        try:
-            generate_content_config = types.GenerateContentConfig(
-                temperature=1,
-                top_p=0.95,
-                max_output_tokens=8192,
-                response_modalities=["TEXT"],
-                safety_settings=[
-                    types.SafetySetting(
-                        category="HARM_CATEGORY_HATE_SPEECH", threshold="OFF"
-                    ),
-                    types.SafetySetting(
-                        category="HARM_CATEGORY_DANGEROUS_CONTENT", threshold="OFF"
-                    ),
-                    types.SafetySetting(
-                        category="HARM_CATEGORY_SEXUALLY_EXPLICIT", threshold="OFF"
-                    ),
-                    types.SafetySetting(
-                        category="HARM_CATEGORY_HARASSMENT", threshold="OFF"
-                    ),
-                ],
-            )
+    def _get_cached_content(self, instructions: str) -> Optional[str]:
+        # Name of the explicit cache holding the system instruction, created once per
+        # instructions. None when it is too small to be cached or the cache can't be
+        # created, then the system instruction is sent with the request and the
+        # implicit caching of the provider still applies to this stable prefix.
+        key = get_prompt_hash(instructions)
+        with self._cached_contents_lock:
+            name, expires_at = self._cached_contents.get(key, (None, 0.0))
+            if time.monotonic() < expires_at - self.CACHED_CONTENT_REFRESH_SECONDS:
+                return name
+
+            name = None
+            # Instructions that can't be cached are not tried again
+            expires_at = float("inf")
+            system_instruction = self._get_system_instruction(instructions)
+            if (
+                self._token_counter.count(system_instruction)
+                >= self.CACHED_CONTENT_MIN_TOKENS
+            ):
+                try:
+                    name = (
+                        self.get_client()
+                        .caches.create(
+                            model=self._model_name,
+                            config=types.CreateCachedContentConfig(
+                                system_instruction=system_instruction,
+                                ttl=f"{self.CACHED_CONTENT_TTL_SECONDS}s",
+                            ),
+                        )
+                        .name
+                    )
+                    expires_at = time.monotonic() + self.CACHED_CONTENT_TTL_SECONDS
+                    print(f"Cached the instructions {key} in {name}")
+                except Exception as e:
+                    print(
+                        f"Could not cache the instructions, sending them instead: {e}"
+                    )
+            self._cached_contents[key] = (name, expires_at)
+            return name
+
+    def _forget_cached_content(self, instructions: str, name: str) -> None:
+        # The cache is gone before its expiry, e.g. deleted, the next request creates
+        # a new one
+        key = get_prompt_hash(instructions)
+        with self._cached_contents_lock:
+            if self._cached_contents.get(key, (None, 0.0))[0] == name:
+                del self._cached_contents[key]
 
+    @staticmethod
+    def _is_missing_cache_error(
+        error: Exception, config: types.GenerateContentConfig
+    ) -> bool:
+        return (
+            config.cached_content is not None
+            and isinstance(error, errors.ClientError)
+            and error.code in (403, 404)
+        )
+
+    def _get_generate_content_config(
+        self, instructions: str
+    ) -> types.GenerateContentConfig:
+        cached_content = self._get_cached_content(instructions)
+        return types.GenerateContentConfig(
+            system_instruction=(
+                None if cached_content else self._get_system_instruction(instructions)
+            ),
+            cached_content=cached_content,
+            temperature=1,
+            top_p=0.95,
+            max_output_tokens=8192,
+            response_modalities=["TEXT"],
+            safety_settings=[
+                types.SafetySetting(
+                    category="HARM_CATEGORY_HATE_SPEECH", threshold="OFF"
+                ),
+                types.SafetySetting(
+                    category="HARM_CATEGORY_DANGEROUS_CONTENT", threshold="OFF"
+                ),
+                types.SafetySetting(
+                    category="HARM_CATEGORY_SEXUALLY_EXPLICIT", threshold="OFF"
+                ),
+                types.SafetySetting(
+                    category="HARM_CATEGORY_HARASSMENT", threshold="OFF"
+                ),
+            ],
+        )
+
+    def _request_review(self, instructions: str, ai_input: str) -> str:
+        config = self._get_generate_content_config(instructions)
+        try:
             response: GenerateContentResponse = (
                 self.get_client().models.generate_content(
-                    model=self._model_name,
-                    contents=ai_input,
-                    config=generate_content_config,
+                    model=self._model_name, contents=ai_input, config=config
                 )
             )
-
         except Exception as e:
-            if "maximum context length" in str(e):
-                print(f"File is too long to generate a comment: {file.filename}")
-                return header.format(
-                    file=file.filename,
-                    sha=file.sha,
-                    response="File is too long to generate a comment.",
-                )
-            else:
-                print(f"Error while generating information: {e}")
-                return header.format(
-                    file=file.filename,
-                    sha=file.sha,
-                    response=f"Error while generating information: {e}",
-                )
-
-        comment = response.text.strip()
+            if not self._is_missing_cache_error(e, config):
+                raise
+            print(f"Cached instructions {config.cached_content} not found: {e}")
+            self._forget_cached_content(instructions, config.cached_content)
+            response = self.get_client().models.generate_content(
+                model=self._model_name,
+                contents=ai_input,
+                config=self._get_generate_content_config(instructions),
+            )
+        return response.text.strip()
 
-        final_comment = header.format(
-            file=file.filename, sha=file.sha, response=comment
+    async def _request_review_async(self, instructions: str, ai_input: str) -> str:
+        config = await asyncio.to_thread(
+            self._get_generate_content_config, instructions
         )
-        print(f"Generated comment for file: {file.filename}")
-        return final_comment
+        try:
+            response: GenerateContentResponse = (
+                await self.get_client().aio.models.generate_content(
+                    model=self._model_name, contents=ai_input, config=config
+                )
+            )
+        except Exception as e:
+            if not self._is_missing_cache_error(e, config):
+                raise
+            print(f"Cached instructions {config.cached_content} not found: {e}")
+            self._forget_cached_content(instructions, config.cached_content)
+            config = await asyncio.to_thread(
+                self._get_generate_content_config, instructions
+            )
+            response = await self.get_client().aio.models.generate_content(
+                model=self._model_name, contents=ai_input, config=config
+            )
+        return response.text.strip()
+
+    def _is_retryable_error(self, error: Exception) -> bool:
+        if isinstance(error, httpx.TransportError):
+            return True
+        return super()._is_retryable_error(error)
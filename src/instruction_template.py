@@ -0,0 +1,41 @@
+import re
+from typing import List, Set
+
+FILE_NAME_SLOT = "file_name"
+FILE_SUFFIX_SLOT = "file_suffix"
+
+SLOT_PATTERN = re.compile(r"\{(file_name|file_suffix)\}")
+
+
+class InstructionTemplate:
+    # Instructions split once around their {file_name} and {file_suffix} slots, so
+    # rendering them for a file joins a few parts instead of copying the whole text for
+    # each placeholder. Any other brace in the text is kept as it is.
+    _parts: List[str]
+    _slots: List[str]
+
+    def __init__(self, text: str):
+        # The parts are the text around the slots, one more than the slots
+        self._parts = []
+        self._slots = []
+        start = 0
+        for match in SLOT_PATTERN.finditer(text):
+            self._parts.append(text[start : match.start()])
+            self._slots.append(match.group(1))
+            start = match.end()
+        self._parts.append(text[start:])
+
+    @property
+    def slots(self) -> Set[str]:
+        return set(self._slots)
+
+    def render(self, file_name: str = "", file_suffix: str = "") -> str:
+        if not self._slots:
+            return self._parts[0]
+
+        values = {FILE_NAME_SLOT: file_name, FILE_SUFFIX_SLOT: file_suffix}
+        rendered = [self._parts[0]]
+        for slot, part in zip(self._slots, self._parts[1:]):
+            rendered.append(values[slot])
+            rendered.append(part)
+        return "".join(rendered)
@@ -0,0 +1,81 @@
+import tomllib
+from typing import List
+
+from ai_assistent import FULL_CONTEXT, HUNKS_CONTEXT, FileInstructions
+
+ALLOWED_KEYS = {
+    "file_match",
+    "instructions",
+    "specifics",
+    "context_mode",
+    "context_lines",
+}
+
+
+def load_file_instructions(path: str) -> List[FileInstructions]:
+    # Reads the per path instructions from a TOML file like:
+    #
+    #   [[instructions]]
+    #   file_match = "migrations/*.sql"
+    #   specifics = "Check that the migration can run without locking the tables."
+    #   context_mode = "hunks"
+    #
+    # "specifics" is added to the default instructions, "instructions" replaces them
+    # and can use the {file_name} and {file_suffix} slots. The first matching entry
+    # wins, before the default instructions.
+    with open(path, "rb") as config_file:
+        try:
+            config = tomllib.load(config_file)
+        except tomllib.TOMLDecodeError as e:
+            raise ValueError(f"Invalid instructions file {path}: {e}") from e
+
+    entries = config.get("instructions", [])
+    if not isinstance(entries, list):
+        raise ValueError(f"{path}: instructions must be an array of tables")
+
+    result = []
+    for number, entry in enumerate(entries, start=1):
+        if not isinstance(entry, dict):
+            raise ValueError(f"{path}: instructions {number} must be a table")
+        unknown_keys = set(entry) - ALLOWED_KEYS
+        if unknown_keys:
+            raise ValueError(
+                f"{path}: unknown keys in instructions {number}: "
+                f"{', '.join(sorted(unknown_keys))}"
+            )
+        if not entry.get("file_match"):
+            raise ValueError(f"{path}: instructions {number} has no file_match")
+        if bool(entry.get("instructions")) == bool(entry.get("specifics")):
+            raise ValueError(
+                f"{path}: instructions {number} needs either instructions or specifics"
+            )
+        context_mode = entry.get("context_mode")
+        if context_mode not in (None, FULL_CONTEXT, HUNKS_CONTEXT):
+            raise ValueError(
+                f"{path}: unknown context_mode in instructions {number}: {context_mode}"
+            )
+
+        context_lines = entry.get("context_lines")
+        # bool is an int in Python, "true" is not a number of lines
+        if context_lines is not None and (
+            not isinstance(context_lines, int)
+            or isinstance(context_lines, bool)
+            or context_lines < 0
+        ):
+            raise ValueError(
+                f"{path}: context_lines in instructions {number} must be a "
+                f"non-negative integer: {context_lines!r}"
+            )
+
+        result.append(
+            FileInstructions(
+                file_match=entry["file_match"],
+                instructions=entry.get("instructions", ""),
+                specifics=entry.get("specifics", ""),
+                context_mode=context_mode,
+                context_lines=context_lines,
+            )
+        )
+
+    print(f"Loaded {len(result)} instructions from {path}")
+    return result
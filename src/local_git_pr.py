@@ -0,0 +1,242 @@
+import json
+import os
+import subprocess
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from github_pr import GithubPR, PullRequestMetadata
+
+GIT_STATUSES = {
+    "A": "added",
+    "M": "modified",
+    "D": "removed",
+    "R": "renamed",
+    "C": "copied",
+    "T": "changed",
+}
+
+
+@dataclass
+class LocalFile:
+    filename: str
+    sha: str
+    status: str
+    patch: Optional[str]
+    previous_filename: Optional[str] = None
+    additions: int = 0
+    deletions: int = 0
+
+    @property
+    def changes(self) -> int:
+        return self.additions + self.deletions
+
+
+@dataclass
+class LocalCommit:
+    sha: str
+    _github_pr: "LocalGitPR" = field(repr=False)
+    _files: Optional[List[LocalFile]] = field(default=None, repr=False)
+
+    @property
+    def files(self) -> List[LocalFile]:
+        if self._files is None:
+            self._files = self._github_pr.get_commit_files(self.sha)
+        return self._files
+
+
+class LocalGitPR(GithubPR):
+    # Reads the PR files, contents and commits from a local checkout using git plumbing
+    # commands, the GitHub API is only used for the comments. The checkout needs the
+    # history between the base and head commits (actions/checkout with fetch-depth: 0);
+    # when it is not available the REST API is used for everything.
+    _repository_path: str
+    _local: bool
+
+    def __init__(
+        self,
+        repository_name: str,
+        pr_number: int,
+        github_token: str,
+        repository_path: str = "",
+        base_sha: str = "",
+        head_sha: str = "",
+    ):
+        super().__init__(
+            repository_name=repository_name,
+            pr_number=pr_number,
+            github_token=github_token,
+        )
+        self._repository_path = (
+            repository_path or os.getenv("GITHUB_WORKSPACE") or os.getcwd()
+        )
+        self._merge_base = ""
+        if base_sha and head_sha:
+            self._metadata = PullRequestMetadata(
+                title="", author_login="", head_sha=head_sha, base_sha=base_sha
+            )
+        else:
+            self._metadata = self._load_event_metadata()
+        self._local = self._prepare_checkout()
+
+    def _git(self, *args: str) -> str:
+        # safe.directory is needed because the action container does not run with the
+        # same user that owns the checkout
+        return subprocess.run(
+            ["git", "-c", "safe.directory=*", *args],
+            cwd=self._repository_path,
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout
+
+    def _load_event_metadata(self) -> Optional[PullRequestMetadata]:
+        # The pull_request event payload already has the PR metadata, so there is no
+        # need to ask the API for it
+        event_path = os.getenv("GITHUB_EVENT_PATH", "")
+        if not event_path or not os.path.isfile(event_path):
+            return None
+
+        with open(event_path) as event_file:
+            pull_request = json.load(event_file).get("pull_request") or {}
+        if pull_request.get("number") != self._pr_number:
+            return None
+
+        return PullRequestMetadata(
+            title=pull_request["title"],
+            author_login=pull_request["user"]["login"],
+            head_sha=pull_request["head"]["sha"],
+            base_sha=pull_request["base"]["sha"],
+        )
+
+    def _has_commit(self, sha: str) -> bool:
+        try:
+            self._git("cat-file", "-e", f"{sha}^{{commit}}")
+            return True
+        except subprocess.CalledProcessError:
+            return False
+
+    def _prepare_checkout(self) -> bool:
+        try:
+            metadata = self.get_metadata()
+            missing = [
+                sha
+                for sha in (metadata.base_sha, metadata.head_sha)
+                if not self._has_commit(sha)
+            ]
+            if missing:
+                print(f"Fetching missing commits: {missing}")
+                self._git("fetch", "--no-tags", "origin", *missing)
+            self._merge_base = self._git(
+                "merge-base", metadata.base_sha, metadata.head_sha
+            ).strip()
+            return True
+        except (OSError, subprocess.CalledProcessError) as e:
+            print(f"Local checkout can't be used, falling back to the GitHub API: {e}")
+            return False
+
+    def _diff(self, from_ref: str, to_ref: str) -> List[LocalFile]:
+        raw = self._git("diff", "--raw", "-M", "--no-abbrev", "-z", from_ref, to_ref)
+        patches = self._git("diff", "-M", from_ref, to_ref)
+
+        files = []
+        entries = raw.split("\0")
+        index = 0
+        while index < len(entries) and entries[index].startswith(":"):
+            _, _, old_sha, new_sha, status = entries[index][1:].split(" ")
+            if status[0] in ("R", "C"):
+                previous_filename, filename = entries[index + 1], entries[index + 2]
+                index += 3
+            else:
+                previous_filename, filename = None, entries[index + 1]
+                index += 2
+            files.append(
+                LocalFile(
+                    filename=filename,
+                    sha=old_sha if status[0] == "D" else new_sha,
+                    status=GIT_STATUSES.get(status[0], "modified"),
+                    patch=None,
+                    previous_filename=previous_filename,
+                )
+            )
+
+        # git prints one "diff --git" section per file, in the same order as --raw.
+        # GitHub patches only have the hunks, without the file headers.
+        sections = patches.split("\ndiff --git ")
+        for file, section in zip(files, sections):
+            hunks_start = section.find("\n@@")
+            if hunks_start != -1:
+                file.patch = section[hunks_start + 1 :].rstrip("\n")
+                lines = file.patch.splitlines()
+                file.additions = sum(1 for line in lines if line.startswith("+"))
+                file.deletions = sum(1 for line in lines if line.startswith("-"))
+        return files
+
+    def get_files(self) -> List[LocalFile]:
+        if not self._local:
+            return super().get_files()
+        return self._diff(self._merge_base, self.get_head_sha())
+
+    def get_pr_commits(self) -> List[LocalCommit]:
+        if not self._local:
+            return super().get_pr_commits()
+        shas = self._git(
+            "rev-list", "--reverse", f"{self._merge_base}..{self.get_head_sha()}"
+        ).split()
+        return [LocalCommit(sha=sha, _github_pr=self) for sha in shas]
+
+    def get_head_commit(self) -> LocalCommit:
+        if not self._local:
+            return super().get_head_commit()
+        return LocalCommit(sha=self.get_head_sha(), _github_pr=self)
+
+    def get_commit_files(self, sha: str) -> List[LocalFile]:
+        return self._diff(f"{sha}^", sha)
+
+    def get_changed_files(
+        self, base_sha: str, head_sha: str
+    ) -> Optional[List[LocalFile]]:
+        if not self._local:
+            return super().get_changed_files(base_sha, head_sha)
+        try:
+            if not self._has_commit(base_sha):
+                self._git("fetch", "--no-tags", "origin", base_sha)
+            self._git("merge-base", "--is-ancestor", base_sha, head_sha)
+        except (OSError, subprocess.CalledProcessError):
+            return None
+        if self._git("rev-list", "--merges", f"{base_sha}..{head_sha}").strip():
+            return None
+        return self._diff(base_sha, head_sha)
+
+    def get_content_for_file(self, file: LocalFile, commit: LocalCommit) -> str:
+        if not self._local:
+            return super().get_content_for_file(file, commit)
+        return self._git("show", f"{commit.sha}:{file.filename}")
+
+    def get_contents_for_files(self, filenames: List[str], ref: str) -> Dict[str, str]:
+        if not self._local:
+            return super().get_contents_for_files(filenames, ref)
+
+        # cat-file --batch prints "<sha> <type> <size>\n<content>\n" for each object
+        output = subprocess.run(
+            ["git", "-c", "safe.directory=*", "cat-file", "--batch"],
+            cwd=self._repository_path,
+            input="".join(f"{ref}:{filename}\n" for filename in filenames).encode(),
+            capture_output=True,
+            check=True,
+        ).stdout
+        result = {}
+        position = 0
+        for filename in filenames:
+            header_end = output.index(b"\n", position)
+            header = output[position:header_end].split(b" ")
+            position = header_end + 1
+            if header[-1] == b"missing":
+                continue
+            size = int(header[2])
+            content = output[position : position + size]
+            position += size + 1
+            try:
+                result[filename] = content.decode("utf-8")
+            except UnicodeDecodeError:
+                print(f"{filename}: File is not a text file, ignoring its content")
+        return result
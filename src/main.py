@@ -26,8 +26,151 @@ parser.add_argument(
     help="Instructions for the model. List of instructions separated by ';'. Example: 'python code;generate comment'",
     default="",
 )
-parser.add_argument("--google_ai_model", help="AI model to use", default="gemini-2.0-flash-001")
+parser.add_argument(
+    "--google_ai_model", help="AI model to use", default="gemini-2.0-flash-001"
+)
 parser.add_argument("--google_project_name", help="Google Project Name", default="")
+parser.add_argument(
+    "--max_workers",
+    help="Number of files reviewed in parallel. Use 1 to review them one by one.",
+    default=1,
+)
+parser.add_argument(
+    "--async_mode",
+    help="Use the asyncio clients, so GitHub and AI calls can overlap. Example: 'true'",
+    default="false",
+)
+parser.add_argument(
+    "--google_max_connections",
+    help="Size of the HTTP connection pool used by the Google Gemini client",
+    default=10,
+)
+parser.add_argument(
+    "--google_keepalive_expiry",
+    help="Seconds an idle Google Gemini connection is kept open for reuse",
+    default=60,
+)
+parser.add_argument(
+    "--github_api",
+    help="API used to read the PR files, commits and comments. Options: 'rest', 'graphql', 'local' (local git checkout)",
+    default="rest",
+)
+parser.add_argument(
+    "--walk_commits",
+    help="Find the latest version of each file walking every PR commit instead of using the PR head. Example: 'true'",
+    default="false",
+)
+
+parser.add_argument(
+    "--bulk_content_download",
+    help="Download the content of all files in a single archive instead of one request per file. Example: 'true'",
+    default="false",
+)
+parser.add_argument(
+    "--local_repository_path",
+    help="Path of the local checkout used when github_api is 'local'. Defaults to GITHUB_WORKSPACE",
+    default="",
+)
+parser.add_argument(
+    "--max_file_changes",
+    help="Files with more changed lines than this are not reviewed. Use 0 for no limit",
+    default=0,
+)
+parser.add_argument(
+    "--path_match_style",
+    help="How ignore_files_in_paths patterns are matched. Options: 'fnmatch', 'gitignore' (supports ** and ! negation)",
+    default="fnmatch",
+)
+parser.add_argument(
+    "--chunk_large_files",
+    help="Review files that are too long for the AI model in chunks around the changes. Example: 'true'",
+    default="true",
+)
+parser.add_argument(
+    "--context_mode",
+    help="What is sent to the AI model. Options: 'full' (whole file), 'hunks' (only the changes and the lines around them)",
+    default="full",
+)
+parser.add_argument(
+    "--context_lines",
+    help="Number of lines sent around each change when context_mode is 'hunks'",
+    default=10,
+)
+parser.add_argument(
+    "--include_signatures",
+    help="Send the signatures of the functions and classes around the changes when context_mode is 'hunks'. Example: 'true'",
+    default="true",
+)
+parser.add_argument(
+    "--review_cache_dir",
+    help="Folder where the AI reviews are cached, it can be kept between runs with actions/cache. Empty disables the cache",
+    default="",
+)
+parser.add_argument(
+    "--review_cache_max_size_mb",
+    help="Maximum size of the review cache folder, the least recently used reviews are removed",
+    default=100,
+)
+parser.add_argument(
+    "--shared_review_cache",
+    help="Folder or SQLite file of a cache shared between PRs and repositories, where reviews are found by the hash of the diff. Empty disables it",
+    default="",
+)
+parser.add_argument(
+    "--shared_review_cache_backend",
+    help="Storage of the shared review cache: filesystem or sqlite",
+    default="filesystem",
+)
+parser.add_argument(
+    "--shared_review_cache_ttl_hours",
+    help="Hours a review in the shared cache is reused, 0 means no expiration",
+    default=0,
+)
+parser.add_argument(
+    "--incremental",
+    help="Only review the files changed since the head reviewed by the last run, using the compare API",
+    default="false",
+)
+parser.add_argument(
+    "--output_mode",
+    help="comments posts one comment per file plus a summary, review submits a single pull request review with the findings on the changed lines",
+    default="comments",
+)
+parser.add_argument(
+    "--ai_requests_per_minute",
+    help="Maximum requests per minute sent to the AI provider, 0 means no limit",
+    default=0,
+)
+parser.add_argument(
+    "--ai_tokens_per_minute",
+    help="Maximum tokens per minute sent to the AI provider, 0 means no limit",
+    default=0,
+)
+parser.add_argument(
+    "--ai_max_retries",
+    help="Retries of AI requests that fail with throttling, timeout or server errors",
+    default=3,
+)
+parser.add_argument(
+    "--ai_hedge_after_seconds",
+    help="Sends a duplicate AI request when the first one takes longer than this, the first answer wins. 0 disables it",
+    default=0,
+)
+parser.add_argument(
+    "--batch_small_files",
+    help="Reviews small files that share the same instructions in a single AI request",
+    default="false",
+)
+parser.add_argument(
+    "--batch_max_files",
+    help="Maximum number of files reviewed in a single AI request when batch_small_files is enabled",
+    default=10,
+)
+parser.add_argument(
+    "--instructions_file",
+    help="TOML file with instructions for the files matching a glob, used before the default instructions",
+    default="",
+)
 
 args = parser.parse_args()
 
@@ -42,4 +185,32 @@ execute(
     instructions=args.instructions,
     google_project_name=args.google_project_name,
     google_model_name=args.google_ai_model,
+    max_workers=int(args.max_workers or 1),
+    async_mode=args.async_mode.lower() == "true",
+    google_max_connections=int(args.google_max_connections or 10),
+    google_keepalive_expiry=float(args.google_keepalive_expiry or 60),
+    github_api=args.github_api or "rest",
+    walk_commits=args.walk_commits.lower() == "true",
+    bulk_content_download=args.bulk_content_download.lower() == "true",
+    local_repository_path=args.local_repository_path,
+    max_file_changes=int(args.max_file_changes or 0),
+    path_match_style=args.path_match_style or "fnmatch",
+    chunk_large_files=args.chunk_large_files.lower() != "false",
+    context_mode=args.context_mode or "full",
+    context_lines=int(args.context_lines or 10),
+    include_signatures=args.include_signatures.lower() != "false",
+    review_cache_dir=args.review_cache_dir,
+    review_cache_max_size_mb=int(args.review_cache_max_size_mb or 100),
+    shared_review_cache=args.shared_review_cache,
+    shared_review_cache_backend=args.shared_review_cache_backend or "filesystem",
+    shared_review_cache_ttl_hours=float(args.shared_review_cache_ttl_hours or 0),
+    incremental=args.incremental.lower() == "true",
+    output_mode=args.output_mode or "comments",
+    ai_requests_per_minute=int(args.ai_requests_per_minute or 0),
+    ai_tokens_per_minute=int(args.ai_tokens_per_minute or 0),
+    ai_max_retries=int(args.ai_max_retries or 3),
+    ai_hedge_after_seconds=float(args.ai_hedge_after_seconds or 0),
+    batch_small_files=args.batch_small_files.lower() == "true",
+    batch_max_files=int(args.batch_max_files or 10),
+    instructions_file=args.instructions_file,
 )
@@ -0,0 +1,110 @@
+import fnmatch
+import re
+from typing import List, Optional, Tuple
+
+FNMATCH_STYLE = "fnmatch"
+GITIGNORE_STYLE = "gitignore"
+
+
+def _translate_gitignore(pattern: str) -> Tuple[str, bool]:
+    negated = pattern.startswith("!")
+    if negated:
+        pattern = pattern[1:]
+
+    directory_only = pattern.endswith("/")
+    pattern = pattern.rstrip("/")
+    # Patterns with a slash are relative to the root, the others match at any depth
+    anchored = "/" in pattern
+    pattern = pattern.lstrip("/")
+
+    regex = ""
+    index = 0
+    while index < len(pattern):
+        if pattern.startswith("**/", index):
+            regex += "(?:.*/)?"
+            index += 3
+        elif pattern.startswith("**", index):
+            regex += ".*"
+            index += 2
+        elif pattern[index] == "*":
+            regex += "[^/]*"
+            index += 1
+        elif pattern[index] == "?":
+            regex += "[^/]"
+            index += 1
+        elif pattern[index] == "[" and "]" in pattern[index + 1 :]:
+            end = pattern.index("]", index + 1)
+            content = pattern[index + 1 : end].replace("\\", "\\\\")
+            if content.startswith("!"):
+                content = "^" + content[1:]
+            regex += f"[{content}]"
+            index = end + 1
+        else:
+            regex += re.escape(pattern[index])
+            index += 1
+
+    if not anchored:
+        regex = "(?:.*/)?" + regex
+    # A matched directory matches everything inside it
+    regex += "/.*" if directory_only else "(?:/.*)?"
+    return regex, negated
+
+
+class PathMatcher:
+    # Compiles a list of glob patterns once into a single regex, where each pattern is a
+    # named alternative. With the fnmatch style the first matching pattern wins, like a
+    # loop over fnmatch.fnmatch. With the gitignore style "*" doesn't cross "/", "**"
+    # does, "!" negates and the last matching pattern wins.
+    _patterns: List[str]
+    _style: str
+    _negated: List[bool]
+    _regex: Optional[re.Pattern]
+
+    def __init__(self, patterns: List[str], style: str = FNMATCH_STYLE):
+        if style not in (FNMATCH_STYLE, GITIGNORE_STYLE):
+            raise ValueError(f"Unknown path match style: {style}")
+
+        self._patterns = patterns
+        self._style = style
+        self._negated = []
+        alternatives = []
+        for index, pattern in enumerate(patterns):
+            if style == GITIGNORE_STYLE:
+                regex, negated = _translate_gitignore(pattern)
+            else:
+                regex, negated = fnmatch.translate(pattern), False
+            self._negated.append(negated)
+            alternatives.append((index, regex))
+
+        # The gitignore style looks for the last match, so the order is reversed
+        if style == GITIGNORE_STYLE:
+            alternatives.reverse()
+
+        self._regex = None
+        if alternatives:
+            self._regex = re.compile(
+                "|".join(
+                    f"(?P<_p{index}>(?:{regex})\\Z)" for index, regex in alternatives
+                ),
+                re.DOTALL,
+            )
+
+    def find(self, path: str) -> Optional[int]:
+        # Returns the index of the pattern that decides the match, or None
+        if self._regex is None:
+            return None
+
+        match = self._regex.match(path)
+        if match is None:
+            return None
+        index = next(
+            int(name[2:])
+            for name, value in match.groupdict().items()
+            if name.startswith("_p") and value is not None
+        )
+        if self._negated[index]:
+            return None
+        return index
+
+    def match(self, path: str) -> bool:
+        return self.find(path) is not None
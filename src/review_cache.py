@@ -0,0 +1,166 @@
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import Optional
+
+FILESYSTEM_BACKEND = "filesystem"
+SQLITE_BACKEND = "sqlite"
+
+
+@dataclass
+class CacheEntry:
+    response: str
+    created_at: float
+
+
+class CacheBackend(ABC):
+    @abstractmethod
+    def get(self, key: str) -> Optional[CacheEntry]:
+        pass
+
+    @abstractmethod
+    def set(self, key: str, entry: CacheEntry) -> None:
+        pass
+
+
+class FileSystemCacheBackend(CacheBackend):
+    # One JSON file per key, so the folder can be saved and restored between runs with
+    # actions/cache or shared through a mounted volume. When the folder is bigger than
+    # the limit, the least recently used entries are removed.
+    _directory: str
+    _max_size_bytes: int
+    _lock: threading.Lock
+
+    def __init__(self, directory: str, max_size_bytes: int = 100 * 1024 * 1024):
+        self._directory = directory
+        self._max_size_bytes = max_size_bytes
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _get_path(self, key: str) -> str:
+        return os.path.join(self._directory, f"{key}.json")
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        path = self._get_path(key)
+        try:
+            with open(path) as cache_file:
+                entry = json.load(cache_file)
+            # The modification time is the last use, used by the eviction
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        if "response" not in entry:
+            return None
+        return CacheEntry(
+            response=entry["response"], created_at=entry.get("created_at", 0)
+        )
+
+    def set(self, key: str, entry: CacheEntry) -> None:
+        # Written to a temporary file and renamed, so a reader never sees half an entry
+        file_descriptor, temporary_path = tempfile.mkstemp(
+            dir=self._directory, suffix=".tmp"
+        )
+        with os.fdopen(file_descriptor, "w") as cache_file:
+            json.dump(
+                {"response": entry.response, "created_at": entry.created_at},
+                cache_file,
+            )
+        os.replace(temporary_path, self._get_path(key))
+        self._evict()
+
+    def _evict(self) -> None:
+        with self._lock:
+            entries = []
+            total_size = 0
+            for entry in os.scandir(self._directory):
+                if not entry.name.endswith(".json"):
+                    continue
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total_size += stat.st_size
+
+            for _, size, path in sorted(entries):
+                if total_size <= self._max_size_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total_size -= size
+
+
+class SQLiteCacheBackend(CacheBackend):
+    # A single SQLite file, or ":memory:" for tests. The connection is shared by the
+    # review threads, so it is used behind a lock.
+    _connection: sqlite3.Connection
+    _lock: threading.Lock
+
+    def __init__(self, path: str):
+        if path != ":memory:" and os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS reviews ("
+                "key TEXT PRIMARY KEY, response TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT response, created_at FROM reviews WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        return CacheEntry(response=row[0], created_at=row[1])
+
+    def set(self, key: str, entry: CacheEntry) -> None:
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO reviews (key, response, created_at) "
+                "VALUES (?, ?, ?)",
+                (key, entry.response, entry.created_at),
+            )
+
+
+def create_cache_backend(
+    backend: str, location: str, max_size_bytes: int = 100 * 1024 * 1024
+) -> CacheBackend:
+    if backend == FILESYSTEM_BACKEND:
+        return FileSystemCacheBackend(location, max_size_bytes=max_size_bytes)
+    if backend == SQLITE_BACKEND:
+        return SQLiteCacheBackend(location)
+    raise ValueError(f"Unknown cache backend: {backend}")
+
+
+class ReviewCache:
+    # AI responses by key. Entries older than the TTL are ignored, a TTL of 0 keeps
+    # them until the backend evicts them.
+    _backend: CacheBackend
+    _ttl_seconds: float
+
+    def __init__(self, backend: CacheBackend, ttl_seconds: float = 0):
+        self._backend = backend
+        self._ttl_seconds = ttl_seconds
+
+    @staticmethod
+    def get_key(*parts: str) -> str:
+        return hashlib.sha256("\0".join(parts).encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        entry = self._backend.get(key)
+        if entry is None:
+            return None
+        if self._ttl_seconds and time.time() - entry.created_at > self._ttl_seconds:
+            return None
+        return entry.response
+
+    def set(self, key: str, response: str) -> None:
+        self._backend.set(key, CacheEntry(response=response, created_at=time.time()))
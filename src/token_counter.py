@@ -0,0 +1,87 @@
+import math
+import re
+from abc import ABC, abstractmethod
+from functools import lru_cache
+from typing import Any, Iterator, Optional
+
+# Around 4 KB per chunk, so big files can stop being counted once they are over the limit
+CHUNK_SIZE = 4096
+WORD_OR_SYMBOL = re.compile(r"\w+|[^\w\s]")
+
+
+def _chunks(content: str) -> Iterator[str]:
+    # Chunks end at a line break, BPE tokens rarely cross lines
+    start = 0
+    while start < len(content):
+        end = content.find("\n", start + CHUNK_SIZE)
+        end = len(content) if end == -1 else end + 1
+        yield content[start:end]
+        start = end
+
+
+class TokenCounter(ABC):
+    def count(self, content: str, limit: Optional[int] = None) -> int:
+        # When a limit is given the count stops as soon as it is exceeded, so the
+        # result is only exact up to the limit
+        total = 0
+        for chunk in _chunks(content):
+            total += self._count_chunk(chunk)
+            if limit is not None and total > limit:
+                break
+        return total
+
+    @abstractmethod
+    def _count_chunk(self, chunk: str) -> int:
+        pass
+
+
+class ApproximateTokenCounter(TokenCounter):
+    # Local approximation for models without a public tokenizer: a word is a token
+    # every 4 characters and each symbol is a token, which is how BPE tokenizers
+    # usually split source code
+    CHARACTERS_PER_TOKEN = 4
+
+    def _count_chunk(self, chunk: str) -> int:
+        total = 0
+        for match in WORD_OR_SYMBOL.finditer(chunk):
+            total += math.ceil(
+                (match.end() - match.start()) / self.CHARACTERS_PER_TOKEN
+            )
+        return total
+
+
+@lru_cache(maxsize=None)
+def _get_encoding(model_name: str) -> Optional[Any]:
+    try:
+        import tiktoken
+    except ImportError:
+        print("tiktoken is not installed, token counts are approximated")
+        return None
+
+    try:
+        try:
+            return tiktoken.encoding_for_model(model_name)
+        except KeyError:
+            return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        print(
+            f"Could not load the tokenizer for {model_name}, using an approximation: {e}"
+        )
+        return None
+
+
+class TiktokenTokenCounter(TokenCounter):
+    # Uses the OpenAI BPE tokenizer. The encoder is loaded once per model and shared by
+    # all the counters; without tiktoken it falls back to the approximation.
+    _model_name: str
+    _fallback: ApproximateTokenCounter
+
+    def __init__(self, model_name: str):
+        self._model_name = model_name
+        self._fallback = ApproximateTokenCounter()
+
+    def _count_chunk(self, chunk: str) -> int:
+        encoding = _get_encoding(self._model_name)
+        if encoding is None:
+            return self._fallback._count_chunk(chunk)
+        return len(encoding.encode(chunk, disallowed_special=()))
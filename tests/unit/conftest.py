@@ -0,0 +1,22 @@
+from ai_assistent import AiAssistent, LatestFile
+
+
+class StubAiAssistent(AiAssistent):
+    # Answers locally instead of calling an AI provider and counts the requests. The
+    # whole budget is left for the input, so small test files are never chunked.
+    MAX_TOKENS = 1000
+    RESERVED_OUTPUT_TOKENS = 0
+    RETRY_BASE_DELAY = 0
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.requests = 0
+
+    def _build_ai_input(
+        self, latest_file: LatestFile, file_content: str, patch: str
+    ) -> str:
+        return f"{file_content}{patch}"
+
+    def _request_review(self, instructions: str, ai_input: str) -> str:
+        self.requests += 1
+        return f"review {ai_input}"
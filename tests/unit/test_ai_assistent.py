@@ -1,13 +1,79 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from unittest.mock import Mock
 
 import pytest
 
-from ai_assistent import AiAssistent, LatestFile
+from ai_assistent import (
+    CHUNK_ERROR_RESPONSE,
+    REVIEW_OUTPUT,
+    FileInstructions,
+    LatestFile,
+)
+from conftest import StubAiAssistent
+from review_cache import ReviewCache, SQLiteCacheBackend
 
 
-class _StubAiAssistent(AiAssistent):
-    def _generate_comment(self, latest_file: LatestFile) -> str:
-        pass
+class _FailingAiAssistent(StubAiAssistent):
+    def _generate_comment(self, latest_file: LatestFile, instructions: str) -> str:
+        if latest_file.file.filename == "b.py":
+            raise ValueError("boom")
+        return f"comment {latest_file.file.filename}"
+
+
+class _BatchAiAssistent(StubAiAssistent):
+    # Answers the batches leaving c.py out, so it has to be reviewed alone
+    def _request_review(self, instructions: str, ai_input: str) -> str:
+        self.ai_inputs.append(ai_input)
+        if "=== FILE:" not in ai_input:
+            return f"alone {ai_input}"
+        return "=== FILE: a.py ===\nissue in a\n=== FILE: b.py ===\nAll Good Here!"
+
+
+class _ConcurrencyAiAssistent(StubAiAssistent):
+    # Records the most requests in flight at the same time
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def _request_review(self, instructions: str, ai_input: str) -> str:
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(0.01)
+        with self.lock:
+            self.in_flight -= 1
+        return "review"
+
+
+class _FailingChunkAiAssistent(StubAiAssistent):
+    def _request_review(self, instructions: str, ai_input: str) -> str:
+        if "value_300 = 300" in ai_input:
+            raise ValueError("rate limited")
+        return "issue"
+
+
+def _latest_file(filename: str, content: str = "", patch: str = "") -> LatestFile:
+    return LatestFile(
+        file=Mock(
+            filename=filename, status="modified", sha=f"sha-{filename}", patch=patch
+        ),
+        commit=Mock(),
+        _content=content,
+    )
+
+
+def _big_file(filename: str) -> LatestFile:
+    # Too long for a single request of the stub
+    content = "".join(f"value_{line} = {line}\n" for line in range(1, 301))
+    patch = "@@ -0,0 +1,300 @@\n" + "\n".join(
+        f"+{line}" for line in content.splitlines()
+    )
+    return _latest_file(filename, content, patch)
 
 
 class TestAiAssistent:
@@ -24,7 +90,7 @@ class TestAiAssistent:
         ),
     )
     def test_should_file_be_ignored(self, file: str, result: bool) -> None:
-        client = _StubAiAssistent(
+        client = StubAiAssistent(
             github_pr=Mock(),
             ignore_files_with_content=[],
             ignore_files_in_paths=[
@@ -33,6 +99,565 @@ class TestAiAssistent:
                 "*Pipfile",
                 "*Pipfile.lock",
             ],
+            instructions=[],
         )
 
         assert client._should_file_be_ignored_due_to_path(file) == result
+
+    def test_generate_comments_in_parallel_keeps_file_order_and_isolates_errors(
+        self,
+    ) -> None:
+        client = _FailingAiAssistent(
+            github_pr=Mock(),
+            ignore_files_with_content=[],
+            ignore_files_in_paths=[],
+            instructions=[],
+            max_workers=4,
+        )
+        files = [_latest_file(name) for name in ("c.py", "a.py", "b.py")]
+
+        assert client._generate_comments(files) == ["comment a.py", "comment c.py"]
+
+    def test_generate_comments_async_uses_request_review_in_file_order(self) -> None:
+        client = StubAiAssistent(
+            github_pr=Mock(),
+            ignore_files_with_content=[],
+            ignore_files_in_paths=[],
+            instructions=[],
+            max_workers=2,
+        )
+        files = [_latest_file("b.py", "content b"), _latest_file("a.py", "content a")]
+
+        comments = asyncio.run(client._generate_comments_async(files))
+
+        assert len(comments) == 2
+        assert "#### File: _a.py_" in comments[0]
+        assert comments[0].endswith("review content a")
+        assert "#### File: _b.py_" in comments[1]
+
+    def test_latest_files_come_from_the_pr_head_without_walking_commits(self) -> None:
+        github_pr = Mock()
+        github_pr.get_files.return_value = [
+            Mock(filename="a.py"),
+            Mock(filename="b.py"),
+        ]
+        client = StubAiAssistent(
+            github_pr=github_pr,
+            ignore_files_with_content=[],
+            ignore_files_in_paths=[],
+            instructions=[],
+        )
+
+        files = client._get_latest_files()
+
+        assert [file.file.filename for file in files] == ["a.py", "b.py"]
+        assert all(
+            file.commit == github_pr.get_head_commit.return_value for file in files
+        )
+        github_pr.get_pr_commits.assert_not_called()
+
+    def test_files_ignored_by_metadata_are_never_downloaded(self) -> None:
+        github_pr = Mock()
+        github_pr.get_pr_author_login.return_value = "someone"
+        github_pr.get_comments.return_value = []
+        github_pr.get_head_commit.return_value = Mock(sha="head")
+        github_pr.get_head_sha.return_value = "head"
+        github_pr.get_files.return_value = [
+            Mock(
+                filename=name,
+                status=status,
+                patch=patch,
+                changes=changes,
+                sha=f"sha-{name}",
+            )
+            for name, status, patch, changes in (
+                ("poetry.lock", "modified", "@@ -1 +1 @@\n+a", 10),
+                ("removed.py", "removed", "@@ -1 +0,0 @@\n-a", 10),
+                ("image.png", "added", None, 0),
+                ("big.py", "modified", "@@ -1 +1 @@\n+a", 500),
+                # GitHub leaves the patch out of diffs that are too big
+                ("huge_diff.py", "modified", None, 50),
+                ("main.py", "modified", "@@ -1 +1 @@\n+a", 10),
+            )
+        ]
+        github_pr.get_contents_for_files.return_value = {
+            "huge_diff.py": "b",
+            "main.py": "a",
+        }
+        client = StubAiAssistent(
+            github_pr=github_pr,
+            ignore_files_with_content=["Generated"],
+            ignore_files_in_paths=["*poetry.lock"],
+            instructions=[],
+            max_file_changes=100,
+            bulk_content_download=True,
+        )
+
+        client.execute()
+
+        github_pr.get_contents_for_files.assert_called_once_with(
+            ["huge_diff.py", "main.py"], "head"
+        )
+        github_pr.get_content_for_file.assert_not_called()
+        created = github_pr.update_comments.call_args.kwargs["created"]
+        assert "#### File: _huge_diff.py_" in created[0]
+        assert "#### File: _main.py_" in created[1]
+
+    def test_file_too_long_is_reviewed_in_chunks(self) -> None:
+        class _ChunkedAiAssistent(StubAiAssistent):
+            MAX_TOKENS = 150
+
+            def _request_review(self, instructions: str, ai_input: str) -> str:
+                if "line1 " in ai_input:
+                    return self.SKIP_COMMENT_TOKEN
+                return "Looks wrong"
+
+        client = _ChunkedAiAssistent(
+            github_pr=Mock(),
+            ignore_files_with_content=[],
+            ignore_files_in_paths=[],
+            instructions=[],
+        )
+        content = "".join(f"line{number} word\n" for number in range(1, 101))
+        patch = (
+            "@@ -1,1 +1,1 @@\n-old\n+line1 word\n@@ -90,1 +90,1 @@\n-old\n+line90 word"
+        )
+
+        comment = client._generate_comment(
+            _latest_file("big.py", content, patch), "instructions"
+        )
+
+        assert "File is too long" not in comment
+        assert "**Lines 1-" not in comment
+        assert "**Lines 70-100**\n\nLooks wrong" in comment
+
+    def test_bot_comments_are_parsed_once_and_reconciled(self) -> None:
+        client = StubAiAssistent(
+            github_pr=Mock(),
+            ignore_files_with_content=[],
+            ignore_files_in_paths=[],
+            instructions=[],
+        )
+        legacy_header = f"{client.COMMENT_HEADER}\n#### File: _{{file}}_\n{client.SHA_HEADER} {{sha}} {client.SHA_HEADER_ENDING}\n----\n{{response}}"
+        bodies = [
+            client._format_file_comment(
+                Mock(filename="kept.py", sha="sha-kept.py"), "Bug"
+            ),
+            legacy_header.format(file="changed.py", sha="old-sha", response="Bug"),
+            legacy_header.format(
+                file="removed.py", sha="sha-removed.py", response="Bug"
+            ),
+            "A comment from a person",
+            client._generate_summary_comment(
+                [_latest_file("clean.py"), _latest_file("kept.py")], [], []
+            ),
+        ]
+        client._github_pr.get_comments.return_value = [
+            Mock(body=body) for body in bodies
+        ]
+        files = [
+            _latest_file("kept.py"),
+            _latest_file("changed.py"),
+            _latest_file("clean.py"),
+            _latest_file("new.py"),
+        ]
+
+        bot_comments = client.get_all_bot_comments()
+        remaining = client._remove_deprecated_comments(files, bot_comments)
+        files_to_comment = client._filter_files_to_comment(
+            client._get_files_to_comment(files, remaining), bot_comments
+        )
+
+        assert len(bot_comments) == 4
+        assert [comment.filename for comment in remaining] == ["kept.py"]
+        assert [comment.comment.body for comment in client._deprecated_comments] == [
+            bodies[1],
+            bodies[2],
+            bodies[4],
+        ]
+        assert [file.file.filename for file in files_to_comment] == [
+            "changed.py",
+            "new.py",
+        ]
+
+    def test_incremental_mode_only_reviews_files_changed_since_last_review(
+        self,
+    ) -> None:
+        github_pr = Mock()
+        client = StubAiAssistent(
+            github_pr=github_pr,
+            ignore_files_with_content=[],
+            ignore_files_in_paths=[],
+            instructions=[],
+            incremental=True,
+        )
+        summary = client._generate_summary_comment(
+            [_latest_file("same.py"), _latest_file("changed.py")],
+            [],
+            [],
+            "old-head",
+        )
+        github_pr.get_head_commit.return_value = Mock(sha="new-head")
+        github_pr.get_changed_files.return_value = [
+            Mock(filename="changed.py", patch="push patch", previous_filename=None),
+            Mock(filename="new.py", patch="push patch", previous_filename=None),
+        ]
+        github_pr.get_files.return_value = [
+            Mock(filename=name, sha=sha, patch="pr patch")
+            for name, sha in (
+                ("changed.py", "new-sha"),
+                ("new.py", "sha-new.py"),
+                ("same.py", "sha-same.py"),
+            )
+        ]
+
+        bot_comments = [client._parse_bot_comment(Mock(body=summary))]
+        files, unchanged_files = client._get_files_to_review(bot_comments)
+
+        github_pr.get_changed_files.assert_called_once_with("old-head", "new-head")
+        assert [file.file.filename for file in files] == ["changed.py", "new.py"]
+        # The patches are the PR diff, not the diff since the last review
+        assert [file.file.patch for file in files] == ["pr patch", "pr patch"]
+        assert [(file.file.filename, file.file.sha) for file in unchanged_files] == [
+            ("same.py", "sha-same.py")
+        ]
+        files_to_comment = client._filter_files_to_comment(
+            files + unchanged_files, bot_comments
+        )
+        assert [file.file.filename for file in files_to_comment] == [
+            "changed.py",
+            "new.py",
+        ]
+
+    def test_incremental_mode_reviews_all_files_when_history_changed(self) -> None:
+        github_pr = Mock()
+        client = StubAiAssistent(
+            github_pr=github_pr,
+            ignore_files_with_content=[],
+            ignore_files_in_paths=[],
+            instructions=[],
+            incremental=True,
+        )
+        summary = client._generate_summary_comment([], [], [], "old-head")
+        github_pr.get_changed_files.return_value = None
+        github_pr.get_files.return_value = [Mock(filename="a.py")]
+
+        files, unchanged_files = client._get_files_to_review(
+            [client._parse_bot_comment(Mock(body=summary))]
+        )
+
+        assert [file.file.filename for file in files] == ["a.py"]
+        assert unchanged_files == []
+
+    def test_comments_of_reviewed_files_are_edited_in_place(self) -> None:
+        github_pr = Mock()
+        client = StubAiAssistent(
+            github_pr=github_pr,
+            ignore_files_with_content=[],
+            ignore_files_in_paths=[],
+            instructions=[],
+        )
+        changed = _latest_file("changed.py")
+        changed_comment = Mock(
+            body=client._format_file_comment(
+                Mock(filename="changed.py", sha="old"), "Bug"
+            )
+        )
+        removed_comment = Mock(
+            body=client._format_file_comment(
+                Mock(filename="removed.py", sha="old"), "Bug"
+            )
+        )
+        summary_comment = Mock(body=client._generate_summary_comment([], [], []))
+        github_pr.get_comments.return_value = [
+            changed_comment,
+            removed_comment,
+            summary_comment,
+        ]
+        client._remove_deprecated_comments([changed], client.get_all_bot_comments())
+
+        client._delete_deprecated_comments([changed])
+        new_comment = client._format_file_comment(changed.file, "Still a bug")
+        new_summary = client._generate_summary_comment([changed], [new_comment], [])
+        client._publish_comments([new_comment, new_summary], [changed])
+
+        assert github_pr.update_comments.call_args_list[0].kwargs == {
+            "deleted": [removed_comment]
+        }
+        assert github_pr.update_comments.call_args_list[1].kwargs == {
+            "edited": [(changed_comment, new_comment), (summary_comment, new_summary)],
+            "created": [],
+            "deleted": [],
+        }
+
+    def test_review_output_submits_a_single_review_with_inline_comments(
+        self,
+    ) -> None:
+        github_pr = Mock()
+        client = StubAiAssistent(
+            github_pr=github_pr,
+            ignore_files_with_content=[],
+            ignore_files_in_paths=[],
+            instructions=[],
+            output_mode=REVIEW_OUTPUT,
+        )
+        patched = _latest_file("a.py", patch="@@ -1,2 +1,3 @@\n a\n+b\n+c")
+        binary = _latest_file("image.png")
+        comments = [
+            client._format_file_comment(patched.file, "Line 3 is wrong"),
+            client._format_file_comment(binary.file, "Too big"),
+        ]
+        summary = client._generate_summary_comment(
+            [patched, binary], comments, [], "head"
+        )
+        client._deprecated_comments = []
+
+        client._publish_comments(comments + [summary], [patched, binary])
+
+        body, review_comments = github_pr.create_review.call_args.args
+        assert review_comments == [{"path": "a.py", "position": 3, "body": comments[0]}]
+        assert body == f"{summary}\n\n{comments[1]}"
+        github_pr.add_comments.assert_not_called()
+        github_pr.update_comments.assert_not_called()
+
+    def test_old_comments_are_deleted_only_after_the_review_is_created(
+        self,
+    ) -> None:
+        github_pr = Mock()
+        client = StubAiAssistent(
+            github_pr=github_pr,
+            ignore_files_with_content=[],
+            ignore_files_in_paths=[],
+            instructions=[],
+            output_mode=REVIEW_OUTPUT,
+        )
+        file = _latest_file("a.py", patch="@@ -1,1 +1,2 @@\n a\n+b")
+        comment = client._format_file_comment(file.file, "Line 2 is wrong")
+        old_comment = Mock()
+        github_pr.create_review.side_effect = ValueError("422 Unprocessable Entity")
+        client._deprecated_comments = [Mock(comment=old_comment)]
+
+        with pytest.raises(ValueError):
+            client._publish_comments([comment], [file])
+
+        github_pr.update_comments.assert_not_called()
+
+        github_pr.create_review.side_effect = None
+        client._deprecated_comments = [Mock(comment=old_comment)]
+        client._publish_comments([comment], [file])
+
+        assert [call[0] for call in github_pr.mock_calls] == [
+            "create_review",
+            "create_review",
+            "update_comments",
+        ]
+        github_pr.update_comments.assert_called_once_with(deleted=[old_comment])
+
+    def test_incremental_review_positions_come_from_the_pr_diff(self) -> None:
+        class _LineAiAssistent(StubAiAssistent):
+            def _request_review(self, instructions: str, ai_input: str) -> str:
+                return "Line 3 is wrong"
+
+        github_pr = Mock()
+        client = _LineAiAssistent(
+            github_pr=github_pr,
+            ignore_files_with_content=[],
+            ignore_files_in_paths=[],
+            instructions=[],
+            incremental=True,
+            output_mode=REVIEW_OUTPUT,
+        )
+        previous_summary = client._generate_summary_comment(
+            [_latest_file("a.py")], [], [], "old-head"
+        )
+        github_pr.get_pr_author_login.return_value = "someone"
+        github_pr.get_comments.return_value = []
+        github_pr.get_reviews.return_value = [Mock(body=previous_summary)]
+        github_pr.get_head_commit.return_value = Mock(sha="new-head")
+        github_pr.get_head_sha.return_value = "new-head"
+        github_pr.get_content_for_file.return_value = "a\nb\nc\n"
+        # Only line 3 is in the PR diff, the last push only touched the end of the file
+        github_pr.get_changed_files.return_value = [
+            Mock(filename="a.py", patch="@@ -5 +5,2 @@\n e\n+f", previous_filename=None)
+        ]
+        github_pr.get_files.return_value = [
+            Mock(
+                filename="a.py",
+                status="modified",
+                sha="new-sha",
+                patch="@@ -1,2 +1,3 @@\n a\n+b\n+c",
+                changes=2,
+            )
+        ]
+
+        client.execute()
+
+        github_pr.get_changed_files.assert_called_once_with("old-head", "new-head")
+        _, review_comments = github_pr.create_review.call_args.args
+        assert [
+            (comment["path"], comment["position"]) for comment in review_comments
+        ] == [("a.py", 3)]
+
+    def test_generate_comments_batches_small_files(self) -> None:
+        client = _BatchAiAssistent(
+            github_pr=Mock(),
+            ignore_files_with_content=[],
+            ignore_files_in_paths=[],
+            instructions=[FileInstructions("*.py", "Review {file_name}")],
+            batch_small_files=True,
+        )
+        client.ai_inputs = []
+        files = [
+            _latest_file(name, content=f"{name} content")
+            for name in ("c.py", "b.py", "a.py")
+        ]
+
+        comments = client._generate_comments(files)
+
+        assert len(client.ai_inputs) == 2
+        assert "=== FILE: a.py ===" in client.ai_inputs[0]
+        assert "=== FILE: c.py ===" in client.ai_inputs[0]
+        assert client.ai_inputs[1] == "c.py content"
+        assert len(comments) == 3
+        assert "#### File: _a.py_" in comments[0]
+        assert comments[0].endswith("issue in a")
+        assert comments[1].endswith("All Good Here!")
+        assert "#### File: _c.py_" in comments[2]
+        assert comments[2].endswith("alone c.py content")
+
+    def test_group_files_in_batches_keeps_big_files_alone(self) -> None:
+        client = StubAiAssistent(
+            github_pr=Mock(),
+            ignore_files_with_content=[],
+            ignore_files_in_paths=[],
+            instructions=[FileInstructions("*.py", "Review {file_name}")],
+            batch_small_files=True,
+            batch_max_files=2,
+        )
+        files = [_latest_file(name) for name in ("a.py", "b.py", "c.py")]
+        files.append(_latest_file("big.py", content="x " * 1000))
+
+        batches = client._group_files_in_batches(files)
+
+        assert [[file.file.filename for file in batch] for batch in batches] == [
+            ["big.py"],
+            ["a.py", "b.py"],
+            ["c.py"],
+        ]
+
+    def test_custom_file_instructions_win_over_the_defaults(self) -> None:
+        client = StubAiAssistent(
+            github_pr=Mock(),
+            ignore_files_with_content=[],
+            ignore_files_in_paths=[],
+            instructions=[],
+            file_instructions=[
+                FileInstructions("docs/*", instructions="Review {file_name}."),
+                FileInstructions("*.sql", specifics="Check the locks."),
+            ],
+        )
+
+        assert (
+            client._get_instructions_for_file(_latest_file("docs/a.md"))
+            == "Review docs/a.md."
+        )
+        sql_instructions = client._get_instructions_for_file(_latest_file("a.sql"))
+        assert "Check the locks." in sql_instructions
+        assert sql_instructions.startswith("You are a senior Python developer")
+        assert "Check the locks." not in client._get_instructions_for_file(
+            _latest_file("a.py")
+        )
+
+    def test_instructions_are_rendered_once_per_suffix(self) -> None:
+        client = StubAiAssistent(
+            github_pr=Mock(),
+            ignore_files_with_content=[],
+            ignore_files_in_paths=[],
+            instructions=[],
+        )
+
+        first = client._get_instructions_for_file(_latest_file("a.yml"))
+        second = client._get_instructions_for_file(_latest_file("b.yml"))
+
+        assert "type .yml" in first
+        assert first is second
+        assert "type .json" in client._get_instructions_for_file(_latest_file("c.json"))
+
+    def test_requests_in_flight_are_capped_by_max_workers(self) -> None:
+        client = _ConcurrencyAiAssistent(
+            github_pr=Mock(),
+            ignore_files_with_content=[],
+            ignore_files_in_paths=[],
+            instructions=[],
+            max_workers=2,
+        )
+
+        # Like the file workers and the chunk workers of each file sending at once
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(
+                executor.map(
+                    lambda _: client._send_review_request("", "input"), range(8)
+                )
+            )
+
+        assert client.max_in_flight == 2
+
+    def test_chunks_of_a_hunks_review_keep_the_original_instructions(self) -> None:
+        client = StubAiAssistent(
+            github_pr=Mock(),
+            ignore_files_with_content=[],
+            ignore_files_in_paths=[],
+            instructions=[],
+            context_mode="hunks",
+        )
+        requests, comment = client._prepare_review(_big_file("a.py"), "Review")
+
+        assert comment is None
+        assert len(requests) > 1
+        assert all(request.instructions == "Review" for request in requests)
+
+    def test_review_with_a_failed_chunk_is_not_cached(self) -> None:
+        client = _FailingChunkAiAssistent(
+            github_pr=Mock(),
+            ignore_files_with_content=[],
+            ignore_files_in_paths=[],
+            instructions=[],
+            review_cache=ReviewCache(SQLiteCacheBackend(":memory:")),
+        )
+        file = _big_file("a.py")
+
+        comment = client._generate_comment(file, "Review")
+        async_comment = asyncio.run(client._generate_comment_async(file, "Review"))
+
+        assert "issue" in comment
+        assert CHUNK_ERROR_RESPONSE in comment
+        assert CHUNK_ERROR_RESPONSE in async_comment
+        assert client._get_cached_review(file, "Review") is None
+
+    def test_requests_leave_room_for_the_instructions_and_the_answer(self) -> None:
+        class _ReservingAiAssistent(StubAiAssistent):
+            RESERVED_OUTPUT_TOKENS = 200
+
+        client = _ReservingAiAssistent(
+            github_pr=Mock(),
+            ignore_files_with_content=[],
+            ignore_files_in_paths=[],
+            instructions=[],
+        )
+        instructions = "Review this file carefully. " * 40
+        content = "".join(f"value_{line} = {line}\n" for line in range(1, 151))
+        patch = "@@ -1,1 +1,1 @@\n-old\n+value_1 = 1"
+        file = _latest_file("a.py", content, patch)
+        counter = client._token_counter
+        # The file alone fits in MAX_TOKENS, not with the instructions and the answer
+        assert counter.count(f"{content}{patch}") < client.MAX_TOKENS
+
+        requests, comment = client._prepare_review(file, instructions)
+
+        assert comment is None
+        # Reviewed in chunks around the changed lines
+        assert requests[0].start_line == 1
+        assert requests[-1].end_line < 150
+        for request in requests:
+            used = counter.count(request.instructions) + counter.count(request.ai_input)
+            assert used + client.RESERVED_OUTPUT_TOKENS <= client.MAX_TOKENS
@@ -0,0 +1,144 @@
+import asyncio
+import threading
+import time
+from unittest.mock import Mock
+
+from ai_assistent import LatestFile
+from ai_rate_limiter import AiRateLimiter
+from conftest import StubAiAssistent
+
+
+class _StatusError(Exception):
+    def __init__(self, status_code: int):
+        super().__init__(f"status {status_code}")
+        self.status_code = status_code
+
+
+class _FlakyAiAssistent(StubAiAssistent):
+    # Fails with the given errors before answering
+    def __init__(self, errors, **kwargs) -> None:
+        super().__init__(
+            github_pr=Mock(),
+            ignore_files_with_content=[],
+            ignore_files_in_paths=[],
+            instructions=[],
+            **kwargs,
+        )
+        self.errors = list(errors)
+
+    def _request_review(self, instructions: str, ai_input: str) -> str:
+        if self.errors:
+            self.requests += 1
+            raise self.errors.pop(0)
+        return super()._request_review(instructions, ai_input)
+
+
+class TestAiRateLimiter:
+    def test_requests_per_minute_are_respected(self) -> None:
+        now = [0.0]
+        limiter = AiRateLimiter(requests_per_minute=2, clock=lambda: now[0])
+
+        assert limiter.reserve(100) == 0
+        assert limiter.reserve(100) == 0
+        # The third request waits for a slot, one every 30s at 2 per minute
+        assert limiter.reserve(100) == 30
+        now[0] = 90.0
+        assert limiter.reserve(100) == 0
+
+    def test_tokens_per_minute_are_respected(self) -> None:
+        now = [0.0]
+        limiter = AiRateLimiter(tokens_per_minute=600, clock=lambda: now[0])
+
+        assert limiter.reserve(500) == 0
+        # 600 tokens per minute are 10 per second, 100 tokens over the budget wait 10s
+        assert limiter.reserve(200) == 10
+        now[0] = 10.0
+        assert limiter.reserve(100) == 10
+
+    def test_no_limits_never_wait(self) -> None:
+        limiter = AiRateLimiter()
+
+        assert all(limiter.reserve(10**6) == 0 for _ in range(100))
+
+    def test_transient_errors_are_retried(self) -> None:
+        client = _FlakyAiAssistent([_StatusError(429), _StatusError(503)])
+
+        assert client._send_review_request("instructions", "input") == "review input"
+        assert client.requests == 3
+
+    def test_permanent_errors_are_not_retried(self) -> None:
+        client = _FlakyAiAssistent([_StatusError(400)])
+
+        try:
+            client._send_review_request("instructions", "input")
+        except _StatusError:
+            pass
+        assert client.requests == 1
+
+    def test_retries_stop_after_max_retries(self) -> None:
+        client = _FlakyAiAssistent([_StatusError(500)] * 5, max_retries=2)
+
+        comment = client._generate_comment(
+            LatestFile(
+                file=Mock(filename="a.py", sha="sha", patch=""),
+                commit=Mock(),
+                _content="x",
+            ),
+            "instructions",
+        )
+
+        assert "Error while generating information" in comment
+        assert client.requests == 3
+
+    def test_hedged_request_returns_the_first_answer(self) -> None:
+        release = threading.Event()
+
+        class _SlowFirstAiAssistent(_FlakyAiAssistent):
+            def _request_review(self, instructions: str, ai_input: str) -> str:
+                self.requests += 1
+                if self.requests == 1:
+                    release.wait(5)
+                    return "slow"
+                return "fast"
+
+        client = _SlowFirstAiAssistent([], hedge_after_seconds=0.05, max_workers=2)
+        try:
+            assert client._send_review_request("instructions", "input") == "fast"
+            # The slower request keeps its slot until it finishes
+            assert client._request_slots.acquire(blocking=False)
+            assert not client._request_slots.acquire(blocking=False)
+        finally:
+            release.set()
+        assert client.requests == 2
+        assert client._request_slots.acquire(timeout=5)
+
+    def test_hedged_request_needs_a_free_slot(self) -> None:
+        class _SlowAiAssistent(_FlakyAiAssistent):
+            def _request_review(self, instructions: str, ai_input: str) -> str:
+                self.requests += 1
+                time.sleep(0.2)
+                return "slow"
+
+        client = _SlowAiAssistent([], hedge_after_seconds=0.05, max_workers=1)
+
+        assert client._send_review_request("instructions", "input") == "slow"
+        assert client.requests == 1
+
+    def test_hedged_request_async_returns_the_first_answer(self) -> None:
+        class _SlowFirstAiAssistent(_FlakyAiAssistent):
+            async def _request_review_async(
+                self, instructions: str, ai_input: str
+            ) -> str:
+                self.requests += 1
+                if self.requests == 1:
+                    await asyncio.sleep(5)
+                    return "slow"
+                return "fast"
+
+        client = _SlowFirstAiAssistent([], hedge_after_seconds=0.05, max_workers=2)
+
+        assert (
+            asyncio.run(client._send_review_request_async("instructions", "input"))
+            == "fast"
+        )
+        assert client.requests == 2
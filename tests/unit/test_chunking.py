@@ -0,0 +1,99 @@
+from chunking import Chunk, split_in_chunks
+from diff_hunks import build_hunks_context, parse_hunks
+
+PATCH = """@@ -2,3 +2,4 @@ def main():
+ a = 1
+-b = 2
++b = 3
++c = 4
+ d = 5
+@@ -40 +41 @@
+-x = 1
++x = 2"""
+
+
+def _content(number_of_lines: int) -> str:
+    return "".join(f"line {number}\n" for number in range(1, number_of_lines + 1))
+
+
+class TestChunking:
+    def test_parse_hunks_tracks_new_lines_and_positions(self) -> None:
+        hunks = parse_hunks(PATCH)
+
+        assert [(hunk.new_start, hunk.new_end) for hunk in hunks] == [(2, 5), (41, 41)]
+        assert [
+            (line.text, line.new_line, line.position) for line in hunks[0].lines
+        ] == [
+            (" a = 1", 2, 1),
+            ("-b = 2", 3, 2),
+            ("+b = 3", 3, 3),
+            ("+c = 4", 4, 4),
+            (" d = 5", 5, 5),
+        ]
+        assert hunks[1].lines[1].position == 8
+
+    def test_neighbour_hunks_are_merged_when_they_fit(self) -> None:
+        chunks = split_in_chunks(
+            _content(60), parse_hunks(PATCH), lambda chunk: True, context_lines=5
+        )
+
+        assert [(chunk.start_line, chunk.end_line) for chunk in chunks] == [(1, 46)]
+        assert chunks[0].content.startswith("line 1\n")
+        assert chunks[0].get_patch() == PATCH
+
+    def test_hunks_are_split_when_they_do_not_fit(self) -> None:
+        def _fits(chunk: Chunk) -> bool:
+            return chunk.end_line - chunk.start_line < 20
+
+        chunks = split_in_chunks(
+            _content(60), parse_hunks(PATCH), _fits, context_lines=5
+        )
+
+        assert [(chunk.start_line, chunk.end_line) for chunk in chunks] == [
+            (1, 10),
+            (36, 46),
+        ]
+
+    def test_single_hunk_too_big_is_split_in_pieces(self) -> None:
+        patch = "@@ -1,0 +1,30 @@\n" + "\n".join(f"+line {n}" for n in range(1, 31))
+
+        chunks = split_in_chunks(
+            _content(30),
+            parse_hunks(patch),
+            lambda chunk: chunk.end_line - chunk.start_line < 10,
+            context_lines=0,
+        )
+
+        assert [(chunk.start_line, chunk.end_line) for chunk in chunks] == [
+            (1, 10),
+            (11, 20),
+            (21, 30),
+        ]
+        assert chunks[1].get_patch().splitlines()[1:] == [
+            f"+line {n}" for n in range(11, 21)
+        ]
+
+    def test_hunks_context_has_changed_lines_context_and_signatures(self) -> None:
+        content = (
+            "import os\n"
+            "\n"
+            "class Service:\n"
+            "    def run(self):\n"
+            "        a = 1\n"
+            "        b = 2\n"
+            "        c = 3\n"
+            "        d = 4\n"
+            "        return a\n"
+        )
+        patch = "@@ -7,1 +7,1 @@\n-        c = 0\n+        c = 3"
+
+        context = build_hunks_context(content, parse_hunks(patch), context_lines=1)
+
+        assert context.splitlines() == [
+            "3: class Service:",
+            "4:     def run(self):",
+            "...",
+            "6:         b = 2",
+            "7:         c = 3",
+            "8:         d = 4",
+        ]
@@ -0,0 +1,47 @@
+from comment_metadata import (
+    FILE_COMMENT_KIND,
+    SUMMARY_COMMENT_KIND,
+    CommentMetadata,
+    parse_comment_metadata,
+)
+from chatgpt import ChatGPT
+
+
+class TestCommentMetadata:
+    def test_metadata_is_read_back_from_the_comment(self) -> None:
+        metadata = CommentMetadata(
+            kind=FILE_COMMENT_KIND,
+            file="src/a-->b.py",
+            sha="1234",
+            model="gpt",
+            prompt_hash="abcd",
+            duration=1.234,
+        )
+        body = f"### Title\n{metadata.to_comment()}\n----\nreview with --> arrows"
+
+        assert "-->b.py" not in metadata.to_comment()
+        assert parse_comment_metadata(body) == CommentMetadata(
+            kind=FILE_COMMENT_KIND,
+            file="src/a-->b.py",
+            sha="1234",
+            model="gpt",
+            prompt_hash="abcd",
+            duration=1.23,
+        )
+
+    def test_comments_without_metadata_return_none(self) -> None:
+        assert parse_comment_metadata("### AIxplain Comment\n----\nreview") is None
+        assert parse_comment_metadata("<!--aixplain:{broken-->") is None
+
+    def test_legacy_summary_comment_is_parsed(self) -> None:
+        body = f"""{ChatGPT.SUMMARY_COMMENT_HEADER}
+  - 2 files were reviewed.
+    <!--FILE:a.py|sha-a-->
+<!--FILE:b.py|sha-b-->
+"""
+
+        metadata = ChatGPT._parse_comment_body(body)
+
+        assert metadata.kind == SUMMARY_COMMENT_KIND
+        assert metadata.version == 0
+        assert metadata.files == [("a.py", "sha-a"), ("b.py", "sha-b")]
@@ -0,0 +1,30 @@
+from diff_hunks import get_review_position, parse_hunks
+
+PATCH = "@@ -1,3 +1,3 @@\n a\n-b\n+B\n c\n@@ -10,2 +10,3 @@\n j\n+new\n k"
+
+
+class TestDiffHunks:
+    def test_positions_follow_the_github_review_positions(self) -> None:
+        hunks = parse_hunks(PATCH)
+
+        assert [
+            (line.text, line.new_line, line.position) for line in hunks[1].lines
+        ] == [
+            (" j", 10, 6),
+            ("+new", 11, 7),
+            (" k", 12, 8),
+        ]
+
+    def test_review_position_uses_the_first_line_mentioned_in_the_diff(self) -> None:
+        hunks = parse_hunks(PATCH)
+
+        assert get_review_position(hunks, "Line 50 and line 11 are wrong") == 7
+        assert get_review_position(hunks, "Looks wrong") == 2
+        assert get_review_position([], "Line 11 is wrong") is None
+
+    def test_slice_recomputes_the_header(self) -> None:
+        hunk = parse_hunks("@@ -5,5 +5,6 @@ def main():\n a\n-b\n+B\n+C\n d\n e\n f")[0]
+
+        sliced = hunk.slice(7, 8)
+
+        assert sliced.get_text() == "@@ -7,1 +7,2 @@ def main():\n+C\n d"
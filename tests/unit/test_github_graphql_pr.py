@@ -0,0 +1,76 @@
+from unittest.mock import Mock, patch
+
+from github_graphql_pr import GithubGraphQLPR
+
+# PyGithub reports (-1, -1) until it gets a response with the rate limit headers
+NO_RATE_LIMIT = {"return_value.requester.rate_limiting": (-1, -1)}
+
+
+def _page(commits, comments, has_next_commits, has_next_comments):
+    pull_request = {
+        "title": "My PR",
+        "author": {"login": "octocat"},
+        "headRefOid": "head-sha",
+        "baseRefOid": "base-sha",
+    }
+    if commits is not None:
+        pull_request["commits"] = {
+            "pageInfo": {"hasNextPage": has_next_commits, "endCursor": "c1"},
+            "nodes": [{"commit": {"oid": sha}} for sha in commits],
+        }
+    if comments is not None:
+        pull_request["comments"] = {
+            "pageInfo": {"hasNextPage": has_next_comments, "endCursor": "k1"},
+            "nodes": [{"databaseId": i, "body": body} for i, body in comments],
+        }
+    return Mock(
+        json=Mock(return_value={"data": {"repository": {"pullRequest": pull_request}}})
+    )
+
+
+class TestGithubGraphQLPR:
+    @patch("github_pr.Github", **NO_RATE_LIMIT)
+    def test_paginates_only_the_connections_with_more_pages(self, github: Mock) -> None:
+        github_pr = GithubGraphQLPR(
+            repository_name="org/repo", pr_number=7, github_token="token"
+        )
+        pages = [
+            _page(["a", "b"], [(1, "first")], True, False),
+            _page(["c"], None, False, False),
+        ]
+        sent_variables = []
+
+        def _post(url, json, timeout):
+            sent_variables.append(dict(json["variables"]))
+            return pages[len(sent_variables) - 1]
+
+        github_pr._session = Mock(post=Mock(side_effect=_post))
+
+        assert [commit.sha for commit in github_pr.get_pr_commits()] == ["a", "b", "c"]
+        assert [comment.body for comment in github_pr.get_comments()] == ["first"]
+        assert github_pr.get_pr_author_login() == "octocat"
+        assert github_pr.get_head_sha() == "head-sha"
+
+        assert len(sent_variables) == 2
+        assert sent_variables[1]["withCommits"] is True
+        assert sent_variables[1]["withComments"] is False
+        assert sent_variables[1]["commitsCursor"] == "c1"
+        github.return_value.get_repo.return_value.get_pull.assert_not_called()
+
+    @patch("github_pr.Github", **NO_RATE_LIMIT)
+    def test_rate_limited_queries_are_retried(self, github: Mock) -> None:
+        github_pr = GithubGraphQLPR(
+            repository_name="org/repo", pr_number=7, github_token="token"
+        )
+        github_pr._scheduler._sleep = Mock()
+        rate_limited = Mock(
+            headers={"Retry-After": "5"},
+            json=Mock(return_value={"errors": [{"type": "RATE_LIMITED"}]}),
+        )
+        github_pr._session = Mock(
+            post=Mock(side_effect=[rate_limited, _page(["a"], [], False, False)])
+        )
+
+        assert [commit.sha for commit in github_pr.get_pr_commits()] == ["a"]
+        github_pr._scheduler._sleep.assert_called_once_with(5.0)
+        assert github_pr._session.post.call_args.kwargs["timeout"] == 60
@@ -0,0 +1,148 @@
+import io
+import tarfile
+from unittest.mock import MagicMock, Mock, patch
+
+from github_pr import GithubPR
+
+# PyGithub reports (-1, -1) until it gets a response with the rate limit headers
+NO_RATE_LIMIT = {"return_value.requester.rate_limiting": (-1, -1)}
+
+
+def _tarball(files: dict) -> bytes:
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w:gz") as archive:
+        for name, content in files.items():
+            info = tarfile.TarInfo(name=f"org-repo-abc123/{name}")
+            info.size = len(content)
+            archive.addfile(info, io.BytesIO(content))
+    return buffer.getvalue()
+
+
+class TestGithubPR:
+    @patch("github_pr.Github", **NO_RATE_LIMIT)
+    def test_pull_request_is_fetched_only_once(self, github: Mock) -> None:
+        repository = github.return_value.get_repo.return_value
+        repository.get_pull.return_value = Mock(
+            title="My PR",
+            user=Mock(login="octocat"),
+            head=Mock(sha="head-sha"),
+            base=Mock(sha="base-sha"),
+            get_files=Mock(return_value=[]),
+            get_issue_comments=Mock(return_value=[]),
+        )
+        github_pr = GithubPR(repository_name="org/repo", pr_number=1, github_token="")
+
+        assert github_pr.get_pr_title() == "My PR"
+        assert github_pr.get_pr_author_login() == "octocat"
+        assert github_pr.get_head_sha() == "head-sha"
+        github_pr.get_files()
+        github_pr.get_comments()
+        github_pr.add_comments(["first", "second"])
+
+        repository.get_pull.assert_called_once_with(1)
+
+    @patch("github_pr.Github", **NO_RATE_LIMIT)
+    def test_list_reads_are_not_nested(self, github: Mock) -> None:
+        github_pr = GithubPR(repository_name="org/repo", pr_number=1, github_token="")
+        read = github_pr._scheduler.read
+        depths = []
+        active = []
+
+        def nested_read(function, *args, **kwargs):
+            active.append(function)
+            depths.append(len(active))
+            try:
+                return read(function, *args, **kwargs)
+            finally:
+                active.pop()
+
+        github_pr._scheduler.read = nested_read
+        github_pr.get_files()
+        github_pr.get_comments()
+        github_pr.get_pr_commits()
+        github_pr.get_reviews()
+
+        # The pull request fetch and the four lists, each in its own read
+        assert depths == [1, 1, 1, 1, 1]
+
+    @patch("github_pr.Github", **NO_RATE_LIMIT)
+    def test_invalidate_cache_fetches_the_pull_request_again(
+        self, github: Mock
+    ) -> None:
+        repository = github.return_value.get_repo.return_value
+        github_pr = GithubPR(repository_name="org/repo", pr_number=1, github_token="")
+
+        github_pr.get_pr_title()
+        github_pr.invalidate_cache()
+        github_pr.get_pr_title()
+
+        assert repository.get_pull.call_count == 2
+
+    @patch("github_pr.requests.get")
+    @patch("github_pr.Github", **NO_RATE_LIMIT)
+    def test_get_contents_for_files_reads_only_requested_text_files(
+        self, github: Mock, requests_get: Mock
+    ) -> None:
+        response = MagicMock()
+        response.raw = io.BytesIO(
+            _tarball(
+                {
+                    "src/a.py": b"print('a')",
+                    "src/b.py": b"print('b')",
+                    "image.png": b"\x89PNG\xff\xfe",
+                }
+            )
+        )
+        requests_get.return_value.__enter__.return_value = response
+        github_pr = GithubPR(repository_name="org/repo", pr_number=1, github_token="")
+
+        contents = github_pr.get_contents_for_files(
+            ["src/a.py", "image.png", "missing.py"], "abc123"
+        )
+
+        assert contents == {"src/a.py": "print('a')"}
+        github.return_value.get_repo.return_value.get_archive_link.assert_called_once_with(
+            "tarball", ref="abc123"
+        )
+
+    @patch("github_pr.Github", **NO_RATE_LIMIT)
+    def test_changed_files_are_only_returned_for_linear_history(
+        self, github: Mock
+    ) -> None:
+        repository = github.return_value.get_repo.return_value
+        github_pr = GithubPR(repository_name="org/repo", pr_number=1, github_token="")
+        files = [Mock(filename="a.py")]
+
+        repository.compare.return_value = Mock(
+            status="ahead", commits=[Mock(parents=[Mock()])], files=files
+        )
+        assert github_pr.get_changed_files("old", "new") == files
+        repository.compare.assert_called_with("old", "new")
+
+        repository.compare.return_value = Mock(
+            status="ahead", commits=[Mock(parents=[Mock(), Mock()])], files=files
+        )
+        assert github_pr.get_changed_files("old", "new") is None
+
+        repository.compare.return_value = Mock(status="diverged")
+        assert github_pr.get_changed_files("old", "new") is None
+
+    @patch("github_pr.Github", **NO_RATE_LIMIT)
+    def test_update_comments_edits_deletes_and_creates_in_order(
+        self, github: Mock
+    ) -> None:
+        pull_request = github.return_value.get_repo.return_value.get_pull.return_value
+        github_pr = GithubPR(repository_name="org/repo", pr_number=1, github_token="")
+        edited, deleted = Mock(), Mock()
+
+        github_pr.update_comments(
+            edited=[(edited, "new body")],
+            created=["first", "second"],
+            deleted=[deleted],
+        )
+
+        edited.edit.assert_called_once_with("new body")
+        deleted.delete.assert_called_once_with()
+        assert [
+            call.args for call in pull_request.create_issue_comment.call_args_list
+        ] == [("first",), ("second",)]
@@ -0,0 +1,86 @@
+import time
+from unittest.mock import Mock
+
+import pytest
+from github import GithubException
+
+from github_scheduler import GithubRequestScheduler
+
+
+class TestGithubRequestScheduler:
+    def test_secondary_rate_limit_is_retried_after_the_given_delay(self) -> None:
+        sleep = Mock()
+        scheduler = GithubRequestScheduler(sleep=sleep)
+        function = Mock(
+            side_effect=[
+                GithubException(
+                    403,
+                    {"message": "You have exceeded a secondary rate limit"},
+                    {"Retry-After": "7"},
+                ),
+                "done",
+            ]
+        )
+
+        assert scheduler.write(function, "body") == "done"
+        assert function.call_count == 2
+        sleep.assert_called_once_with(7.0)
+
+    def test_errors_that_are_not_rate_limits_are_raised(self) -> None:
+        sleep = Mock()
+        scheduler = GithubRequestScheduler(sleep=sleep)
+        function = Mock(
+            side_effect=GithubException(403, {"message": "Resource not accessible"})
+        )
+
+        with pytest.raises(GithubException):
+            scheduler.read(function)
+        assert function.call_count == 1
+        sleep.assert_not_called()
+
+    def test_server_errors_are_retried_with_backoff_until_the_limit(self) -> None:
+        sleep = Mock()
+        scheduler = GithubRequestScheduler(sleep=sleep)
+        function = Mock(side_effect=GithubException(502, {"message": "Bad gateway"}))
+
+        with pytest.raises(GithubException):
+            scheduler.read(function)
+        assert function.call_count == GithubRequestScheduler.MAX_RETRIES + 1
+        delays = [call.args[0] for call in sleep.call_args_list]
+        assert all(delay <= GithubRequestScheduler.MAX_DELAY for delay in delays)
+        assert delays[-1] > delays[0]
+
+    def test_creates_are_not_retried_on_server_errors(self) -> None:
+        sleep = Mock()
+        scheduler = GithubRequestScheduler(sleep=sleep)
+        # GitHub may have saved the comment before failing, a retry would duplicate it
+        function = Mock(side_effect=GithubException(502, {"message": "Bad Gateway"}))
+
+        with pytest.raises(GithubException):
+            scheduler.create(function, "body")
+        assert function.call_count == 1
+        sleep.assert_not_called()
+
+    def test_creates_are_retried_when_rate_limited(self) -> None:
+        sleep = Mock()
+        scheduler = GithubRequestScheduler(sleep=sleep)
+        function = Mock(
+            side_effect=[
+                GithubException(
+                    429, {"message": "Too many requests"}, {"Retry-After": "3"}
+                ),
+                "created",
+            ]
+        )
+
+        assert scheduler.create(function, "body") == "created"
+        sleep.assert_called_once_with(3.0)
+
+    def test_exhausted_budget_waits_for_the_reset(self) -> None:
+        sleep = Mock()
+        scheduler = GithubRequestScheduler(sleep=sleep)
+        scheduler.observe(remaining=0, limit=5000, reset_at=time.time() + 30)
+
+        scheduler.read(Mock())
+
+        assert 25 < sleep.call_args.args[0] <= 30
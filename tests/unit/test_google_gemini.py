@@ -0,0 +1,98 @@
+from unittest.mock import Mock, patch
+
+from google.genai import errors
+
+from google_gemini import GoogleGemini
+
+
+def _gemini() -> GoogleGemini:
+    return GoogleGemini(
+        github_pr=Mock(),
+        ignore_files_with_content=[],
+        ignore_files_in_paths=[],
+        google_gemini_token="token",
+        instructions=[],
+    )
+
+
+class TestGoogleGemini:
+    def test_instructions_are_sent_as_system_instruction(self):
+        client = _gemini()
+        instructions = client._get_instructions_for_file(
+            Mock(file=Mock(filename="src/main.py", status="modified"))
+        )
+
+        config = client._get_generate_content_config(instructions)
+
+        assert instructions in config.system_instruction
+        assert config.cached_content is None
+        # The prefix doesn't change with the file, so the provider can cache it
+        assert "src/main.py" not in config.system_instruction
+
+    def test_long_instructions_are_cached_once(self):
+        client = _gemini()
+        client._client = Mock()
+        client._client.caches.create.return_value.name = "cachedContents/1"
+        instructions = "word " * (GoogleGemini.CACHED_CONTENT_MIN_TOKENS * 2)
+
+        first = client._get_generate_content_config(instructions)
+        second = client._get_generate_content_config(instructions)
+
+        assert first.cached_content == "cachedContents/1"
+        assert first.system_instruction is None
+        assert second.cached_content == "cachedContents/1"
+        client._client.caches.create.assert_called_once()
+
+    def test_cache_is_recreated_before_it_expires(self):
+        client = _gemini()
+        client._client = Mock()
+        first_cache, second_cache = Mock(), Mock()
+        first_cache.name, second_cache.name = "cachedContents/1", "cachedContents/2"
+        client._client.caches.create.side_effect = [first_cache, second_cache]
+        instructions = "word " * (GoogleGemini.CACHED_CONTENT_MIN_TOKENS * 2)
+
+        with patch("google_gemini.time.monotonic", return_value=1000.0):
+            first = client._get_cached_content(instructions)
+        about_to_expire = 1000.0 + GoogleGemini.CACHED_CONTENT_TTL_SECONDS - 30
+        with patch("google_gemini.time.monotonic", return_value=about_to_expire):
+            second = client._get_cached_content(instructions)
+
+        assert first == "cachedContents/1"
+        assert second == "cachedContents/2"
+
+    def test_missing_cache_falls_back_to_the_system_instruction(self):
+        client = _gemini()
+        client._client = Mock()
+        cache = Mock()
+        cache.name = "cachedContents/1"
+        client._client.caches.create.side_effect = [cache, Exception("quota exceeded")]
+        client._client.models.generate_content.side_effect = [
+            errors.ClientError(404, {"error": {"message": "not found"}}),
+            Mock(text="review"),
+        ]
+        instructions = "word " * (GoogleGemini.CACHED_CONTENT_MIN_TOKENS * 2)
+
+        assert client._request_review(instructions, "input") == "review"
+        configs = [
+            call.kwargs["config"]
+            for call in client._client.models.generate_content.call_args_list
+        ]
+        assert configs[0].cached_content == "cachedContents/1"
+        assert configs[1].cached_content is None
+        assert instructions in configs[1].system_instruction
+
+    def test_input_budget_counts_the_system_instruction(self):
+        client = _gemini()
+        instructions = "Review this file."
+
+        limit = client._get_input_tokens_limit(instructions)
+
+        system_instruction = client._get_system_instruction(instructions)
+        assert limit == (
+            GoogleGemini.MAX_TOKENS
+            - client._token_counter.count(system_instruction)
+            - GoogleGemini.RESERVED_OUTPUT_TOKENS
+        )
+        assert client._token_counter.count(system_instruction) > (
+            client._token_counter.count(instructions)
+        )
@@ -0,0 +1,27 @@
+from instruction_template import FILE_NAME_SLOT, FILE_SUFFIX_SLOT, InstructionTemplate
+
+
+class TestInstructionTemplate:
+    def test_render_fills_the_slots(self):
+        template = InstructionTemplate("Review {file_name}, a {file_suffix} file.")
+
+        assert template.slots == {FILE_NAME_SLOT, FILE_SUFFIX_SLOT}
+        assert (
+            template.render(file_name="src/main.py", file_suffix=".py")
+            == "Review src/main.py, a .py file."
+        )
+
+    def test_render_keeps_other_braces(self):
+        template = InstructionTemplate('Use {"key": 1} and {other} in {file_suffix}')
+
+        assert template.slots == {FILE_SUFFIX_SLOT}
+        assert (
+            template.render(file_suffix=".json")
+            == 'Use {"key": 1} and {other} in .json'
+        )
+
+    def test_render_without_slots_returns_the_text(self):
+        template = InstructionTemplate("Review this file.")
+
+        assert template.slots == set()
+        assert template.render(file_name="a.py") == "Review this file."
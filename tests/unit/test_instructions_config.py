@@ -0,0 +1,54 @@
+import pytest
+
+from ai_assistent import HUNKS_CONTEXT, FileInstructions
+from instructions_config import load_file_instructions
+
+
+class TestLoadFileInstructions:
+    def test_load_file_instructions(self, tmp_path):
+        path = tmp_path / "instructions.toml"
+        path.write_text(
+            """
+[[instructions]]
+file_match = "migrations/*.sql"
+specifics = "Check the locks."
+context_mode = "hunks"
+context_lines = 5
+
+[[instructions]]
+file_match = "docs/*"
+instructions = "Review the docs in {file_name}."
+"""
+        )
+
+        assert load_file_instructions(str(path)) == [
+            FileInstructions(
+                file_match="migrations/*.sql",
+                specifics="Check the locks.",
+                context_mode=HUNKS_CONTEXT,
+                context_lines=5,
+            ),
+            FileInstructions(
+                file_match="docs/*", instructions="Review the docs in {file_name}."
+            ),
+        ]
+
+    @pytest.mark.parametrize(
+        "content",
+        (
+            '[[instructions]]\nspecifics = "No file match."',
+            '[[instructions]]\nfile_match = "*.py"',
+            '[[instructions]]\nfile_match = "*.py"\nspecifics = "a"\ninstructions = "b"',
+            '[[instructions]]\nfile_match = "*.py"\nspecifics = "a"\ncontext_mode = "lines"',
+            '[[instructions]]\nfile_match = "*.py"\nspecifics = "a"\nmodel = "gpt"',
+            '[[instructions]]\nfile_match = "*.py"\nspecifics = "a"\ncontext_lines = "5"',
+            '[[instructions]]\nfile_match = "*.py"\nspecifics = "a"\ncontext_lines = -1',
+            'instructions = ["x"]',
+        ),
+    )
+    def test_load_file_instructions_rejects_invalid_entries(self, tmp_path, content):
+        path = tmp_path / "instructions.toml"
+        path.write_text(f"{content}\n")
+
+        with pytest.raises(ValueError):
+            load_file_instructions(str(path))
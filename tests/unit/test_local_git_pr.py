@@ -0,0 +1,71 @@
+import subprocess
+from pathlib import Path
+from unittest.mock import Mock, patch
+
+import pytest
+
+from local_git_pr import LocalGitPR
+
+# PyGithub reports (-1, -1) until it gets a response with the rate limit headers
+NO_RATE_LIMIT = {"return_value.requester.rate_limiting": (-1, -1)}
+
+
+def _git(path: Path, *args: str) -> str:
+    return subprocess.run(
+        ["git", "-c", "user.name=test", "-c", "user.email=test@test", *args],
+        cwd=path,
+        capture_output=True,
+        check=True,
+        text=True,
+    ).stdout.strip()
+
+
+@pytest.fixture
+def repository(tmp_path: Path) -> Path:
+    _git(tmp_path, "init", "-q")
+    (tmp_path / "main.py").write_text("a = 1\nb = 2\n")
+    (tmp_path / "old.md").write_text("old\n")
+    _git(tmp_path, "add", ".")
+    _git(tmp_path, "commit", "-qm", "base")
+    (tmp_path / "main.py").write_text("a = 1\nb = 3\n")
+    _git(tmp_path, "commit", "-qam", "change main")
+    (tmp_path / "new.py").write_text("c = 4\n")
+    (tmp_path / "old.md").unlink()
+    _git(tmp_path, "add", "-A")
+    _git(tmp_path, "commit", "-qm", "add new")
+    return tmp_path
+
+
+class TestLocalGitPR:
+    @patch("github_pr.Github", **NO_RATE_LIMIT)
+    def test_reads_files_commits_and_contents_from_checkout(
+        self, github: Mock, repository: Path
+    ) -> None:
+        github_pr = LocalGitPR(
+            repository_name="org/repo",
+            pr_number=1,
+            github_token="",
+            repository_path=str(repository),
+            base_sha=_git(repository, "rev-parse", "HEAD~2"),
+            head_sha=_git(repository, "rev-parse", "HEAD"),
+        )
+
+        files = {file.filename: file for file in github_pr.get_files()}
+        commits = github_pr.get_pr_commits()
+        contents = github_pr.get_contents_for_files(
+            ["main.py", "new.py", "old.md"], github_pr.get_head_sha()
+        )
+
+        assert {name: file.status for name, file in files.items()} == {
+            "main.py": "modified",
+            "new.py": "added",
+            "old.md": "removed",
+        }
+        assert files["main.py"].patch == "@@ -1,2 +1,2 @@\n a = 1\n-b = 2\n+b = 3"
+        assert [[file.filename for file in commit.files] for commit in commits] == [
+            ["main.py"],
+            ["new.py", "old.md"],
+        ]
+        assert contents == {"main.py": "a = 1\nb = 3\n", "new.py": "c = 4\n"}
+        assert github_pr.get_content_for_file(files["new.py"], commits[-1]) == "c = 4\n"
+        github.return_value.get_repo.return_value.get_pull.assert_not_called()
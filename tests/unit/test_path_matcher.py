@@ -0,0 +1,63 @@
+import fnmatch
+
+import pytest
+
+from path_matcher import GITIGNORE_STYLE, PathMatcher
+
+
+class TestPathMatcher:
+    @pytest.mark.parametrize(
+        "path",
+        (
+            "src/main.py",
+            "README.md",
+            "docs/guide.md",
+            "Makefile",
+            "a/b/c.tar.gz",
+            "poetry.lock",
+        ),
+    )
+    def test_fnmatch_style_returns_the_first_pattern_like_fnmatch(
+        self, path: str
+    ) -> None:
+        patterns = ["*.py", "*.md", "*.*", "*"]
+        expected = next(
+            index
+            for index, pattern in enumerate(patterns)
+            if fnmatch.fnmatch(path, pattern)
+        )
+
+        assert PathMatcher(patterns).find(path) == expected
+
+    @pytest.mark.parametrize(
+        "path, result",
+        (
+            ("poetry.lock", True),
+            ("services/api/poetry.lock", True),
+            ("vendor/lib/module.py", True),
+            ("vendor/keep/module.py", False),
+            ("src/vendor/module.py", False),
+            ("docs/api/index.md", True),
+            ("docs/index.md", True),
+            ("src/docs.md", False),
+            ("build/output.js", True),
+            ("src/build/output.js", True),
+            ("src/main.py", False),
+        ),
+    )
+    def test_gitignore_style(self, path: str, result: bool) -> None:
+        matcher = PathMatcher(
+            [
+                "poetry.lock",
+                "/vendor/",
+                "!vendor/keep/**",
+                "docs/**/*.md",
+                "build",
+            ],
+            style=GITIGNORE_STYLE,
+        )
+
+        assert matcher.match(path) == result
+
+    def test_no_patterns_never_match(self) -> None:
+        assert PathMatcher([]).match("src/main.py") is False
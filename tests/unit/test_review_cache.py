@@ -0,0 +1,177 @@
+import os
+from unittest.mock import Mock
+
+from ai_assistent import FileInstructions, LatestFile
+from conftest import StubAiAssistent
+from review_cache import (
+    CacheEntry,
+    FileSystemCacheBackend,
+    ReviewCache,
+    SQLiteCacheBackend,
+)
+
+
+class TestReviewCache:
+    def test_get_returns_what_was_set(self, tmp_path) -> None:
+        cache = ReviewCache(FileSystemCacheBackend(str(tmp_path)))
+        key = ReviewCache.get_key("sha", "instructions", "model")
+
+        assert cache.get(key) is None
+        cache.set(key, "response")
+        assert cache.get(key) == "response"
+        assert ReviewCache(FileSystemCacheBackend(str(tmp_path))).get(key) == "response"
+
+    def test_least_recently_used_entries_are_evicted(self, tmp_path) -> None:
+        cache = ReviewCache(FileSystemCacheBackend(str(tmp_path), max_size_bytes=200))
+        cache.set("first", "a" * 50)
+        cache.set("second", "b" * 50)
+        os.utime(tmp_path / "first.json", (1, 1))
+        os.utime(tmp_path / "second.json", (2, 2))
+        cache.get("first")
+
+        cache.set("third", "c" * 50)
+
+        assert cache.get("first") is not None
+        assert cache.get("second") is None
+        assert cache.get("third") is not None
+
+    def test_expired_entries_are_ignored(self) -> None:
+        backend = SQLiteCacheBackend(":memory:")
+        backend.set("old", CacheEntry(response="old response", created_at=0))
+        cache = ReviewCache(backend, ttl_seconds=3600)
+        cache.set("new", "new response")
+
+        assert cache.get("old") is None
+        assert cache.get("new") == "new response"
+        assert ReviewCache(backend).get("old") == "old response"
+
+    def test_shared_cache_reuses_reviews_of_the_same_change(self) -> None:
+        shared_review_cache = ReviewCache(SQLiteCacheBackend(":memory:"))
+
+        def create_client() -> StubAiAssistent:
+            return StubAiAssistent(
+                github_pr=Mock(),
+                ignore_files_with_content=[],
+                ignore_files_in_paths=[],
+                instructions=[],
+                shared_review_cache=shared_review_cache,
+            )
+
+        def create_file(sha: str, content: str) -> LatestFile:
+            return LatestFile(
+                file=Mock(
+                    filename="vendor/lib.py", status="modified", sha=sha, patch="+bump"
+                ),
+                commit=Mock(),
+                _content=content,
+            )
+
+        first_client = create_client()
+        first_client._generate_comment(create_file("sha-1", "bump"), "instructions")
+        second_client = create_client()
+        second_client._generate_comment(create_file("sha-2", "bump"), "instructions")
+        # Same hunk in another file, the AI sees a different file
+        second_client._generate_comment(create_file("sha-3", "other"), "instructions")
+
+        assert first_client.requests == 1
+        assert second_client.requests == 1
+
+    def test_shared_cache_key_uses_the_context_of_the_file(self) -> None:
+        shared_review_cache = ReviewCache(SQLiteCacheBackend(":memory:"))
+        content = "".join(f"line {number}\n" for number in range(1, 31))
+        patch = "@@ -15,1 +15,1 @@\n-old\n+line 15"
+
+        def review(**kwargs) -> int:
+            client = StubAiAssistent(
+                github_pr=Mock(),
+                ignore_files_with_content=[],
+                ignore_files_in_paths=[],
+                instructions=[],
+                shared_review_cache=shared_review_cache,
+                **kwargs,
+            )
+            latest_file = LatestFile(
+                file=Mock(
+                    filename="vendor/lib.py", status="modified", sha="sha", patch=patch
+                ),
+                commit=Mock(),
+                _content=content,
+            )
+            client._generate_comment(latest_file, "instructions")
+            return client.requests
+
+        assert review(context_mode="hunks", context_lines=10) == 1
+        assert review(context_mode="hunks", context_lines=3) == 1
+        assert review() == 1
+        # The defaults are full, but the instructions of the file ask for hunks
+        assert (
+            review(
+                file_instructions=[
+                    FileInstructions(
+                        "vendor/*",
+                        specifics="x",
+                        context_mode="hunks",
+                        context_lines=10,
+                    )
+                ]
+            )
+            == 0
+        )
+
+    def test_cached_review_is_not_requested_again(self, tmp_path) -> None:
+        def create_client() -> StubAiAssistent:
+            return StubAiAssistent(
+                github_pr=Mock(),
+                ignore_files_with_content=[],
+                ignore_files_in_paths=[],
+                instructions=[],
+                review_cache=ReviewCache(FileSystemCacheBackend(str(tmp_path))),
+            )
+
+        latest_file = LatestFile(
+            file=Mock(filename="a.py", status="modified", sha="blob-sha", patch=""),
+            commit=Mock(),
+            _content="print(1)",
+        )
+        first_client = create_client()
+        first = first_client._generate_comment(latest_file, "instructions")
+        second_client = create_client()
+        second = second_client._generate_comment(latest_file, "instructions")
+        second_client._generate_comment(latest_file, "other instructions")
+
+        assert first == second
+        assert first_client.requests == 1
+        assert second_client.requests == 1
+
+    def test_files_with_a_cached_review_are_not_downloaded(self, tmp_path) -> None:
+        github_pr = Mock()
+        github_pr.get_contents_for_files.return_value = {"b.py": "print(2)"}
+        client = StubAiAssistent(
+            github_pr=github_pr,
+            ignore_files_with_content=[],
+            ignore_files_in_paths=[],
+            instructions=[],
+            bulk_content_download=True,
+            review_cache=ReviewCache(FileSystemCacheBackend(str(tmp_path))),
+        )
+
+        def create_file(name: str, content=None) -> LatestFile:
+            return LatestFile(
+                file=Mock(filename=name, status="modified", sha=f"sha-{name}"),
+                commit=Mock(sha="head"),
+                _content=content,
+            )
+
+        cached = create_file("a.py", "print(1)")
+        client._store_review(
+            cached, client._get_instructions_for_file(cached), "Looks wrong"
+        )
+
+        files = [create_file("a.py"), create_file("b.py")]
+        client._load_file_contents(client._get_files_to_download(files))
+        comments = client._generate_comments(files)
+
+        github_pr.get_contents_for_files.assert_called_once_with(["b.py"], "head")
+        github_pr.get_content_for_file.assert_not_called()
+        assert len(comments) == 2
+        assert client.requests == 1
@@ -0,0 +1,34 @@
+from unittest.mock import patch
+
+from token_counter import ApproximateTokenCounter, TiktokenTokenCounter
+
+
+class TestTokenCounter:
+    def test_approximate_counts_symbols_and_long_words(self) -> None:
+        counter = ApproximateTokenCounter()
+
+        # "def", "(", ")", ":" and "pass" are one token each, the long name is three
+        assert counter.count("def a_very_long_name(): pass") == 9
+
+    def test_code_without_spaces_is_not_a_single_token(self) -> None:
+        counter = ApproximateTokenCounter()
+
+        assert counter.count("x=[1,2,3];" * 100) == 1000
+
+    def test_count_stops_once_the_limit_is_exceeded(self) -> None:
+        counter = ApproximateTokenCounter()
+        content = "word " * 100_000
+
+        with patch.object(
+            counter, "_count_chunk", wraps=counter._count_chunk
+        ) as count_chunk:
+            result = counter.count(content, limit=10)
+
+        assert result > 10
+        assert count_chunk.call_count == 1
+
+    @patch("token_counter._get_encoding", return_value=None)
+    def test_tiktoken_counter_falls_back_to_the_approximation(self, _) -> None:
+        assert TiktokenTokenCounter("gpt-3.5-turbo").count(
+            "def main(): pass"
+        ) == ApproximateTokenCounter().count("def main(): pass")